@@ -0,0 +1,92 @@
+import argparse
+import statistics
+import time
+
+from bench.results import write_result
+from bench.synthetic import SyntheticLog
+
+
+def _time(fn, entries, repeat):
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        decoded = fn(entries)
+        runs.append(time.perf_counter() - start)
+    best = min(runs)
+    return {
+        "entries": len(entries),
+        "decoded": decoded,  # rows that came out non-empty; a drop means a decode regression, not a speedup
+        "best_seconds": best,
+        "median_seconds": statistics.median(runs),
+        "entries_per_second": len(entries) / best,
+        "us_per_entry": best / len(entries) * 1e6,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Decode microbenchmarks on synthetic CT log entries")
+    parser.add_argument("--entries", type=int, default=2000, help="Entries decoded per run")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per benchmark; the best run is reported")
+    parser.add_argument("--pool_size", type=int, default=256, help="Distinct certificates in the synthetic log")
+    parser.add_argument("--columns", type=str, default="default",
+                        help="Column selection for the fast_columns benchmark, as runner.py --columns")
+    parser.add_argument("--only", type=str, default=None, help="Comma-separated subset of benchmarks to run")
+    parser.add_argument("--output", type=str, default=None, help="JSON result file")
+    args = parser.parse_args()
+
+    from decrypt import (decrypt_ctlog, fill_row, parse_raw_entry_fast, process_certificate, process_ctlog_entry_fast,
+                         process_raw_entry_fast)
+    from fields import extractors, parse_columns
+    from issuers import IssuerCache
+    from transport import pack_entries, unpack_entries
+
+    log = SyntheticLog(pool_size=args.pool_size)
+    entries = log.entries(0, args.entries - 1)
+    packed = pack_entries(entries)
+
+    def fast_packed(entries):
+        cache = IssuerCache()
+        return sum(process_raw_entry_fast(leaf_input, extra_data, cache, i) is not None
+                   for i, (leaf_input, extra_data) in enumerate(unpack_entries(packed)))
+
+    columns = parse_columns(args.columns)
+
+    def fast_columns(entries):
+        # CTLogsProcs' per-entry work: parse, then only the selected extractors, straight into column lists
+        cache = IssuerCache()
+        buffers = {name: [] for name in columns}
+        targets = [(buffers[name], extract) for name, extract in extractors(columns)]
+        decoded = 0
+        for i, (leaf_input, extra_data) in enumerate(unpack_entries(packed)):
+            cert = parse_raw_entry_fast(leaf_input, extra_data, cache, i)
+            decoded += cert is not None and fill_row(targets, cert)
+        return decoded
+
+    def fast_json(entries):
+        cache = IssuerCache()
+        return sum(process_ctlog_entry_fast(e, cache) is not None for e in entries)
+
+    benchmarks = {
+        # the reference path, split into its two stages and end to end
+        "decrypt_ctlog": lambda entries: sum(decrypt_ctlog(e) is not None for e in entries),
+        "process_certificate": lambda entries: sum(process_certificate(d) is not None for d in decrypted),
+        "reference": lambda entries: sum(process_certificate(decrypt_ctlog(e)) is not None for e in entries),
+        "fast_json": fast_json,
+        # what CTLogsProcs runs: packed raw bytes, memoryview slices, issuer cache
+        "fast_packed": fast_packed,
+        "fast_columns": fast_columns,
+        "pack_entries": lambda entries: len(unpack_entries(pack_entries(entries))),
+    }
+    selected = args.only.split(",") if args.only else list(benchmarks)
+    # process_certificate decodes the output of decrypt_ctlog, which needs certlib; build it only when it runs
+    decrypted = [decrypt_ctlog(e) for e in entries] if "process_certificate" in selected else None
+    results = {}
+    for name in selected:
+        results[name] = _time(benchmarks[name], entries, args.repeat)
+        print(f"{name:>20}: {results[name]['entries_per_second']:>10.0f} entries/s "
+              f"({results[name]['us_per_entry']:.1f} us/entry, {results[name]['decoded']} decoded)")
+    write_result("decode", vars(args), results, args.output)
+
+
+if __name__ == "__main__":
+    main()
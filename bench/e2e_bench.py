@@ -0,0 +1,117 @@
+import argparse
+import time
+from multiprocessing import Process, Value
+
+from bench.mock_server import MockCTServer
+from bench.results import write_result
+
+
+class FakeClickHouseClient:
+    """Accepts inserts without a server, taking `latency` seconds plus `per_row` seconds per row."""
+
+    def __init__(self, latency=0.02, per_row=0.0):
+        self.latency = latency
+        self.per_row = per_row
+
+    def insert(self, table, data, column_names=None, column_oriented=False, settings=None):
+        rows = len(data[0]) if column_oriented and data else len(data)
+        time.sleep(self.latency + rows * self.per_row)
+
+    def command(self, *args, **kwargs):
+        pass
+
+    def close(self):
+        pass
+
+
+def fake_consumer_process(buffer, total_procs, decode_mode, insert_rows, insert_latency, insert_per_row, columns="default"):
+    from decrypt import CTLogsProcs
+    from fields import parse_columns
+    from sinks import ClickHouseSink
+
+    columns = parse_columns(columns)
+    sink = ClickHouseSink(FakeClickHouseClient(insert_latency), FakeClickHouseClient(insert_latency, insert_per_row),
+                          columns, max_rows=insert_rows, max_age=0.5)
+    CTLogsProcs(buffer, total_procs, decode_mode=decode_mode, sink=sink, columns=columns).start_processing()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end entries/s of the runner.py pipeline against a local mock log")
+    parser.add_argument("--entries", type=int, default=50_000, help="Entries to ingest")
+    parser.add_argument("--num_consumers", type=int, default=3)
+    parser.add_argument("--transport", type=str, choices=["queue", "shm"], default="queue")
+    parser.add_argument("--fetch_mode", type=str, choices=["thread", "pool"], default="pool")
+    parser.add_argument("--rate_control", type=str, choices=["aimd", "stagger"], default="aimd")
+    parser.add_argument("--max_in_flight", type=int, default=16)
+    parser.add_argument("--batch_size", type=int, default=512)
+    parser.add_argument("--decode_mode", type=str, choices=["fast", "reference"], default="fast")
+    parser.add_argument("--insert_rows", type=int, default=100_000)
+    parser.add_argument("--columns", type=str, default="default", help="Certs columns extracted, as runner.py --columns")
+    parser.add_argument("--insert_latency", type=float, default=0.02, help="Seconds per fake ClickHouse insert")
+    parser.add_argument("--insert_per_row", type=float, default=0.0, help="Extra fake insert seconds per row")
+    parser.add_argument("--latency", type=float, default=0.05, help="Mock log get-entries latency")
+    parser.add_argument("--jitter", type=float, default=0.02)
+    parser.add_argument("--page_cap", type=int, default=256)
+    parser.add_argument("--throttle_rate", type=float, default=0.0)
+    parser.add_argument("--error_rate", type=float, default=0.0)
+    parser.add_argument("--retry_after", type=int, default=1)
+    parser.add_argument("--tamper_rate", type=float, default=0.0, help="Mock log responses with one corrupted leaf")
+    parser.add_argument("--verify_merkle", action="store_true", help="Verify fetched leaves against the tree head")
+    parser.add_argument("--timeout", type=float, default=600, help="Give up after this many seconds")
+    parser.add_argument("--output", type=str, default=None, help="JSON result file")
+    args = parser.parse_args()
+
+    from runner import producer_process
+    from transport import QueueTransport, ShmRingTransport
+
+    server = MockCTServer(tree_size=args.entries, latency=args.latency, jitter=args.jitter, page_cap=args.page_cap,
+                          throttle_rate=args.throttle_rate, error_rate=args.error_rate,
+                          retry_after=args.retry_after, tamper_rate=args.tamper_rate).start()
+    buffer = ShmRingTransport() if args.transport == "shm" else QueueTransport()
+    total_entries = Value('i', 0)
+    total_procs = Value('i', 0)
+
+    consumers = [Process(target=fake_consumer_process,
+                         args=(buffer, total_procs, args.decode_mode, args.insert_rows, args.insert_latency,
+                               args.insert_per_row, args.columns),
+                         daemon=True)
+                 for _ in range(args.num_consumers)]
+    for c in consumers:
+        c.start()
+    start = time.time()
+    producer = Process(target=producer_process,
+                       args=(server.url, buffer, total_entries, 0, args.entries, args.fetch_mode, args.max_in_flight,
+                             args.rate_control, 0.01, None, args.batch_size),
+                       kwargs={"verify": args.verify_merkle}, daemon=True)
+    producer.start()
+
+    fetched_at = None
+    while total_procs.value < args.entries and time.time() - start < args.timeout:
+        time.sleep(0.05)
+        if fetched_at is None and total_entries.value >= args.entries:
+            fetched_at = time.time()
+    elapsed = time.time() - start
+
+    producer.terminate()
+    for c in consumers:
+        c.terminate()
+    for p in [producer] + consumers:
+        p.join()
+    server.stop()
+    if args.transport == "shm":
+        buffer.close(unlink=True)
+
+    results = {
+        "completed": total_procs.value >= args.entries,
+        "entries_fetched": total_entries.value,
+        "entries_committed": total_procs.value,
+        "seconds": elapsed,
+        "entries_per_second": total_procs.value / elapsed,
+        "fetch_seconds": (fetched_at - start) if fetched_at else None,
+        "server": server.stats,
+    }
+    write_result("e2e", vars(args), results, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+import argparse
+import base64
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from bench.synthetic import SyntheticLog
+from merkle import EMPTY_ROOT, leaf_hash, node_hash
+
+
+class MockCTServer:
+    """Local RFC 6962 log serving `get-sth`, `get-entries`, `get-sth-consistency` and `get-entry-and-proof`
+    from a SyntheticLog.
+
+    Every get-entries response is delayed by `latency` seconds (plus up to
+    `jitter`), truncated to `page_cap` entries like real logs, answered with
+    429 and `Retry-After: retry_after` with probability `throttle_rate`, and
+    with 500 with probability `error_rate`. With probability `tamper_rate` one
+    leaf of a response has a byte flipped, which Merkle verification must
+    catch. `grow_per_second` makes the tree grow for follow-mode runs. Request
+    counts are kept in `stats`.
+
+    Tree heads carry real Merkle roots. The synthetic log repeats its pool of
+    entries, so subtree hashes are cached by their position modulo the pool
+    and roots and proofs of large trees stay cheap.
+    """
+
+    def __init__(self, tree_size=100_000, latency=0.05, jitter=0.0, page_cap=256, throttle_rate=0.0, error_rate=0.0,
+                 retry_after=1, grow_per_second=0, host="127.0.0.1", port=0, log=None, seed=None, tamper_rate=0.0):
+        self.tree_size = tree_size
+        self.latency = latency
+        self.jitter = jitter
+        self.page_cap = page_cap
+        self.throttle_rate = throttle_rate
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.grow_per_second = grow_per_second
+        self.tamper_rate = tamper_rate
+        self.log = log or SyntheticLog()
+        self.random = random.Random(seed)
+        self.stats = {"sth": 0, "entries": 0, "entries_served": 0, "throttled": 0, "errors": 0, "tampered": 0}
+        self.subtrees = {}
+        self.lock = threading.Lock()
+        self.started_at = time.time()
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def current_size(self):
+        return self.tree_size + int((time.time() - self.started_at) * self.grow_per_second)
+
+    def start(self):
+        self.started_at = time.time()
+        self.thread = threading.Thread(target=self.server.serve_forever, name="mock-ct", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _perfect(self, level, index):
+        """Hash of the perfect subtree of `2**level` leaves starting at leaf `index * 2**level`."""
+        pool = len(self.log.pool)
+        start = index << level
+        if pool & (pool - 1) == 0:  # a power-of-two pool repeats whole subtrees
+            start %= max(pool, 1 << level)
+        key = (level, start)
+        h = self.subtrees.get(key)
+        if h is None:
+            if level == 0:
+                h = leaf_hash(base64.b64decode(self.log.entry(start)["leaf_input"]))
+            else:
+                h = node_hash(self._perfect(level - 1, 2 * (start >> level)), self._perfect(level - 1, 2 * (start >> level) + 1))
+            self.subtrees[key] = h
+        return h
+
+    def subtree_hash(self, start, size):
+        """MTH of the leaves `[start, start + size)`, with `start` aligned as in RFC 6962 trees."""
+        if size == 0:
+            return EMPTY_ROOT
+        if size & (size - 1) == 0 and start % size == 0:
+            return self._perfect(size.bit_length() - 1, start // size)
+        k = 1 << ((size - 1).bit_length() - 1)  # largest power of two below size
+        return node_hash(self.subtree_hash(start, k), self.subtree_hash(start + k, size - k))
+
+    def audit_path(self, index, start, size):
+        if size == 1:
+            return []
+        k = 1 << ((size - 1).bit_length() - 1)
+        if index < start + k:
+            return self.audit_path(index, start, k) + [self.subtree_hash(start + k, size - k)]
+        return self.audit_path(index, start + k, size - k) + [self.subtree_hash(start, k)]
+
+    def consistency(self, first, start, size, complete=True):
+        if first == size:
+            return [] if complete else [self.subtree_hash(start, size)]
+        k = 1 << ((size - 1).bit_length() - 1)
+        if first <= k:
+            return self.consistency(first, start, k, complete) + [self.subtree_hash(start + k, size - k)]
+        return self.consistency(first - k, start + k, size - k, False) + [self.subtree_hash(start, k)]
+
+    def _count(self, key, n=1):
+        with self.lock:
+            self.stats[key] += n
+
+    def _roll(self, rate):
+        with self.lock:
+            return rate and self.random.random() < rate
+
+    def _handler(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keep-alive, like real logs
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send(self, status, body=None, headers=()):
+                data = json.dumps(body).encode() if body is not None else b""
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in headers:
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                query = parse_qs(url.query)
+                if url.path.endswith("/ct/v1/get-sth"):
+                    mock._count("sth")
+                    size = mock.current_size()
+                    self._send(200, {"tree_size": size, "timestamp": int(time.time() * 1000),
+                                     "sha256_root_hash": b64(mock.subtree_hash(0, size)), "tree_head_signature": ""})
+                    return
+                if url.path.endswith("/ct/v1/get-sth-consistency"):
+                    try:
+                        first, second = int(query["first"][0]), int(query["second"][0])
+                    except (KeyError, ValueError):
+                        self._send(400, {"error": "first and second are required"})
+                        return
+                    if not 0 < first <= second <= mock.current_size():
+                        self._send(400, {"error": "bad tree sizes"})
+                        return
+                    proof = mock.consistency(first, 0, second) if first < second else []
+                    self._send(200, {"consistency": [b64(h) for h in proof]})
+                    return
+                if url.path.endswith("/ct/v1/get-entry-and-proof"):
+                    try:
+                        index, size = int(query["leaf_index"][0]), int(query["tree_size"][0])
+                    except (KeyError, ValueError):
+                        self._send(400, {"error": "leaf_index and tree_size are required"})
+                        return
+                    if not 0 <= index < size <= mock.current_size():
+                        self._send(400, {"error": "bad leaf index or tree size"})
+                        return
+                    entry = dict(mock.log.entry(index), audit_path=[b64(h) for h in mock.audit_path(index, 0, size)])
+                    self._send(200, entry)
+                    return
+                if not url.path.endswith("/ct/v1/get-entries"):
+                    self._send(404, {"error": "not found"})
+                    return
+
+                mock._count("entries")
+                if mock.latency or mock.jitter:
+                    time.sleep(mock.latency + mock.random.uniform(0, mock.jitter))
+                if mock._roll(mock.throttle_rate):
+                    mock._count("throttled")
+                    self._send(429, {"error": "rate limited"}, [("Retry-After", str(mock.retry_after))])
+                    return
+                if mock._roll(mock.error_rate):
+                    mock._count("errors")
+                    self._send(500, {"error": "injected"})
+                    return
+                try:
+                    start, end = int(query["start"][0]), int(query["end"][0])
+                except (KeyError, ValueError):
+                    self._send(400, {"error": "start and end are required"})
+                    return
+                size = mock.current_size()
+                if start < 0 or start > end or start >= size:
+                    self._send(400, {"error": "bad range"})
+                    return
+                end = min(end, size - 1, start + mock.page_cap - 1)
+                mock._count("entries_served", end - start + 1)
+                entries = mock.log.entries(start, end)
+                if mock._roll(mock.tamper_rate):
+                    mock._count("tampered")
+                    i = mock.random.randrange(len(entries))
+                    leaf = bytearray(base64.b64decode(entries[i]["leaf_input"]))
+                    leaf[2] ^= 0xFF  # inside the timestamp, so the entry still decodes
+                    entries[i] = dict(entries[i], leaf_input=base64.b64encode(leaf).decode())
+                self._send(200, {"entries": entries})
+
+        return Handler
+
+
+def b64(data):
+    return base64.b64encode(data).decode()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a synthetic CT log locally")
+    parser.add_argument("--port", type=int, default=8999)
+    parser.add_argument("--tree_size", type=int, default=1_000_000)
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds added to every get-entries response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Extra random latency, up to this many seconds")
+    parser.add_argument("--page_cap", type=int, default=256, help="Maximum entries per get-entries response")
+    parser.add_argument("--throttle_rate", type=float, default=0.0, help="Fraction of get-entries answered with 429")
+    parser.add_argument("--error_rate", type=float, default=0.0, help="Fraction of get-entries answered with 500")
+    parser.add_argument("--retry_after", type=int, default=1, help="Retry-After seconds sent with a 429")
+    parser.add_argument("--grow_per_second", type=int, default=0, help="Entries added to the tree per second")
+    parser.add_argument("--tamper_rate", type=float, default=0.0,
+                        help="Fraction of get-entries responses with one corrupted leaf")
+    args = parser.parse_args()
+
+    server = MockCTServer(args.tree_size, args.latency, args.jitter, args.page_cap, args.throttle_rate,
+                          args.error_rate, args.retry_after, args.grow_per_second, port=args.port,
+                          tamper_rate=args.tamper_rate).start()
+    print(f"Mock CT log at {server.url} ({args.tree_size} entries)")
+    try:
+        while True:
+            time.sleep(10)
+            print(server.stats)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+import json
+import os
+import platform
+import subprocess
+import time
+
+
+def revision():
+    """Short git revision of the tree being measured, with `-dirty` for local changes."""
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def write_result(benchmark, params, results, output=None):
+    """Print a benchmark result and write it as JSON to `output` (default `bench/results/<benchmark>-<time>.json`)."""
+    record = {
+        "benchmark": benchmark,
+        "revision": revision(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "params": params,
+        "results": results,
+    }
+    if output is None:
+        folder = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+        os.makedirs(folder, exist_ok=True)
+        output = os.path.join(folder, f"{benchmark}-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    with open(output, "w") as f:
+        json.dump(record, f, indent=2)
+    print(json.dumps(results, indent=2))
+    print(f"Result written to {output}")
+    return record
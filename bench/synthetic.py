@@ -0,0 +1,101 @@
+import base64
+import datetime
+import hashlib
+import struct
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
+
+
+def _name(common_name, organization=None):
+    attributes = [x509.NameAttribute(NameOID.COUNTRY_NAME, "US")]
+    if organization:
+        attributes.append(x509.NameAttribute(NameOID.ORGANIZATION_NAME, organization))
+    attributes.append(x509.NameAttribute(NameOID.COMMON_NAME, common_name))
+    return x509.Name(attributes)
+
+
+def _u24(n):
+    return n.to_bytes(3, "big")
+
+
+def _asn1_cert(der):
+    return _u24(len(der)) + der
+
+
+def _chain(ders):
+    body = b"".join(_asn1_cert(der) for der in ders)
+    return _u24(len(body)) + body
+
+
+class SyntheticLog:
+    """Valid RFC 6962 `leaf_input`/`extra_data` for a synthetic log.
+
+    A root signs `issuers` intermediates, which sign a pool of `pool_size`
+    leaf certificates (every `precert_every`-th one a pre-certificate with the
+    CT poison extension); entry `i` of the log is pool entry `i % pool_size`.
+    Keys are P-256, so building the pool takes well under a second.
+    """
+
+    def __init__(self, pool_size=256, issuers=4, precert_every=2, seed_time=1_700_000_000_000):
+        self.key = ec.generate_private_key(ec.SECP256R1())
+        not_before = datetime.datetime(2025, 1, 1, tzinfo=datetime.timezone.utc)
+        not_after = datetime.datetime(2035, 1, 1, tzinfo=datetime.timezone.utc)
+        root_name = _name("Bench Root CA", "Bench Trust")
+        root = self._sign(root_name, root_name, 1, not_before, not_after, ca=True)
+        intermediates = [
+            self._sign(_name(f"Bench Issuing CA {i}", "Bench Trust"), root_name, 100 + i, not_before, not_after, ca=True)
+            for i in range(issuers)
+        ]
+        root_der = root.public_bytes(serialization.Encoding.DER)
+        self.pool = []
+        for i in range(pool_size):
+            issuer = intermediates[i % issuers]
+            issuer_der = issuer.public_bytes(serialization.Encoding.DER)
+            host = f"host{i}.bench.example"
+            precert = precert_every and i % precert_every == precert_every - 1
+            leaf_args = (_name(host, f"Bench Org {i % 17}"), issuer.subject, 1000 + i, not_before,
+                         not_after - datetime.timedelta(days=i))
+            sans = [host, f"www.{host}", f"api.{host}"]
+            leaf = self._sign(*leaf_args, sans=sans, precert=precert)
+            leaf_der = leaf.public_bytes(serialization.Encoding.DER)
+            timestamp = struct.pack(">BBQ", 0, 0, seed_time + i)  # version v1, timestamped_entry, timestamp
+            if precert:
+                issuer_key_hash = hashlib.sha256(issuer.public_key().public_bytes(
+                    serialization.Encoding.DER, serialization.PublicFormat.SubjectPublicKeyInfo)).digest()
+                # the PreCert TBSCertificate is the pre-certificate's with the poison extension removed
+                tbs = self._sign(*leaf_args, sans=sans).tbs_certificate_bytes
+                leaf_input = timestamp + struct.pack(">H", 1) + issuer_key_hash + _u24(len(tbs)) + tbs + b"\0\0"
+                extra_data = _asn1_cert(leaf_der) + _chain([issuer_der, root_der])
+            else:
+                leaf_input = timestamp + struct.pack(">H", 0) + _asn1_cert(leaf_der) + b"\0\0"
+                extra_data = _chain([issuer_der, root_der])
+            self.pool.append({
+                "leaf_input": base64.b64encode(leaf_input).decode(),
+                "extra_data": base64.b64encode(extra_data).decode(),
+            })
+
+    def _sign(self, subject, issuer, serial, not_before, not_after, ca=False, sans=(), precert=False):
+        builder = (x509.CertificateBuilder()
+                   .subject_name(subject)
+                   .issuer_name(issuer)
+                   .public_key(self.key.public_key())
+                   .serial_number(serial)
+                   .not_valid_before(not_before)
+                   .not_valid_after(not_after)
+                   .add_extension(x509.BasicConstraints(ca=ca, path_length=None), critical=True))
+        if sans:
+            builder = builder.add_extension(x509.SubjectAlternativeName([x509.DNSName(s) for s in sans]), critical=False)
+        if precert:
+            builder = builder.add_extension(x509.PrecertPoison(), critical=True)
+        return builder.sign(self.key, hashes.SHA256())
+
+    def entry(self, index):
+        """The get-entries JSON object for leaf `index`."""
+        return self.pool[index % len(self.pool)]
+
+    def entries(self, start, end):
+        """get-entries objects for `start..end` inclusive."""
+        return [self.entry(i) for i in range(start, end + 1)]
@@ -0,0 +1,151 @@
+import os
+import sqlite3
+import threading
+
+
+class CheckpointStore:
+    """Durable per-log ingestion progress in a local SQLite file.
+
+    For every log URL it keeps a contiguous `watermark` (every index below it is
+    in ClickHouse), the committed ranges above the watermark that are not yet
+    contiguous with it, and gap records for ranges that were claimed but not
+    committed (`inflight`) or given up on (`failed`). Ranges are inclusive
+    `(start, end)` pairs, like the get-entries API.
+
+    The store is shared by the producer and the consumer processes: it is
+    picklable and opens its own connection lazily in each process.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        return {"path": self.path}
+
+    def __setstate__(self, state):
+        self.__init__(state["path"])
+
+    @property
+    def conn(self):
+        if self._conn is None or self._pid != os.getpid():
+            self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS watermarks (log_url TEXT PRIMARY KEY, watermark INTEGER NOT NULL)")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS committed (log_url TEXT, start INTEGER, end INTEGER)")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS gaps (log_url TEXT, start INTEGER, end INTEGER, state TEXT)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS committed_log ON committed (log_url, start)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS gaps_log ON gaps (log_url, start)")
+            self._pid = os.getpid()
+        return self._conn
+
+    def _watermark(self, log_url):
+        row = self.conn.execute("SELECT watermark FROM watermarks WHERE log_url = ?", (log_url,)).fetchone()
+        return row[0] if row else None
+
+    def watermark(self, log_url):
+        with self._lock:
+            return self._watermark(log_url)
+
+    def mark(self, log_url, start, end, state="inflight"):
+        """Record a claimed (`inflight`) or abandoned (`failed`) range so a restart refills it first."""
+        with self._lock:
+            self.conn.execute("INSERT INTO gaps VALUES (?, ?, ?, ?)", (log_url, start, end, state))
+
+    def commit(self, log_url, start, end):
+        """Record `(start, end)` as durably inserted and advance the watermark over contiguous ranges."""
+        with self._lock:
+            conn = self.conn
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                # trim gap records covered by the committed range
+                overlapping = conn.execute(
+                    "SELECT rowid, start, end, state FROM gaps WHERE log_url = ? AND start <= ? AND end >= ?",
+                    (log_url, end, start)).fetchall()
+                for rowid, g_start, g_end, state in overlapping:
+                    conn.execute("DELETE FROM gaps WHERE rowid = ?", (rowid,))
+                    if g_start < start:
+                        conn.execute("INSERT INTO gaps VALUES (?, ?, ?, ?)", (log_url, g_start, start - 1, state))
+                    if g_end > end:
+                        conn.execute("INSERT INTO gaps VALUES (?, ?, ?, ?)", (log_url, end + 1, g_end, state))
+
+                conn.execute("INSERT INTO committed VALUES (?, ?, ?)", (log_url, start, end))
+                watermark = self._watermark(log_url)
+                if watermark is not None:
+                    while True:
+                        rows = conn.execute("SELECT rowid, end FROM committed WHERE log_url = ? AND start <= ?",
+                                            (log_url, watermark)).fetchall()
+                        if not rows:
+                            break
+                        watermark = max(watermark, max(r[1] for r in rows) + 1)
+                        conn.executemany("DELETE FROM committed WHERE rowid = ?", [(r[0],) for r in rows])
+                    conn.execute("UPDATE watermarks SET watermark = ? WHERE log_url = ?", (watermark, log_url))
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+    def is_committed(self, log_url, start, end):
+        """True if every index of `(start, end)` is below the watermark or in some committed range.
+
+        A range may have been committed in pieces (a batch split across ring
+        slots) and may sit above a failed gap that holds the watermark back.
+        """
+        with self._lock:
+            watermark = self._watermark(log_url)
+            cursor = max(start, watermark) if watermark is not None else start
+            if cursor > end:
+                return True
+            rows = self.conn.execute("SELECT start, end FROM committed WHERE log_url = ? AND start <= ? AND end >= ? "
+                                     "ORDER BY start", (log_url, end, cursor)).fetchall()
+        for c_start, c_end in rows:
+            if c_start > cursor:
+                return False
+            cursor = max(cursor, c_end + 1)
+            if cursor > end:
+                return True
+        return False
+
+    def resume(self, log_url, start_index, end_index):
+        """Return `(pending, next_index)` to seed a RangeScheduler for `[start_index, end_index)`.
+
+        `pending` holds every uncommitted hole below `next_index`, recorded gaps
+        first; everything from `next_index` on was never handed out.
+        """
+        with self._lock:
+            conn = self.conn
+            watermark = self._watermark(log_url)
+            if watermark is None:
+                conn.execute("INSERT INTO watermarks VALUES (?, ?)", (log_url, start_index))
+                watermark = start_index
+            committed = conn.execute("SELECT start, end FROM committed WHERE log_url = ? ORDER BY start",
+                                     (log_url,)).fetchall()
+            gaps = conn.execute("SELECT start, end FROM gaps WHERE log_url = ? ORDER BY start", (log_url,)).fetchall()
+
+        low = max(start_index, watermark)
+        high = max([low] + [e + 1 for _, e in committed + gaps])
+        next_index = min(high, end_index)
+
+        holes = []
+        cursor = low
+        for c_start, c_end in committed:
+            if c_start > cursor:
+                holes.append((cursor, min(c_start, next_index) - 1))
+            cursor = max(cursor, c_end + 1)
+        if cursor < next_index:
+            holes.append((cursor, next_index - 1))
+        holes = [(s, e) for s, e in holes if s <= e]
+
+        def in_gap(hole):
+            return any(g_start <= hole[1] and g_end >= hole[0] for g_start, g_end in gaps)
+
+        pending = [h for h in holes if in_gap(h)] + [h for h in holes if not in_gap(h)]
+        return pending, next_index
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
@@ -1,136 +1,190 @@
-import certlib
 import base64
-from OpenSSL import crypto
-from cryptography import x509
 from cryptography import x509
 from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives import hashes
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from fields import DEFAULT_COLUMNS, CertView, extract, extractors, is_numeric
+from functools import partial
+from issuers import IssuerCache, issuer_fields
+from schema import LazyClient
+from sinks import ClickHouseSink
+from watchlist import JsonlAlertSink, certificate_names, make_alert
 import queue
 import threading
 import time
-import uuid
-import clickhouse_connect
-
-init_client = clickhouse_connect.get_client(
-    host='localhost',
-    port=8123,
-    username='default',
-    password='mysecretpassword',
-    database='default'
-)
-
-# --- Step 1: Create database if it doesn't exist ---
-db_name = 'certs_db'
-init_client.command(f'CREATE DATABASE IF NOT EXISTS {db_name}')
-
-# Step 2: Use the database
-init_client.command(f'USE {db_name}')
-
-# Step 3: Drop the table if it exists
-init_client.command('DROP TABLE IF EXISTS certs')
-
-# Step 4: Create a fresh table
-init_client.command('''
-CREATE TABLE certs (
-    cert_index UInt32,
-    sha1_fingerprint String,
-    issuer_country String,
-    issuer_organization String,
-    issuer_common_name String,
-    subject_country String,
-    subject_state String,
-    subject_organization String,
-    subject_serial_number String,
-    subject_common_name String,
-    san String,
-    subject_business_category String,
-    subject_jurisdiction_state String,
-    subject_jurisdiction_country String,
-    not_after DateTime
-) ENGINE = MergeTree()
-ORDER BY cert_index
-''')
-init_client.close()  # closes connections
-
-print("Fresh certs table created successfully!")
+
+CERT_COLUMNS = DEFAULT_COLUMNS
+
+
+def get_db_client():
+    """ClickHouse client for the certs database; it connects on first use (tables come from `schema.migrate`)."""
+    return LazyClient()
+
+
+def fill_row(targets, cert):
+    """Append one certificate's values straight to the `(column list, extractor)` targets.
+
+    Returns False, leaving no partial row behind, when an extractor fails.
+    """
+    rows = len(targets[0][0]) if targets else 0
+    try:
+        for column, extractor in targets:
+            column.append(extractor(cert))
+    except Exception:
+        for column, _ in targets:
+            del column[rows:]
+        return False
+    return True
+
+
+def release_slot(transport, batch):
+    """Hand a consumed batch back to transports that own its memory (plain queues do not)."""
+    release = getattr(transport, "release", None)
+    if release:
+        release(batch)
+
 
 class CTLogsProcs:
-    def __init__(self, entries_queue: queue, total_procs):
+    def __init__(self, entries_queue: queue, total_procs, checkpoint=None, metrics=None, decode_mode="fast",
+                 issuer_cache_size=4096, insert_rows=100_000, insert_bytes=64 * 1024 * 1024, insert_age=5.0,
+                 async_insert=False, sink=None, watchlist=None, alert_sink=None, columns=CERT_COLUMNS,
+                 leases=None):
         self.entries_queue = entries_queue
+        self.issuer_cache = IssuerCache(issuer_cache_size)
+        self.seen_issuers = set()  # issuer_ids this worker has written to the issuers table, once committed
+        # "fast" parses the leaf DER once; "reference" keeps the pyOpenSSL/certlib round trip
+        if decode_mode == "fast":
+            self.decode = partial(parse_raw_entry_fast, issuer_cache=self.issuer_cache)
+        else:
+            self.decode = parse_raw_entry
+        # the certs columns this deployment writes (see fields.py); only their extractors run
+        self.columns = columns
+        self.extractors = extractors(columns)
+        self.numeric = {name for name in columns if is_numeric(name)}
+        self.metrics = metrics  # optional metrics.MetricsRegistry
+        # resolved once: the decode timing is observed for every entry
+        self.decode_seconds = metrics.histogram("ctlog_decode_seconds") if metrics else None
+        self.checkpoint = checkpoint  # optional CheckpointStore, committed only after a successful insert
+        self.leases = leases  # optional lease.LeaseStore, told what is stored so a shared backfill advances
         # self.max_workers = max_workers
         self.stop_event = threading.Event()  # <--- stop flag
         self.pull_time = 2  # seconds
         self.start_time = time.time()
         self.total_procs = total_procs
-        self.db_client = clickhouse_connect.get_client(
-            host='localhost',
-            port=8123,
-            username='default',
-            password='mysecretpassword',
-            database='default'
-        )
-
-
-
+        # every decoded batch goes to `sink` (see sinks.py); by default certs rows are coalesced across
+        # queue items and inserted into ClickHouse on the writer's own connection
+        if sink is None:
+            sink = ClickHouseSink(get_db_client(), get_db_client(), columns, max_rows=insert_rows,
+                                  max_bytes=insert_bytes, max_age=insert_age, async_insert=async_insert,
+                                  metrics=metrics)
+        self.sink = sink
+        # optional watchlist.Watchlist checked against every decoded certificate; matches go to `alert_sink`
+        # right after the batch is decoded, ahead of the (coalesced) insert
+        self.watchlist = watchlist
+        self.alert_sink = alert_sink or (JsonlAlertSink() if watchlist else None)
+        if watchlist and metrics:
+            metrics.set("ctlog_watchlist_patterns", len(watchlist))
+
+    def committed(self, log_id, log_url, start_index, count, sth_timestamp, issuer_ids=()):
+        """Runs once a batch's rows are durable in the sink (all sinks, with a FanoutSink)."""
+        # only now are the batch's new issuers known to be stored; until then later batches send them again
+        self.seen_issuers.update(issuer_ids)
+        if self.checkpoint:
+            self.checkpoint.commit(log_url, start_index, start_index + count - 1)
+        if self.leases:
+            self.leases.commit(log_url, start_index, start_index + count - 1)
+        if self.metrics:
+            self.metrics.inc("ctlog_entries_processed_total", count, log=log_id)
+            if sth_timestamp:
+                self.metrics.set("ctlog_ingest_lag_seconds", time.time() - sth_timestamp / 1000, log=log_id)
+        with self.total_procs.get_lock():  # ensures atomic update
+            self.total_procs.value += count
 
     def start_processing(self):
         while not self.stop_event.is_set():
-            batched_entries = self.entries_queue.get()  # blocking get
-            rows_to_insert = []
-            for entry in batched_entries:
-                cert_data = process_ctlog_entry(entry)
-                rows_to_insert.append((
-                    cert_data['cert_index'],
-                    cert_data['sha1_fingerprint'],
-                    cert_data['issuer_country'],
-                    cert_data['issuer_organization'],
-                    cert_data['issuer_common_name'],
-                    cert_data['subject_country'],
-                    cert_data['subject_state'],
-                    cert_data['subject_organization'],
-                    cert_data['subject_serial_number'],
-                    cert_data['subject_common_name'],
-                    cert_data['san'],
-                    cert_data['subject_business_category'],
-                    cert_data['subject_jurisdiction_state'],
-                    cert_data['subject_jurisdiction_country'],
-                    cert_data['not_after']
-                ))
-
-            # Insert all rows at once
-            self.db_client.insert(
-                'certs',
-                rows_to_insert,
-                column_names=[
-                    'cert_index', 'sha1_fingerprint', 'issuer_country', 'issuer_organization',
-                    'issuer_common_name', 'subject_country', 'subject_state', 'subject_organization',
-                    'subject_serial_number', 'subject_common_name', 'san',
-                    'subject_business_category', 'subject_jurisdiction_state',
-                    'subject_jurisdiction_country', 'not_after'
-                ]
-            )
-            with self.total_procs.get_lock():  # ensures atomic update
-                self.total_procs.value += len(batched_entries)
+            batch = self.entries_queue.get()  # blocking get
+            log_id = batch.log_id
+            batched_entries = batch.entries()
+            columns = {name: [] for name in self.columns}
+            targets = [(columns[name], extract) for name, extract in self.extractors]
+            track_issuers = 'issuer_id' in columns
+            new_issuers = {}  # issuer_id -> issuer fields, for issuers not yet committed by this worker
+            failures = []
+            alerts = []
+            if self.watchlist and self.watchlist.maybe_reload() and self.metrics:
+                self.metrics.set("ctlog_watchlist_patterns", len(self.watchlist))
+            for cert_index, (leaf_input, extra_data) in enumerate(batched_entries, batch.start_index):
+                decode_start = time.perf_counter()
+                cert = self.decode(leaf_input, extra_data, cert_index=cert_index)
+                filled = cert is not None and fill_row(targets, cert)
+                if self.decode_seconds:
+                    self.decode_seconds.observe(time.perf_counter() - decode_start)
+                if not filled:
+                    failures.append((log_id, cert_index, explain_failure(leaf_input, extra_data),
+                                     bytes(leaf_input), bytes(extra_data)))
+                    continue
+                if track_issuers and cert.issuer[0] not in self.seen_issuers:
+                    new_issuers[cert.issuer[0]] = cert.issuer
+                if self.watchlist:
+                    try:
+                        names = certificate_names(cert)
+                    except Exception:
+                        names = []  # a SAN extension that does not parse (and is not selected) has no names to match
+                    for match in self.watchlist.match(names):
+                        alerts.append(make_alert(log_id, cert, match))
+            rows = len(columns['cert_index'])
+            columns['log_id'] = [log_id] * rows
+            count = len(batched_entries)
+            del batched_entries  # memoryviews into the batch payload
+            release_slot(self.entries_queue, batch)
+            if self.metrics:
+                self.metrics.inc("ctlog_entries_dequeued_total", count)
+                if failures:
+                    self.metrics.inc("ctlog_decode_failures_total", len(failures), log=log_id)
+            if alerts:
+                self.alert_sink.send(alerts)
+                if self.metrics:
+                    self.metrics.inc("ctlog_watchlist_matches_total", len(alerts), log=log_id)
+            if failures:
+                # stored before the write: the batch's commit covers the failed entries as well
+                self.sink.quarantine(failures)
+
+            nbytes = sum(8 * rows if name in self.numeric else sum(map(len, values)) for name, values in columns.items())
+            self.sink.write(columns, rows, nbytes, list(new_issuers.values()),
+                            on_commit=partial(self.committed, log_id, batch.log_url, batch.start_index, count,
+                                              batch.sth_timestamp, list(new_issuers)))
+            if self.metrics:
+                self.metrics.inc("ctlog_issuer_cache_hits_total", self.issuer_cache.hits)
+                self.metrics.inc("ctlog_issuer_cache_misses_total", self.issuer_cache.misses)
+                self.issuer_cache.hits = self.issuer_cache.misses = 0
+        self.sink.close()
+        if self.alert_sink:
+            self.alert_sink.close()
 
 
 
     def start_processing_debug(self):
         while not self.stop_event.is_set():
-            batched_entries = self.entries_queue.get()  # blocking get
+            batch = self.entries_queue.get()  # blocking get
+            batched_entries = batch.entries()
             batch_start = time.time()
             avg = 0
-            for entry in batched_entries:
+            for cert_index, (leaf_input, extra_data) in enumerate(batched_entries, batch.start_index):
                 s = time.time()
-                result = process_ctlog_entry(entry)
+                cert = self.decode(leaf_input, extra_data, cert_index=cert_index)
+                if cert is not None:
+                    extract(cert, self.columns)
                 e = time.time() - s
                 avg+=e
+            count = len(batched_entries)
+            del batched_entries
+            release_slot(self.entries_queue, batch)
             
             with self.total_procs.get_lock():  # ensures atomic update
-                self.total_procs.value += len(batched_entries)
+                self.total_procs.value += count
             elapsed = time.time() - batch_start
-            avg_time = avg / len(batched_entries) if batched_entries else 0
-            print(f"Elapsed: {elapsed:.2f}s - Processing Time avg {avg_time:.4f}s")
+            avg_time = avg / count if count else 0
+            print(f"Elapsed: {elapsed:.2f}s - Processing Time avg {avg_time:.4f}s - "
+                  f"Issuer cache hits/misses {self.issuer_cache.hits}/{self.issuer_cache.misses}")
 
     # def worker(self):
 
@@ -206,14 +260,134 @@ def safe_b64decode(data: str) -> bytes:
 
 def process_ctlog_entry(entry):
     """Process a single CT log entry to extract and decrypt certificate data."""
-    cert_data = decrypt_ctlog(entry)
+    return process_raw_entry(safe_b64decode(entry["leaf_input"]), safe_b64decode(entry["extra_data"]))
+
+
+def process_ctlog_entry_fast(entry, issuer_cache=None):
+    """Same result as `process_ctlog_entry`, parsing the leaf certificate only once."""
+    return process_raw_entry_fast(safe_b64decode(entry["leaf_input"]), safe_b64decode(entry["extra_data"]), issuer_cache)
+
+
+def process_raw_entry(leaf_input, extra_data, cert_index=0):
+    """Reference decode of already base64-decoded `leaf_input`/`extra_data` bytes."""
+    cert_data = decrypt_raw(leaf_input, extra_data)
+    cert_data['cert_index'] = cert_index
     result = process_certificate(cert_data)
     return result
 
 
+def process_raw_entry_fast(leaf_input, extra_data, issuer_cache=None, cert_index=0):
+    """Fast decode of raw entry bytes, see `parse_raw_entry_fast`."""
+    return process_view(parse_raw_entry_fast(leaf_input, extra_data, issuer_cache, cert_index))
+
+
+def parse_raw_entry(leaf_input, extra_data, cert_index=0):
+    """CertView of an entry through the reference pyOpenSSL/certlib path, or None if it does not parse."""
+    try:
+        cert_data = decrypt_raw(leaf_input, extra_data)
+        der_cert = base64.b64decode(cert_data['leaf_cert']['as_der'].strip())
+    except Exception:
+        return None
+    return parse_der(der_cert, cert_index)
+
+
+def parse_raw_entry_fast(leaf_input, extra_data, issuer_cache=None, cert_index=0):
+    """CertView of raw entry bytes (bytes or memoryviews, e.g. over a shared-memory slot), or None.
+
+    With an `issuer_cache`, issuer fields come from the (cached) first chain
+    certificate instead of being extracted from every leaf.
+    """
+    try:
+        _, der_cert, issuer_der = extract_leaf_der(leaf_input, extra_data)
+    except Exception:
+        return None
+    der_cert = bytes(der_cert)  # cryptography only parses bytes, not memoryviews
+    issuer = None
+    if issuer_cache is not None and issuer_der:
+        try:
+            issuer = issuer_cache.get(issuer_der)
+        except Exception:
+            issuer = None  # unparsable chain certificate: fall back to the leaf's own issuer
+    return parse_der(der_cert, cert_index, issuer=issuer)
+
+
+def parse_der(der_cert, cert_index=0, issuer=None):
+    """CertView of a DER-encoded leaf certificate, or None if it does not parse.
+
+    Nothing is extracted yet; see fields.py.
+    """
+    try:
+        return CertView(x509.load_der_x509_certificate(der_cert, default_backend()), cert_index, issuer)
+    except Exception:
+        return None
+
+
+def explain_failure(leaf_input, extra_data):
+    """Why an entry did not decode, for the quarantine. Only called on the (rare) failure path."""
+    try:
+        _, der_cert, _ = extract_leaf_der(leaf_input, extra_data)
+        x509.load_der_x509_certificate(bytes(der_cert), default_backend())
+    except Exception as e:
+        return f"{type(e).__name__}: {e}"
+    return "field extraction failed"
+
+
+def extract_leaf_der(leaf_input, extra_data):
+    """Return `(entry_type, leaf DER, issuer DER or None)` sliced straight out of the RFC 6962 structures.
+
+    MerkleTreeLeaf is version(1) leaf_type(1) timestamp(8) entry_type(2) followed,
+    for an X509 entry, by the 24-bit length-prefixed certificate; its `extra_data`
+    is the length-prefixed chain. For a precert entry the pre-certificate is the
+    first length-prefixed certificate of `extra_data` (PrecertChainEntry),
+    followed by the chain. Only the first chain certificate (the issuer) is
+    located, and it is not parsed.
+    """
+    if int.from_bytes(leaf_input[10:12], "big") == 0:
+        length = int.from_bytes(leaf_input[12:15], "big")
+        der_cert = leaf_input[15:15 + length]
+        entry_type = "X509LogEntry"
+        chain_offset = 3
+    else:
+        length = int.from_bytes(extra_data[0:3], "big")
+        der_cert = extra_data[3:3 + length]
+        entry_type = "PreCertEntry"
+        chain_offset = 3 + length + 3
+    if len(der_cert) != length:
+        raise ValueError("truncated certificate in CT log entry")
+
+    issuer_der = None
+    if len(extra_data) >= chain_offset + 3:
+        issuer_length = int.from_bytes(extra_data[chain_offset:chain_offset + 3], "big")
+        issuer_der = extra_data[chain_offset + 3:chain_offset + 3 + issuer_length]
+        if len(issuer_der) != issuer_length:
+            issuer_der = None
+    return entry_type, der_cert, issuer_der
+
+
+def diff_decode_paths(entries):
+    """Decode `entries` with both paths and return `(position, reference, fast)` for every row that differs."""
+    mismatches = []
+    issuer_cache = IssuerCache()
+    for i, entry in enumerate(entries):
+        try:
+            reference = process_ctlog_entry(entry)
+        except Exception:
+            reference = None
+        fast = process_ctlog_entry_fast(entry, issuer_cache=issuer_cache)
+        if reference != fast:
+            mismatches.append((i, reference, fast))
+    return mismatches
+
+
 def decrypt_ctlog(raw_ctlog):
-    leaf_input = safe_b64decode(raw_ctlog["leaf_input"])
-    extra_data = safe_b64decode(raw_ctlog["extra_data"])
+    return decrypt_raw(safe_b64decode(raw_ctlog["leaf_input"]), safe_b64decode(raw_ctlog["extra_data"]))
+
+
+def decrypt_raw(leaf_input, extra_data):
+    # only the reference decode path needs these; importing them lazily keeps worker startup fast
+    import certlib
+    from OpenSSL import crypto
+
     mtl = certlib.MerkleTreeHeader.parse(leaf_input)
 
     chain = []
@@ -248,6 +422,20 @@ def process_certificate(cert_data):
     """Process certificate data to extract relevant fields for database."""
     try:
         der_cert = base64.b64decode(cert_data['leaf_cert']['as_der'].strip())
+    except Exception:
+        return None
+    return process_der(der_cert, cert_data.get('cert_index', 0))
+
+
+def process_der(der_cert, cert_index=0, issuer=None):
+    """Extract the database fields from a DER-encoded leaf certificate.
+
+    `issuer` is a precomputed `issuers.issuer_fields` tuple; without it the
+    issuer is read from the leaf itself. This is the reference extraction,
+    written out independently of the fields.py extractors so that
+    `diff_decode_paths` checks them.
+    """
+    try:
         certificate = x509.load_der_x509_certificate(der_cert, default_backend())
 
         # SHA1 fingerprint
@@ -255,10 +443,7 @@ def process_certificate(cert_data):
         sha1_fingerprint_hex = ':'.join(f'{byte:02X}' for byte in sha1_fingerprint)
 
         # Issuer attributes
-        issuer_attributes = {attr.oid: attr.value for attr in certificate.issuer}
-        issuer_country = issuer_attributes.get(x509.NameOID.COUNTRY_NAME, "")
-        issuer_organization = issuer_attributes.get(x509.NameOID.ORGANIZATION_NAME, "")
-        issuer_common_name = issuer_attributes.get(x509.NameOID.COMMON_NAME, "")
+        issuer_id, issuer_country, issuer_organization, issuer_common_name = issuer or issuer_fields(certificate.issuer)
 
         # Subject attributes
         subject_attributes = {attr.oid: attr.value for attr in certificate.subject}
@@ -283,11 +468,10 @@ def process_certificate(cert_data):
         # Validity period (using UTC-aware property)
         not_after = certificate.not_valid_after_utc
 
-        #TODO: NOT BEFORE not_after = certificate.not_valid_before_utc (?)
-
         return  {
-            "cert_index": cert_data.get('cert_index', 0),
+            "cert_index": cert_index,
             "sha1_fingerprint": sha1_fingerprint_hex,
+            "issuer_id": issuer_id,
             "issuer_country": issuer_country,
             "issuer_organization": issuer_organization,
             "issuer_common_name": issuer_common_name,
@@ -303,5 +487,21 @@ def process_certificate(cert_data):
             "not_after": not_after
         }
 
-    except Exception as e:
-        return None
\ No newline at end of file
+    except Exception:
+        return None
+
+
+def process_view(cert):
+    """All default columns of a CertView (but log_id), plus the issuer strings, as one dict; None on failure.
+
+    The fast path's counterpart of `process_der`, through the fields.py extractors; CTLogsProcs extracts
+    only its selected columns instead.
+    """
+    if cert is None:
+        return None
+    try:
+        cert_data = extract(cert, CERT_COLUMNS)
+        _, cert_data['issuer_country'], cert_data['issuer_organization'], cert_data['issuer_common_name'] = cert.issuer
+    except Exception:
+        return None
+    return cert_data
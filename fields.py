@@ -0,0 +1,161 @@
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import dsa, ec, ed448, ed25519, rsa
+
+from issuers import issuer_fields
+
+
+class CertView:
+    """A parsed leaf certificate; the values several fields share are worked out on first use.
+
+    The subject attributes, the SAN names and the issuer are each computed at
+    most once per certificate, and only when a selected field reads them.
+    `issuer` may be a precomputed `issuers.issuer_fields` tuple (e.g. from an
+    IssuerCache); otherwise it is read from the leaf itself.
+    """
+
+    __slots__ = ("certificate", "cert_index", "_issuer", "_subject", "_san")
+
+    def __init__(self, certificate, cert_index=0, issuer=None):
+        self.certificate = certificate
+        self.cert_index = cert_index
+        self._issuer = issuer
+        self._subject = None
+        self._san = None
+
+    @property
+    def issuer(self):
+        """`(issuer_id, country, organization, common_name)`."""
+        if self._issuer is None:
+            self._issuer = issuer_fields(self.certificate.issuer)
+        return self._issuer
+
+    @property
+    def subject(self):
+        """Subject attributes by OID."""
+        if self._subject is None:
+            self._subject = {attr.oid: attr.value for attr in self.certificate.subject}
+        return self._subject
+
+    @property
+    def common_name(self):
+        return self.subject.get(x509.NameOID.COMMON_NAME, "")
+
+    @property
+    def san(self):
+        """SAN DNS names other than the subject CN."""
+        if self._san is None:
+            try:
+                extension = self.certificate.extensions.get_extension_for_oid(x509.ExtensionOID.SUBJECT_ALTERNATIVE_NAME)
+            except x509.ExtensionNotFound:
+                self._san = []
+            else:
+                common_name = self.common_name
+                self._san = [name for name in extension.value.get_values_for_type(x509.DNSName) if name != common_name]
+        return self._san
+
+    def value(self, name):
+        """The value of registry field `name` for this certificate."""
+        return FIELDS[name][1](self)
+
+
+def _subject(oid):
+    return lambda cert: cert.subject.get(oid, "")
+
+
+def _fingerprint(cert):
+    return ':'.join(f'{byte:02X}' for byte in cert.certificate.fingerprint(hashes.SHA1()))
+
+
+def _key_type(cert):
+    key = cert.certificate.public_key()
+    if isinstance(key, rsa.RSAPublicKey):
+        return f"RSA-{key.key_size}"
+    if isinstance(key, ec.EllipticCurvePublicKey):
+        return f"EC-{key.curve.name}"
+    if isinstance(key, ed25519.Ed25519PublicKey):
+        return "Ed25519"
+    if isinstance(key, ed448.Ed448PublicKey):
+        return "Ed448"
+    if isinstance(key, dsa.DSAPublicKey):
+        return f"DSA-{key.key_size}"
+    return type(key).__name__
+
+
+def _policy_oids(cert):
+    try:
+        extension = cert.certificate.extensions.get_extension_for_oid(x509.ExtensionOID.CERTIFICATE_POLICIES)
+    except x509.ExtensionNotFound:
+        return ""
+    return ";".join(policy.policy_identifier.dotted_string for policy in extension.value)
+
+
+# column -> (ClickHouse type, extractor of the value from a CertView). The columns added to certs, the rows
+# built by CTLogsProcs and the Parquet schema all follow this registry; a deployment selects the columns it needs
+# (see `parse_columns`) and only their extractors run. log_id is not extracted, it is the batch's log.
+FIELDS = {
+    'log_id': ('LowCardinality(String)', None),
+    'cert_index': ('UInt32', lambda cert: cert.cert_index),
+    'sha1_fingerprint': ('String', _fingerprint),
+    'issuer_id': ('UInt64', lambda cert: cert.issuer[0]),
+    'subject_country': ('String', _subject(x509.NameOID.COUNTRY_NAME)),
+    'subject_state': ('String', _subject(x509.NameOID.STATE_OR_PROVINCE_NAME)),
+    'subject_organization': ('String', _subject(x509.NameOID.ORGANIZATION_NAME)),
+    'subject_serial_number': ('String', _subject(x509.NameOID.SERIAL_NUMBER)),
+    'subject_common_name': ('String', lambda cert: cert.common_name),
+    'san': ('String', lambda cert: ";".join(cert.san)),
+    'subject_business_category': ('String', _subject(x509.NameOID.BUSINESS_CATEGORY)),
+    'subject_jurisdiction_state': ('String', _subject(x509.NameOID.JURISDICTION_STATE_OR_PROVINCE_NAME)),
+    'subject_jurisdiction_country': ('String', _subject(x509.NameOID.JURISDICTION_COUNTRY_NAME)),
+    'not_after': ('DateTime', lambda cert: cert.certificate.not_valid_after_utc),
+    # not in the default selection
+    'not_before': ('DateTime', lambda cert: cert.certificate.not_valid_before_utc),
+    'serial': ('String', lambda cert: f"{cert.certificate.serial_number:X}"),
+    'key_type': ('LowCardinality(String)', _key_type),  # RSA-2048, EC-secp256r1, Ed25519, ...
+    'policy_oids': ('String', _policy_oids),  # certificate policy OIDs, ;-joined like san
+}
+
+KEY_COLUMNS = ['log_id', 'cert_index']  # the certs sort key, always selected
+DEFAULT_COLUMNS = [
+    'log_id', 'cert_index', 'sha1_fingerprint', 'issuer_id',
+    'subject_country', 'subject_state', 'subject_organization',
+    'subject_serial_number', 'subject_common_name', 'san',
+    'subject_business_category', 'subject_jurisdiction_state',
+    'subject_jurisdiction_country', 'not_after'
+]
+NUMERIC_TYPES = {'UInt32', 'UInt64', 'DateTime'}
+
+
+def parse_columns(spec):
+    """Column list for a comma-separated selection; `default` stands for DEFAULT_COLUMNS.
+
+    The key columns always come first, e.g. `default,not_before,key_type` or
+    `issuer_id,san,not_after`.
+    """
+    columns = list(KEY_COLUMNS)
+    for name in spec.split(","):
+        name = name.strip()
+        for column in DEFAULT_COLUMNS if name == "default" else [name]:
+            if column not in FIELDS:
+                raise ValueError(f"unknown column {column!r}; available: default, {', '.join(FIELDS)}")
+            if column not in columns:
+                columns.append(column)
+    return columns
+
+
+def extractors(columns):
+    """`(name, extractor)` of the selected columns filled in per certificate."""
+    return [(name, FIELDS[name][1]) for name in columns if FIELDS[name][1] is not None]
+
+
+def extract(cert, columns):
+    """Values of `columns` for one CertView, as a dict."""
+    return {name: fn(cert) for name, fn in extractors(columns)}
+
+
+def is_numeric(name):
+    return FIELDS[name][0] in NUMERIC_TYPES
+
+
+def add_column(table, name):
+    return f'ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {name} {FIELDS[name][0]}'
@@ -0,0 +1,51 @@
+import hashlib
+from collections import OrderedDict
+from cryptography import x509
+from cryptography.hazmat.backends import default_backend
+
+
+def issuer_id_for(name):
+    """64-bit ID of an X.509 Name: the first 8 bytes of the SHA-256 of its DER encoding."""
+    return int.from_bytes(hashlib.sha256(name.public_bytes()).digest()[:8], "big")
+
+
+def issuer_fields(name):
+    """`(issuer_id, country, organization, common_name)` for the issuer Name of a certificate."""
+    attributes = {attr.oid: attr.value for attr in name}
+    return (
+        issuer_id_for(name),
+        attributes.get(x509.NameOID.COUNTRY_NAME, ""),
+        attributes.get(x509.NameOID.ORGANIZATION_NAME, ""),
+        attributes.get(x509.NameOID.COMMON_NAME, ""),
+    )
+
+
+class IssuerCache:
+    """Bounded LRU of parsed chain certificates, keyed by the SHA-256 of their DER bytes.
+
+    A log repeats the same few hundred intermediates in nearly every entry's
+    chain, so the issuing certificate is parsed once per worker and its subject
+    (the leaf's issuer) is served from here afterwards.
+    """
+
+    def __init__(self, max_size=4096):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, der_cert):
+        """Return the subject of chain certificate `der_cert` as `issuer_fields`, i.e. the issuer of the leaf it signed."""
+        key = hashlib.sha256(der_cert).digest()
+        fields = self.entries.get(key)
+        if fields is not None:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return fields
+        self.misses += 1
+        certificate = x509.load_der_x509_certificate(bytes(der_cert), default_backend())
+        fields = issuer_fields(certificate.subject)
+        self.entries[key] = fields
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+        return fields
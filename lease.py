@@ -0,0 +1,311 @@
+import os
+import socket
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+
+
+def default_owner():
+    """Node ID for lease rows: host, process and a random suffix, so a restarted process is a new owner."""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+
+class LeaseStore:
+    """Index-range leases of one or more logs, shared by several ingest nodes through a SQLite file.
+
+    Every log has a `next_index`, below which all indexes are covered by a
+    lease, and an `end_index` (exclusive). A lease is an inclusive `(start,
+    end)` range owned by one node until `expires`; owners extend `expires`
+    with heartbeats. `next` is the first index of the lease not yet durably
+    stored: consumers report what their sinks committed (`commit`, called
+    next to `CheckpointStore.commit`), and a lease is done once all of it is
+    committed. An expired lease is handed to the next node that claims, from
+    its `next` on, so whatever a dead node had fetched but not yet stored is
+    fetched again. Claims and renewals are single `BEGIN IMMEDIATE`
+    transactions, so no index is ever leased to two live owners.
+
+    SQLite needs working file locks: use it on one machine or a filesystem
+    that provides them. Like CheckpointStore it is picklable and connects
+    lazily in each process.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        return {"path": self.path}
+
+    def __setstate__(self, state):
+        self.__init__(state["path"])
+
+    @property
+    def conn(self):
+        if self._conn is None or self._pid != os.getpid():
+            self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS lease_logs (log_url TEXT PRIMARY KEY, next_index INTEGER NOT NULL, "
+                               "end_index INTEGER NOT NULL)")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS leases (id INTEGER PRIMARY KEY, log_url TEXT, start INTEGER, "
+                               "end INTEGER, next INTEGER, owner TEXT, expires REAL, state TEXT)")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS lease_nodes (owner TEXT PRIMARY KEY, rate REAL, seen REAL)")
+            # committed ranges of active leases not yet contiguous with their `next`
+            self._conn.execute("CREATE TABLE IF NOT EXISTS lease_commits (lease_id INTEGER, start INTEGER, end INTEGER)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS leases_log ON leases (log_url, state, expires)")
+            self._pid = os.getpid()
+        return self._conn
+
+    def _transaction(self, fn, *args):
+        with self._lock:
+            conn = self.conn
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = fn(conn, *args)
+                conn.execute("COMMIT")
+                return result
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+    def register(self, log_url, start_index, end_index):
+        """Add a log to share, or grow its end; the first node's `start_index` wins."""
+        def register(conn):
+            conn.execute("INSERT OR IGNORE INTO lease_logs VALUES (?, ?, ?)", (log_url, start_index, end_index))
+            conn.execute("UPDATE lease_logs SET end_index = MAX(end_index, ?) WHERE log_url = ?", (end_index, log_url))
+        self._transaction(register)
+
+    def claim(self, log_url, owner, size, ttl):
+        """Lease `(id, start, end)` to `owner` for `ttl` seconds: another node's expired lease first, else the next
+        `size` indexes, else one `owner` released or let expire itself.
+
+        Returns None when every index is leased or done.
+        """
+        def take(conn, row, now):
+            conn.execute("UPDATE leases SET owner = ?, expires = ? WHERE id = ?", (owner, now + ttl, row[0]))
+            return row
+
+        def claim(conn):
+            now = time.time()
+            expired = "SELECT id, next, end FROM leases WHERE log_url = ? AND state = 'active' AND expires < ? AND owner {} ? " \
+                      "ORDER BY start LIMIT 1"
+            row = conn.execute(expired.format("!="), (log_url, now, owner)).fetchone()
+            if row:
+                return take(conn, row, now)
+            next_index, end_index = conn.execute("SELECT next_index, end_index FROM lease_logs WHERE log_url = ?",
+                                                 (log_url,)).fetchone()
+            if next_index >= end_index:
+                row = conn.execute(expired.format("="), (log_url, now, owner)).fetchone()
+                return take(conn, row, now) if row else None
+            end = min(next_index + size, end_index) - 1
+            cursor = conn.execute("INSERT INTO leases (log_url, start, end, next, owner, expires, state) "
+                                  "VALUES (?, ?, ?, ?, ?, ?, 'active')", (log_url, next_index, end, next_index, owner, now + ttl))
+            conn.execute("UPDATE lease_logs SET next_index = ? WHERE log_url = ?", (end + 1, log_url))
+            return cursor.lastrowid, next_index, end
+        return self._transaction(claim)
+
+    def heartbeat(self, owner, lease_ids, ttl, rate=0.0):
+        """Renew `owner`'s leases; returns `(lost, done)`, the IDs it no longer holds and those fully committed."""
+        def heartbeat(conn):
+            now = time.time()
+            lost, done = [], []
+            for lease_id in lease_ids:
+                row = conn.execute("SELECT owner, state FROM leases WHERE id = ?", (lease_id,)).fetchone()
+                if row and row[1] == 'done':
+                    done.append(lease_id)
+                elif row and row[0] == owner:
+                    conn.execute("UPDATE leases SET expires = ? WHERE id = ?", (now + ttl, lease_id))
+                else:
+                    lost.append(lease_id)
+            conn.execute("INSERT OR REPLACE INTO lease_nodes VALUES (?, ?, ?)", (owner, rate, now))
+            return lost, done
+        return self._transaction(heartbeat)
+
+    def commit(self, log_url, start, end):
+        """Record `(start, end)` of `log_url` as durably stored and advance the `next` of the leases it falls in.
+
+        Whoever owns the lease by now, the rows are stored, so a node that
+        takes a lease over does not fetch them again.
+        """
+        def commit(conn):
+            leases = conn.execute("SELECT id, start, end, next FROM leases WHERE log_url = ? AND state = 'active' "
+                                  "AND start <= ? AND end >= ?", (log_url, end, start)).fetchall()
+            for lease_id, l_start, l_end, next_index in leases:
+                conn.execute("INSERT INTO lease_commits VALUES (?, ?, ?)", (lease_id, max(start, l_start), min(end, l_end)))
+                while True:
+                    rows = conn.execute("SELECT rowid, end FROM lease_commits WHERE lease_id = ? AND start <= ?",
+                                        (lease_id, next_index)).fetchall()
+                    if not rows:
+                        break
+                    next_index = max(next_index, max(r[1] for r in rows) + 1)
+                    conn.executemany("DELETE FROM lease_commits WHERE rowid = ?", [(r[0],) for r in rows])
+                state = 'done' if next_index > l_end else 'active'
+                conn.execute("UPDATE leases SET next = ?, state = ? WHERE id = ?", (next_index, state, lease_id))
+                if state == 'done':
+                    conn.execute("DELETE FROM lease_commits WHERE lease_id = ?", (lease_id,))
+        self._transaction(commit)
+
+    def release(self, lease_id, owner):
+        """Give a lease up so the next claim takes it over from its committed `next`."""
+        def release(conn):
+            conn.execute("UPDATE leases SET expires = 0 WHERE id = ? AND owner = ? AND state = 'active'",
+                         (lease_id, owner))
+        self._transaction(release)
+
+    def status(self):
+        """Per-log progress and per-node rates, for `python lease.py STORE`."""
+        with self._lock:
+            conn = self.conn
+            logs = conn.execute("SELECT l.log_url, l.next_index, l.end_index, "
+                                "SUM(s.state = 'done'), SUM(s.state = 'active'), SUM(s.state = 'active' AND s.expires < ?) "
+                                "FROM lease_logs l LEFT JOIN leases s USING (log_url) GROUP BY l.log_url",
+                                (time.time(),)).fetchall()
+            nodes = conn.execute("SELECT n.owner, n.rate, n.seen, COUNT(s.id) FROM lease_nodes n LEFT JOIN leases s "
+                                 "ON s.owner = n.owner AND s.state = 'active' GROUP BY n.owner ORDER BY n.seen DESC").fetchall()
+        return logs, nodes
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+class _Lease:
+    __slots__ = ("id", "start", "end", "fetched", "next")
+
+    def __init__(self, lease_id, start, end):
+        self.id = lease_id
+        self.start = start
+        self.end = end
+        self.fetched = {}  # start -> end (exclusive) of fetched ranges at or above `next`
+        self.next = start  # first index not fetched yet by this node
+
+    def record(self, start, count):
+        self.fetched[start] = start + count
+        while self.next in self.fetched:
+            self.next = self.fetched.pop(self.next)
+
+    def fetching(self):
+        return self.next <= self.end
+
+
+class LeaseCoordinator:
+    """Feeds a CTlogsStream's scheduler from a LeaseStore instead of a fixed index range.
+
+    A background thread keeps up to `max_leases` leases being fetched (one in
+    progress, the next one queued). It sizes new leases to about
+    `lease_seconds` of work at the node's measured fetch rate, within
+    `min_lease..max_lease`, so fast nodes take larger shares. A fetched lease
+    is still held, and renewed every `ttl / 3` seconds (at most 5), until the
+    consumers have committed all of it to the store; a node that dies before
+    that leaves the uncommitted part to whoever takes the lease over. A lease
+    with a range given up on after the stream's retries is released to the
+    next claimant. The stream is `finished` when the store has nothing left
+    to lease and this node holds no lease.
+    """
+
+    def __init__(self, store, stream, owner=None, ttl=60.0, lease_seconds=120.0, min_lease=8192, max_lease=5_000_000,
+                 max_leases=2, tick=1.0):
+        self.store = store
+        self.stream = stream
+        self.log_url = stream.ct_log_url
+        self.owner = owner or default_owner()
+        self.ttl = ttl
+        self.lease_seconds = lease_seconds
+        self.min_lease = min_lease
+        self.max_lease = max_lease
+        self.max_leases = max_leases
+        self.tick = tick
+        self.leases = {}  # id -> _Lease held by this node, until committed or lost
+        self.lock = threading.Lock()  # guards leases
+        self.rate = 0.0  # entries/s, exponentially weighted
+        self.fetched = 0  # entries fetched since the last rate sample
+        self.finished = False
+        store.register(self.log_url, stream.start_index, stream.end_index)
+        self.thread = threading.Thread(target=self._run, name="lease-coordinator", daemon=True)
+        self.thread.start()
+
+    def extend(self, end_index):
+        """The log grew (follow mode): make the new indexes leasable for every node."""
+        self.store.register(self.log_url, self.stream.start_index, end_index)
+        self.finished = False
+
+    def record(self, start, count):
+        """Called by the stream for every fetched range."""
+        with self.lock:
+            self.fetched += count
+            for lease in self.leases.values():
+                if lease.start <= start <= lease.end:
+                    lease.record(start, count)
+                    break
+
+    def lease_size(self):
+        size = int(self.rate * self.lease_seconds) if self.rate else self.min_lease
+        return max(self.min_lease, min(self.max_lease, size))
+
+    def _run(self):
+        last_sample = last_heartbeat = time.time()
+        while not self.stream.stop_event.wait(self.tick):
+            now = time.time()
+            with self.lock:
+                sample, self.fetched = self.fetched, 0
+                held = list(self.leases)
+            if now > last_sample:
+                self.rate = 0.8 * self.rate + 0.2 * sample / (now - last_sample) if self.rate else sample / (now - last_sample)
+            last_sample = now
+            self._release_failed()
+
+            if now - last_heartbeat >= min(self.ttl / 3, 5.0) or not self._fetching():
+                last_heartbeat = now
+                lost, done = self.store.heartbeat(self.owner, held, self.ttl, self.rate)
+                for lease_id in lost:
+                    # another node took it over after we missed renewals; what is already scheduled is fetched twice
+                    print(f"Lost lease {lease_id} of {self.log_url}")
+                with self.lock:
+                    for lease_id in lost + done:
+                        self.leases.pop(lease_id, None)
+
+            while self._fetching() < self.max_leases:
+                claimed = self.store.claim(self.log_url, self.owner, self.lease_size(), self.ttl)
+                if claimed is None:
+                    break
+                lease_id, start, end = claimed
+                if lease_id in self.leases:
+                    continue  # our own lease, expired during a stall and renewed by this claim; already scheduled
+                with self.lock:
+                    self.leases[lease_id] = _Lease(lease_id, start, end)
+                self.stream.scheduler.add(start, end)
+            with self.lock:
+                self.finished = not self.leases
+
+    def _fetching(self):
+        with self.lock:
+            return sum(lease.fetching() for lease in self.leases.values())
+
+    def _release_failed(self):
+        scheduler = self.stream.scheduler
+        with scheduler.lock:
+            failed, scheduler.failed = scheduler.failed, []
+        for start, end in failed:
+            with self.lock:
+                lease = next((l for l in self.leases.values() if l.start <= start <= l.end), None)
+                if lease:
+                    del self.leases[lease.id]
+            if lease:
+                print(f"Releasing lease {lease.start}-{lease.end} of {self.log_url}: range {start}-{end} failed")
+                scheduler.drop(lease.start, lease.end)  # the next claimant fetches the rest of it
+                self.store.release(lease.id, self.owner)
+
+
+if __name__ == "__main__":
+    # python lease.py STORE: progress of a shared backfill
+    logs, nodes = LeaseStore(sys.argv[1]).status()
+    for log_url, next_index, end_index, done, active, expired in logs:
+        print(f"{log_url}: leased up to {next_index} of {end_index}, {done or 0} leases done, "
+              f"{active or 0} active ({expired or 0} expired)")
+    for owner, rate, seen, held in nodes:
+        print(f"  {owner}: {rate:.0f} entries/s, {held} leases, last heartbeat {time.time() - seen:.0f}s ago")
@@ -0,0 +1,236 @@
+import hashlib
+import threading
+
+_LEAF_PREFIX = hashlib.sha256(b"\x00")
+EMPTY_ROOT = hashlib.sha256(b"").digest()
+
+
+def leaf_hash(leaf_input):
+    """RFC 6962 leaf hash, SHA-256(0x00 || MerkleTreeLeaf)."""
+    h = _LEAF_PREFIX.copy()
+    h.update(leaf_input)
+    return h.digest()
+
+
+def node_hash(left, right):
+    """RFC 6962 interior node hash, SHA-256(0x01 || left || right)."""
+    return hashlib.sha256(b"\x01" + left + right).digest()
+
+
+class CompactRange:
+    """Merkle hashes of the leaves `[begin, end)`, kept as the O(log n) perfect subtrees covering them.
+
+    `nodes` holds `(level, hash)` pairs left to right, a node of level `l`
+    covering `2**l` leaves aligned on a multiple of `2**l`. Appending merges
+    sibling subtrees as soon as both are present, so the list always is the
+    fewest such subtrees, and two adjacent ranges combine by appending the
+    nodes of the right one to the left one.
+    """
+
+    __slots__ = ("begin", "end", "nodes")
+
+    def __init__(self, begin, hashes=()):
+        self.begin = begin
+        self.end = begin
+        self.nodes = []
+        for h in hashes:
+            self.append(0, h)
+
+    def append(self, level, h):
+        """Add the subtree of `level` starting at `end`."""
+        nodes = self.nodes
+        nodes.append((level, h))
+        self.end += 1 << level
+        while len(nodes) > 1 and nodes[-2][0] == nodes[-1][0]:
+            level = nodes[-1][0]
+            if (self.end - (2 << level)) % (2 << level):
+                break  # same size, but not siblings
+            (_, left), (_, right) = nodes[-2], nodes[-1]
+            nodes[-2:] = [(level + 1, node_hash(left, right))]
+
+    def extend(self, other):
+        """Append the adjacent range `other` (`other.begin == self.end`)."""
+        if other.begin != self.end:
+            raise ValueError(f"ranges [{self.begin}, {self.end}) and [{other.begin}, {other.end}) are not adjacent")
+        for level, h in other.nodes:
+            self.append(level, h)
+
+    def root(self):
+        """Tree head hash of a range starting at 0, i.e. the root of the tree of size `end`."""
+        if self.begin != 0:
+            raise ValueError("only a range starting at leaf 0 has a root")
+        if not self.nodes:
+            return EMPTY_ROOT
+        h = self.nodes[-1][1]
+        for _, left in reversed(self.nodes[:-1]):
+            h = node_hash(left, h)
+        return h
+
+
+def verify_inclusion(index, tree_size, leaf, audit_path, root):
+    """Check an RFC 6962 audit path; returns the left siblings on it (smallest first), or None if it fails.
+
+    The left siblings of leaf `index` are exactly the subtrees covering
+    `[0, index)`, i.e. the compact range in front of it.
+    """
+    if index >= tree_size:
+        return None
+    fn, sn = index, tree_size - 1
+    h = leaf
+    lefts = []
+    for p in audit_path:
+        if sn == 0:
+            return None
+        if fn & 1 or fn == sn:
+            h = node_hash(p, h)
+            lefts.append(p)
+            while not fn & 1 and fn:
+                fn >>= 1
+                sn >>= 1
+        else:
+            h = node_hash(h, p)
+        fn >>= 1
+        sn >>= 1
+    return lefts if sn == 0 and h == root else None
+
+
+def prefix_range(index, lefts):
+    """CompactRange of `[0, index)` from the left siblings returned by `verify_inclusion`."""
+    levels = [bit for bit in range(index.bit_length()) if index >> bit & 1]
+    if len(levels) != len(lefts):
+        raise ValueError("audit path does not match the leaf index")
+    prefix = CompactRange(0)
+    prefix.nodes = list(zip(reversed(levels), reversed(lefts)))
+    prefix.end = index
+    return prefix
+
+
+def verify_consistency(first, second, first_root, second_root, proof):
+    """Check an RFC 6962 consistency proof between two tree heads (RFC 9162, section 2.1.4.2)."""
+    if first > second:
+        return False
+    if first == second:
+        return not proof and first_root == second_root
+    if first == 0:
+        return not proof
+    if not proof:
+        return False
+    if first & (first - 1) == 0:
+        proof = [first_root] + list(proof)  # a power of two is itself a node of the larger tree
+    fn, sn = first - 1, second - 1
+    while fn & 1:
+        fn >>= 1
+        sn >>= 1
+    fr = sr = proof[0]
+    for c in proof[1:]:
+        if sn == 0:
+            return False
+        if fn & 1 or fn == sn:
+            fr = node_hash(c, fr)
+            sr = node_hash(c, sr)
+            if not fn & 1:
+                while not fn & 1 and fn:
+                    fn >>= 1
+                    sn >>= 1
+        else:
+            sr = node_hash(sr, c)
+        fn >>= 1
+        sn >>= 1
+    return sn == 0 and fr == first_root and sr == second_root
+
+
+class MerkleVerifier:
+    """Folds fetched ranges of one log into Merkle roots to check against its signed tree heads.
+
+    `add` hashes a range's leaves into a CompactRange and merges it with the
+    ranges next to it, in whatever order fetches complete; memory is O(log n)
+    hashes per range not yet joined, independent of the tree size. The range
+    starting at leaf 0 (the prefix) grows as its neighbours arrive; when it
+    reaches a size registered with `cut`, `on_root(size, root)` is called with
+    the root of the tree of that size. Ranges never merge across a cut that
+    has not been reached, so every cut is reported exactly at its size.
+
+    Fetching that starts at `base > 0` needs the prefix `[0, base)` from an
+    inclusion proof first, see `seed`.
+    """
+
+    def __init__(self, base=0, on_root=None):
+        self.base = base
+        self.on_root = on_root
+        self.prefix = CompactRange(0) if base == 0 else None
+        self.ranges = {}  # begin -> CompactRange not joined to the prefix yet
+        self.ends = {}  # end -> begin of the same ranges
+        self.cuts = set()
+        self.lock = threading.Lock()
+
+    def seed(self, prefix):
+        with self.lock:
+            if prefix.end != self.base:
+                raise ValueError(f"prefix ends at {prefix.end}, expected {self.base}")
+            self.prefix = prefix
+            roots = self._advance()
+        self._report(roots)
+
+    def cut(self, size):
+        """Report the root once `[0, size)` has been folded; `size` must not fall inside a range already added."""
+        with self.lock:
+            self.cuts.add(size)
+            roots = self._advance()
+        self._report(roots)
+
+    def add(self, start, leaves):
+        """Fold the leaf inputs of `[start, start + len(leaves))`."""
+        hashes = [leaf_hash(leaf) for leaf in leaves]
+        if not hashes:
+            return
+        with self.lock:
+            end = start + len(hashes)
+            bounds = [start] + sorted(c for c in self.cuts if start < c < end) + [end]
+            for lo, hi in zip(bounds, bounds[1:]):
+                self._insert(CompactRange(lo, hashes[lo - start:hi - start]))
+            roots = self._advance()
+        self._report(roots)
+
+    def _insert(self, rng):
+        begin = self.ends.get(rng.begin)
+        if begin is not None and rng.begin not in self.cuts:
+            left = self.ranges[begin]
+            del self.ends[rng.begin]
+            left.extend(rng)
+            rng = left
+        else:
+            self.ranges[rng.begin] = rng
+        right = self.ranges.get(rng.end)
+        if right is not None and rng.end not in self.cuts:
+            del self.ranges[right.begin]
+            rng.extend(right)
+        self.ends[rng.end] = rng.begin
+
+    def _advance(self):
+        roots = []
+        prefix = self.prefix
+        while prefix is not None:
+            if prefix.end in self.cuts:
+                self.cuts.remove(prefix.end)
+                roots.append((prefix.end, prefix.root()))
+            following = self.ranges.pop(prefix.end, None)
+            if following is None:
+                break
+            del self.ends[following.end]
+            prefix.extend(following)
+        return roots
+
+    def _report(self, roots):
+        if self.on_root:
+            for size, root in roots:
+                self.on_root(size, root)
+
+    def verified_end(self):
+        """End of the contiguous prefix folded so far, or None before `seed`."""
+        with self.lock:
+            return self.prefix.end if self.prefix else None
+
+    def unverified(self):
+        """Cuts not reached yet and the ranges waiting for the prefix, for reporting."""
+        with self.lock:
+            return sorted(self.cuts), sorted((r.begin, r.end) for r in self.ranges.values())
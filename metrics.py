@@ -0,0 +1,247 @@
+import os
+import threading
+import time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing import Array, Lock, Value
+
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+DECODE_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.05)
+ENTRIES_BUCKETS = (1, 32, 64, 128, 256, 512, 1024, 2048)
+ROWS_BUCKETS = (100, 1_000, 10_000, 50_000, 100_000, 250_000, 1_000_000)
+
+# name -> (type, help, histogram buckets)
+METRICS = {
+    "ctlog_fetch_seconds": ("histogram", "get-entries request latency", LATENCY_BUCKETS),
+    "ctlog_fetch_entries": ("histogram", "Entries per get-entries response", ENTRIES_BUCKETS),
+    "ctlog_fetch_retries_total": ("counter", "get-entries attempts that failed and were retried or given up", None),
+    "ctlog_throttled_total": ("counter", "get-entries responses with HTTP 429 or 503", None),
+    "ctlog_entries_fetched_total": ("counter", "Entries handed to the transport", None),
+    "ctlog_active_workers": ("gauge", "get-entries requests in flight", None),
+    "ctlog_fetch_limit": ("gauge", "Concurrency limit of the rate controller", None),
+    "ctlog_stagger_seconds": ("gauge", "Launch delay of the stagger controller, or remaining Retry-After pause", None),
+    "ctlog_queue_batches": ("gauge", "Batches waiting in the transport", None),
+    "ctlog_queue_entries": ("gauge", "Entries fetched but not yet picked up by a consumer", None),
+    "ctlog_queue_bytes": ("gauge", "Bytes held by the transport: queued payloads, or ring slots in use", None),
+    "ctlog_entries_dequeued_total": ("counter", "Entries picked up by consumers", None),
+    "ctlog_decode_seconds": ("histogram", "Decode time per entry", DECODE_BUCKETS),
+    "ctlog_decode_failures_total": ("counter", "Entries that could not be decoded", None),
+    "ctlog_insert_seconds": ("histogram", "ClickHouse insert latency, retries included", LATENCY_BUCKETS),
+    "ctlog_insert_rows": ("histogram", "Rows per ClickHouse insert", ROWS_BUCKETS),
+    "ctlog_entries_processed_total": ("counter", "Entries committed to the sink", None),
+    "ctlog_ingest_lag_seconds": ("gauge", "Time from the STH announcing a batch to its commit", None),
+    "ctlog_issuer_cache_hits_total": ("counter", "Issuer cache hits", None),
+    "ctlog_issuer_cache_misses_total": ("counter", "Issuer cache misses", None),
+    "ctlog_merkle_verified_size": ("gauge", "Largest tree size whose root was verified against a signed tree head", None),
+    "ctlog_merkle_failures_total": ("counter", "Merkle root, consistency or inclusion checks that failed", None),
+    "ctlog_watchlist_matches_total": ("counter", "Certificate names matching a watchlist pattern", None),
+    "ctlog_watchlist_patterns": ("gauge", "Patterns in the watchlist index in use", None),
+}
+
+KEY_BYTES = 256
+
+
+def _cells(name):
+    buckets = METRICS[name][2]
+    return len(buckets) + 3 if buckets else 1  # bucket counts, +Inf, sum, count
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _sample(name, labels):
+    return f"{name}{{{labels}}}" if labels else name
+
+
+def _series_key(name, labels):
+    return name + "|" + ",".join(f'{k}="{_escape(v)}"' for k, v in sorted(labels.items()))
+
+
+class MetricsRegistry:
+    """Process-shared metric values, rendered in the Prometheus text format.
+
+    Create it in the parent and pass it to the child processes. Every series
+    (`name` plus labels, see `METRICS`) gets a fixed run of cells in one shared
+    `multiprocessing.Array`; the series table lives in shared memory too, so a
+    series first seen in one process is found by the others. Counters and
+    histograms are accumulated per process and added to the shared cells every
+    `flush_interval` seconds under one lock, so the hot paths (e.g. a decode
+    timing per entry) never touch a cross-process lock. Gauges are written
+    straight through.
+    """
+
+    def __init__(self, max_series=2048, max_cells=65536, flush_interval=1.0):
+        self.values = Array('d', max_cells, lock=False)
+        self.keys = Array('c', max_series * KEY_BYTES, lock=False)
+        self.offsets = Array('i', max_series, lock=False)
+        self.series = Value('i', 0, lock=False)
+        self.cells = Value('i', 0, lock=False)
+        self.max_series = max_series
+        self.max_cells = max_cells
+        self.lock = Lock()
+        self.flush_interval = flush_interval
+        self._init_local()
+
+    def _init_local(self):
+        self._pid = os.getpid()
+        self._offsets = {}
+        self._pending = {}  # cell -> delta not yet added to the shared values
+        self._local_lock = threading.Lock()
+        self._flusher = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for name in ("_pid", "_offsets", "_pending", "_local_lock", "_flusher"):
+            del state[name]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._init_local()
+
+    def _offset(self, name, labels):
+        if self._pid != os.getpid():
+            self._init_local()  # forked child: the inherited caches and flusher belong to the parent
+        key = _series_key(name, labels)
+        offset = self._offsets.get(key)
+        if offset is None:
+            offset = self._offsets[key] = self._allocate(key.encode(), _cells(name))
+        return offset
+
+    def _allocate(self, key, cells):
+        if len(key) > KEY_BYTES:
+            raise ValueError(f"metric series key longer than {KEY_BYTES} bytes: {key!r}")
+        padded = key.ljust(KEY_BYTES, b"\0")
+        with self.lock:
+            for i in range(self.series.value):
+                if self.keys[i * KEY_BYTES:(i + 1) * KEY_BYTES] == padded:
+                    return self.offsets[i]
+            i = self.series.value
+            offset = self.cells.value
+            if i >= self.max_series or offset + cells > self.max_cells:
+                raise RuntimeError("metrics registry is full")
+            self.keys[i * KEY_BYTES:(i + 1) * KEY_BYTES] = padded
+            self.offsets[i] = offset
+            self.cells.value = offset + cells
+            self.series.value = i + 1
+            return offset
+
+    def _add(self, *deltas):
+        with self._local_lock:
+            pending = self._pending
+            for cell, amount in deltas:
+                pending[cell] = pending.get(cell, 0) + amount
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._flush_loop, name="metrics-flush", daemon=True)
+                self._flusher.start()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def flush(self):
+        """Add this process's pending counter and histogram deltas to the shared values."""
+        with self._local_lock:
+            pending, self._pending = self._pending, {}
+        if pending:
+            with self.lock:
+                for cell, amount in pending.items():
+                    self.values[cell] += amount
+
+    def inc(self, name, amount=1, **labels):
+        self._add((self._offset(name, labels), amount))
+
+    def set(self, name, value, **labels):
+        self.values[self._offset(name, labels)] = value
+
+    def observe(self, name, value, **labels):
+        self.histogram(name, **labels).observe(value)
+
+    def histogram(self, name, **labels):
+        """Handle on one histogram series, for hot paths: `observe` without looking the series up every time.
+
+        Get it in the process that observes, e.g. when a consumer starts.
+        """
+        return _Histogram(self, self._offset(name, labels), METRICS[name][2])
+
+    def _snapshot(self):
+        with self.lock:
+            series = [(self.keys[i * KEY_BYTES:(i + 1) * KEY_BYTES].rstrip(b"\0").decode(), self.offsets[i])
+                      for i in range(self.series.value)]
+            values = self.values[:self.cells.value]
+        return series, values
+
+    def total(self, name):
+        """Sum of a counter or gauge over all of its label sets."""
+        series, values = self._snapshot()
+        return sum(values[offset] for key, offset in series if key.split("|", 1)[0] == name)
+
+    def render(self):
+        """All series in the Prometheus text exposition format."""
+        self.flush()
+        series, values = self._snapshot()
+        by_name = {}
+        for key, offset in series:
+            name, labels = key.split("|", 1)
+            by_name.setdefault(name, []).append((labels, offset))
+        lines = []
+        for name, (kind, help_text, buckets) in METRICS.items():
+            if name not in by_name:
+                continue
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, offset in by_name[name]:
+                if kind != "histogram":
+                    lines.append(f"{_sample(name, labels)} {values[offset]:g}")
+                    continue
+                cumulative = 0
+                for i, le in enumerate(list(buckets) + ["+Inf"]):
+                    cumulative += values[offset + i]
+                    bucket_labels = f'{labels},le="{le}"' if labels else f'le="{le}"'
+                    lines.append(f"{_sample(name + '_bucket', bucket_labels)} {cumulative:g}")
+                lines.append(f"{_sample(name + '_sum', labels)} {values[offset + len(buckets) + 1]:g}")
+                lines.append(f"{_sample(name + '_count', labels)} {values[offset + len(buckets) + 2]:g}")
+        return "\n".join(lines) + "\n"
+
+
+class _Histogram:
+    __slots__ = ("registry", "buckets", "sum_cell", "count_cell", "offset")
+
+    def __init__(self, registry, offset, buckets):
+        self.registry = registry
+        self.buckets = buckets
+        self.offset = offset
+        self.sum_cell = offset + len(buckets) + 1
+        self.count_cell = offset + len(buckets) + 2
+
+    def observe(self, value):
+        self.registry._add(
+            (self.offset + bisect_left(self.buckets, value), 1),  # first bucket with value <= le, else +Inf
+            (self.sum_cell, value),
+            (self.count_cell, 1),
+        )
+
+
+def serve(registry, port=9108, host="127.0.0.1"):
+    """Expose `registry` at `http://host:port/metrics` from a daemon thread; returns the server."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?", 1)[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
@@ -0,0 +1,123 @@
+import json
+import threading
+import time
+from ratelimit import AIMDRateController, StaggerController
+from stream import CTlogsStream
+
+# log list states worth fetching; retired and rejected logs are skipped
+LOG_LIST_STATES = ("usable", "qualified", "readonly")
+
+
+def load_log_list(path):
+    """Read the logs to ingest as `(url, weight, log_id)` tuples.
+
+    Accepts either a text file with one `URL [weight]` per line (`#` starts a
+    comment) or a CT log list JSON in the v3 schema, whose RFC 6962 `log_id` is
+    used to tag rows.
+    """
+    with open(path) as f:
+        text = f.read()
+    if text.lstrip().startswith("{"):
+        logs = []
+        for operator in json.loads(text).get("operators", []):
+            for log in operator.get("logs", []):
+                if any(state in log.get("state", {}) for state in LOG_LIST_STATES):
+                    url = log["url"] if log["url"].endswith("/") else log["url"] + "/"
+                    logs.append((url, 1.0, log.get("log_id")))
+        return logs
+
+    logs = []
+    for line in text.splitlines():
+        line = line.split("#", 1)[0].strip()
+        if not line:
+            continue
+        parts = line.split()
+        url = parts[0] if parts[0].endswith("/") else parts[0] + "/"
+        logs.append((url, float(parts[1]) if len(parts) > 1 else 1.0, None))
+    return logs
+
+
+class MultiLogStream:
+    """Fetch many logs from one process under a single concurrency budget.
+
+    Every log keeps its own CTlogsStream, and with it its own RangeScheduler,
+    rate controller and checkpoint rows; all of them share one buffer, so a
+    single consumer pool decodes and inserts for every log. `max_in_flight`
+    long-lived workers are the global budget. Each free worker serves the log
+    with the smallest virtual time among those that have work and a free
+    rate-controller slot, then advances that log's virtual time by
+    `page_size / weight` (weighted fair queuing), so a huge log cannot starve
+    small ones and an idle log cannot bank credit while it waits.
+
+    `rate_control` picks each log's controller as in `runner.producer_process`
+    (`aimd`, or `stagger` with `stagger_coef`). A failed fetch frees its worker
+    at once; the range is retried by any worker once its backoff has passed.
+    """
+
+    def __init__(self, logs, buffer, total_entries, max_in_flight=64, per_log_in_flight=16, start_index=0,
+                 batch_size=512, checkpoint=None, metrics=None, verify=False, rate_control="aimd", stagger_coef=0.01):
+        self.streams = []
+        self.weights = {}
+        self.vtime = {}
+        for url, weight, log_id in logs:
+            if rate_control == "stagger":
+                rate_controller = StaggerController(stagger_coef)
+            else:
+                rate_controller = AIMDRateController(max_limit=per_log_in_flight)
+            stream = CTlogsStream(ct_log_url=url, buffer=buffer, total_entries=total_entries, start_index=start_index,
+                                  max_in_flight=per_log_in_flight, rate_controller=rate_controller, batch_size=batch_size,
+                                  checkpoint=checkpoint, log_id=log_id, metrics=metrics, verify=verify)
+            self.streams.append(stream)
+            self.weights[stream.ct_log_url] = weight
+            self.vtime[stream.ct_log_url] = 0.0
+        self.clock = 0.0  # virtual time of the last dispatch
+        self.max_in_flight = max_in_flight
+        self.following = False
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+
+    def follow(self, poll_min=1.0, poll_max=30.0):
+        self.following = True
+        for stream in self.streams:
+            stream.follow(poll_min, poll_max)
+
+    def done(self):
+        return not self.following and all(stream.scheduler.done() for stream in self.streams)
+
+    def _pick(self):
+        """Return the stream to serve next with a rate-controller slot already held, or None."""
+        with self.lock:
+            active = [s for s in self.streams if not s.scheduler.exhausted()]
+            for stream in active:
+                # a log coming back from idle rejoins at the current virtual time, not with saved-up credit
+                self.vtime[stream.ct_log_url] = max(self.vtime[stream.ct_log_url], self.clock)
+            for stream in sorted(active, key=lambda s: self.vtime[s.ct_log_url]):
+                if stream.rate.try_acquire():
+                    url = stream.ct_log_url
+                    self.clock = self.vtime[url]
+                    self.vtime[url] += stream.scheduler.page_size / self.weights[url]
+                    return stream
+        return None
+
+    def _worker(self):
+        while not self.stop_event.is_set():
+            stream = self._pick()
+            if stream is None or not stream.stream_task(slot_held=True, defer_retries=True):
+                if self.done():
+                    break
+                time.sleep(0.05)
+
+    def start_stream(self):
+        threads = []
+        for i in range(self.max_in_flight):
+            t = threading.Thread(target=self._worker, name=f"fetch-{i}")
+            t.daemon = True
+            t.start()
+            threads.append(t)
+        for t in threads:
+            t.join()
+        for stream in self.streams:
+            stream.stop_event.set()
+            stream.report_verification()
+            stream.session.close()
+        print("Multi-log stream finished.")
@@ -1,11 +1,13 @@
-from multiprocessing import Process, Queue, Value
+from multiprocessing import Process, Value
 import time
 from stream import CTlogsStream
+from transport import QueueTransport
+from runner import consumer_process
 import argparse
-import sys
 
-def producer_process(ct_log_url, buffer, total_entries):
-    producer = CTlogsStream(ct_log_url=ct_log_url, buffer=buffer, total_entries=total_entries)
+def producer_process(ct_log_url, buffer, total_entries, start_index=0, end_index=None):
+    producer = CTlogsStream(ct_log_url=ct_log_url, buffer=buffer, total_entries=total_entries,
+                            start_index=start_index, end_index=end_index)
     producer.start_stream()
 
 
@@ -25,5 +27,26 @@ def main():
     broker = args.broker
     topic = args.topic
 
+    buffer = QueueTransport()
+    total_entries = Value('i', 0)
+    total_procs = Value('i', 0)
+    # last_index is inclusive, CTlogsStream's end_index is not
+    producer = Process(target=producer_process, args=(ctlog_url, buffer, total_entries, first_index, last_index + 1),
+                       daemon=True)
+    producer.start()
+    # decode and publish every certificate to the topic; no ClickHouse involved
+    consumer = Process(target=consumer_process, args=(buffer, total_procs),
+                       kwargs={"sinks": "kafka", "broker": broker, "topic": topic}, daemon=True)
+    consumer.start()
+
+    try:
+        while total_procs.value < last_index - first_index + 1:
+            time.sleep(2)
+            print(f"Fetched: {total_entries.value} - Produced to {topic}: {total_procs.value}")
+    except KeyboardInterrupt:
+        print("Shutting down...")
+    producer.terminate()
+    consumer.terminate()
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
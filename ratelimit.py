@@ -0,0 +1,177 @@
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+THROTTLE_STATUSES = (429, 503)
+
+
+def parse_retry_after(value, now=None):
+    """Return the Retry-After header as seconds, accepting both delta-seconds and HTTP-date forms.
+
+    An HTTP-date is counted from `now` (default: the current time).
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - (time.time() if now is None else now))
+    except (TypeError, ValueError):
+        return None
+
+
+class StaggerController:
+    """The original fixed launch delay: 0.12s plus `stagger_coef` per active request, no upper bound."""
+
+    def __init__(self, stagger_coef=0.01, base_delay=1, max_delay=60):
+        self.stagger_coef = stagger_coef
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.in_flight = 0
+        self.last_launch = 0.0
+        self.lock = threading.Lock()
+
+    @property
+    def current_limit(self):
+        return self.in_flight
+
+    @property
+    def current_stagger(self):
+        return 0.12 + self.in_flight * self.stagger_coef
+
+    def acquire(self, stop_event=None):
+        with self.lock:
+            stagger = self.current_stagger
+        time.sleep(stagger)
+        with self.lock:
+            self.in_flight += 1
+        return not (stop_event and stop_event.is_set())
+
+    def try_acquire(self):
+        """Non-blocking `acquire`: a slot only once the stagger has passed since the last launch."""
+        with self.lock:
+            now = time.time()
+            if now < self.last_launch + self.current_stagger:
+                return False
+            self.last_launch = now
+            self.in_flight += 1
+        return True
+
+    def release(self):
+        with self.lock:
+            self.in_flight -= 1
+
+    def on_success(self, latency):
+        pass
+
+    def on_throttle(self, retry_after=None):
+        pass
+
+    def on_error(self):
+        pass
+
+    def backoff(self, attempt):
+        return self.base_delay
+
+
+class AIMDRateController:
+    """Additive-increase/multiplicative-decrease limit on concurrent requests to one log.
+
+    Every successful response grows the limit by `increase / limit` (about +increase
+    per round trip). A 429/503 or a transport error cuts it by `decrease`, at most
+    once per smoothed round trip so a burst of throttled responses counts as one
+    congestion signal. Retry-After pauses new requests for the whole log, and a
+    latency rising above `latency_tolerance` times the best observed latency holds
+    the limit where it is.
+
+    `clock` (seconds, like `time.time`) and `rng` (a `random.Random`) can be
+    replaced to make the controller deterministic.
+    """
+
+    def __init__(self, initial_limit=4, min_limit=1, max_limit=64, increase=1.0, decrease=0.5,
+                 base_delay=0.5, max_delay=60, latency_tolerance=2.0, clock=time.time, rng=random):
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.increase = increase
+        self.decrease = decrease
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.latency_tolerance = latency_tolerance
+        self.clock = clock
+        self.rng = rng
+
+        self.in_flight = 0
+        self.cooldown_until = 0.0
+        self.last_decrease = 0.0
+        self.min_latency = None
+        self.avg_latency = None
+        self.throttled = 0
+        self.cond = threading.Condition()
+
+    @property
+    def current_limit(self):
+        return max(self.min_limit, int(self.limit))
+
+    @property
+    def current_stagger(self):
+        """Remaining Retry-After pause; there is no fixed launch delay."""
+        return max(0.0, self.cooldown_until - self.clock())
+
+    def _ready(self):
+        return self.in_flight < self.current_limit and self.clock() >= self.cooldown_until
+
+    def acquire(self, stop_event=None):
+        """Block until a request slot is free and no Retry-After pause is active. Returns False if stopped."""
+        with self.cond:
+            while not self._ready():
+                if stop_event and stop_event.is_set():
+                    return False
+                wait = max(0.0, self.cooldown_until - self.clock()) or 0.5
+                self.cond.wait(min(wait, 0.5))
+            self.in_flight += 1
+            return True
+
+    def try_acquire(self):
+        with self.cond:
+            if not self._ready():
+                return False
+            self.in_flight += 1
+            return True
+
+    def release(self):
+        with self.cond:
+            self.in_flight -= 1
+            self.cond.notify()
+
+    def on_success(self, latency):
+        with self.cond:
+            self.min_latency = latency if self.min_latency is None else min(self.min_latency, latency)
+            self.avg_latency = latency if self.avg_latency is None else 0.8 * self.avg_latency + 0.2 * latency
+            if self.avg_latency <= self.latency_tolerance * self.min_latency:
+                self.limit = min(self.max_limit, self.limit + self.increase / self.limit)
+            self.cond.notify_all()
+
+    def _decrease(self):
+        now = self.clock()
+        if now - self.last_decrease >= (self.avg_latency or 0):
+            self.limit = max(self.min_limit, self.limit * self.decrease)
+            self.last_decrease = now
+
+    def on_throttle(self, retry_after=None):
+        with self.cond:
+            self.throttled += 1
+            self._decrease()
+            if retry_after:
+                self.cooldown_until = max(self.cooldown_until, self.clock() + min(retry_after, self.max_delay))
+
+    def on_error(self):
+        with self.cond:
+            self._decrease()
+
+    def backoff(self, attempt):
+        """Full-jitter exponential backoff for retry number `attempt` (1-based)."""
+        return self.rng.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
@@ -1,17 +1,93 @@
-from multiprocessing import Process, Queue, Value
+from multiprocessing import Process, Value
 import time
 from stream import CTlogsStream
-from decrypt import CTLogsProcs
+from multilog import MultiLogStream, load_log_list
+from ratelimit import AIMDRateController, StaggerController
+from checkpoint import CheckpointStore
+from lease import LeaseStore
+from decrypt import CTLogsProcs, CERT_COLUMNS, get_db_client
+from fields import parse_columns
+from sinks import ClickHouseSink, KafkaSink, FanoutSink, ParquetSink
+from transport import QueueTransport, ShmRingTransport
+from spill import SpillBuffer
+from metrics import MetricsRegistry, serve
+from schema import migrate
+from watchlist import Watchlist, make_alert_sink
 import argparse
 
 
-def producer_process(ct_log_url, buffer, total_entries, start_index=0, end_index=None):
-    producer = CTlogsStream(ct_log_url=ct_log_url, buffer=buffer, total_entries=total_entries, start_index=start_index, end_index=end_index)
+def spill_wrap(buffer, checkpoint, spill_dir=None, spill_segment_bytes=256 * 1024 * 1024, spill_max_bytes=8 * 1024 * 1024 * 1024):
+    if not spill_dir:
+        return buffer
+    return SpillBuffer(buffer, spill_dir, segment_bytes=spill_segment_bytes, max_bytes=spill_max_bytes,
+                       is_committed=checkpoint.is_committed if checkpoint else None)
+
+
+def producer_process(ct_log_url, buffer, total_entries, start_index=0, end_index=None, fetch_mode="thread", max_in_flight=16,
+                     rate_control="aimd", stagger_coef=0.01, metrics=None, batch_size=512, checkpoint=None, follow=False,
+                     spill=None, verify=False, lease_store=None, lease_ttl=60.0, lease_seconds=120.0):
+    buffer = spill_wrap(buffer, checkpoint, *(spill or ()))
+    if rate_control == "stagger":
+        rate_controller = StaggerController(stagger_coef)
+    else:
+        rate_controller = AIMDRateController(max_limit=max_in_flight)
+    producer = CTlogsStream(ct_log_url=ct_log_url, buffer=buffer, total_entries=total_entries, start_index=start_index, end_index=end_index,
+                            max_in_flight=max_in_flight, rate_controller=rate_controller, metrics=metrics,
+                            batch_size=batch_size, checkpoint=checkpoint, verify=verify,
+                            lease_store=LeaseStore(lease_store) if lease_store else None, lease_ttl=lease_ttl,
+                            lease_seconds=lease_seconds)
+    if follow:
+        producer.follow()
+    if fetch_mode == "pool":
+        producer.start_stream_pool()
+    else:
+        producer.start_stream()
+
+
+def multilog_producer_process(log_list, buffer, total_entries, start_index=0, max_in_flight=64, per_log_in_flight=16,
+                              batch_size=512, checkpoint=None, follow=False, spill=None, metrics=None, verify=False,
+                              rate_control="aimd", stagger_coef=0.01):
+    buffer = spill_wrap(buffer, checkpoint, *(spill or ()))
+    producer = MultiLogStream(load_log_list(log_list), buffer, total_entries, max_in_flight=max_in_flight,
+                              per_log_in_flight=per_log_in_flight, start_index=start_index, batch_size=batch_size,
+                              checkpoint=checkpoint, metrics=metrics, verify=verify, rate_control=rate_control,
+                              stagger_coef=stagger_coef)
+    if follow:
+        producer.follow()
     producer.start_stream()
 
 
-def consumer_process(buffer, total_procs):
-    consumer = CTLogsProcs(buffer, total_procs)
+def make_sink(sinks="clickhouse", broker="localhost:9092", topic="ctlogs", kafka_compression="zstd", kafka_linger_ms=50,
+              insert_rows=100_000, insert_bytes=64 * 1024 * 1024, insert_age=5.0, async_insert=False,
+              parquet_dir="parquet", parquet_rows=1_000_000, metrics=None, columns=CERT_COLUMNS):
+    """Build the consumer's sink from a comma-separated list of sink names; several fan out from one decode pass."""
+    built = []
+    for name in sinks.split(","):
+        if name == "clickhouse":
+            built.append(ClickHouseSink(get_db_client(), get_db_client(), columns, max_rows=insert_rows,
+                                        max_bytes=insert_bytes, max_age=insert_age, async_insert=async_insert,
+                                        metrics=metrics))
+        elif name == "kafka":
+            built.append(KafkaSink(broker, topic, linger_ms=kafka_linger_ms, compression=kafka_compression))
+        elif name == "parquet":
+            built.append(ParquetSink(parquet_dir, rows_per_file=parquet_rows))
+        else:
+            raise ValueError(f"unknown sink {name!r}")
+    return built[0] if len(built) == 1 else FanoutSink(built)
+
+
+def consumer_process(buffer, total_procs, checkpoint=None, metrics=None, decode_mode="fast", insert_rows=100_000,
+                     insert_bytes=64 * 1024 * 1024, insert_age=5.0, async_insert=False,
+                     sinks="clickhouse", broker="localhost:9092", topic="ctlogs", kafka_compression="zstd", kafka_linger_ms=50,
+                     parquet_dir="parquet", parquet_rows=1_000_000, watchlist=None, watchlist_reload=5.0, alerts="-",
+                     columns=CERT_COLUMNS, lease_store=None):
+    sink = make_sink(sinks, broker, topic, kafka_compression, kafka_linger_ms,
+                     insert_rows, insert_bytes, insert_age, async_insert, parquet_dir, parquet_rows, metrics, columns)
+    watchlist = Watchlist(watchlist, watchlist_reload) if watchlist else None
+    alert_sink = make_alert_sink(alerts) if watchlist else None
+    consumer = CTLogsProcs(buffer, total_procs, checkpoint=checkpoint, metrics=metrics, decode_mode=decode_mode, sink=sink,
+                           watchlist=watchlist, alert_sink=alert_sink, columns=columns,
+                           leases=LeaseStore(lease_store) if lease_store else None)
     consumer.start_processing()
 
 
@@ -21,44 +97,140 @@ def run():
     parser.add_argument("--ctlog_url", type=str,
                         default="https://ct.cloudflare.com/logs/nimbus2025/",
                         help="CTLog source URL")
-    parser.add_argument("--start_index", type=int, default=0, help="First entry index")
-    parser.add_argument("--end_index", type=int, default=1000, help="Last entry index")
+    parser.add_argument("--ctlog_list", type=str, default=None,
+                        help="File listing logs to ingest together (one 'URL [weight]' per line, or a v3 log list JSON); overrides --ctlog_url")
+    parser.add_argument("--global_in_flight", type=int, default=64,
+                        help="Concurrent get-entries requests shared by all logs with --ctlog_list")
+    parser.add_argument("--start_index", type=int, default=0, help="First entry index (negative: counted back from the tree head)")
+    parser.add_argument("--end_index", type=int, default=1000, help="Last entry index (ignored with --follow)")
+    parser.add_argument("--follow", action="store_true",
+                        help="Keep polling get-sth and stream new entries as the log grows")
     parser.add_argument("--broker", type=str, default="localhost:9092", help="Kafka broker (host:port)")
     parser.add_argument("--topic", type=str, default="ctlogs", help="Kafka topic to produce to")
+    parser.add_argument("--sinks", type=str, default="clickhouse",
+                        help="Comma-separated sinks fed from one decode pass: clickhouse, kafka, parquet")
+    parser.add_argument("--kafka_compression", type=str, choices=["zstd", "lz4"], default="zstd",
+                        help="Compression codec for Kafka record batches")
+    parser.add_argument("--kafka_linger_ms", type=int, default=50, help="How long Kafka batches may wait to fill up")
+    parser.add_argument("--parquet_dir", type=str, default="parquet", help="Output directory of the parquet sink")
+    parser.add_argument("--parquet_rows", type=int, default=1_000_000, help="Rows per Parquet file")
+    parser.add_argument("--columns", type=str, default="default",
+                        help="Comma-separated certs columns to extract and write (see fields.py), e.g. default,not_before,key_type")
+    parser.add_argument("--watchlist", type=str, default=None,
+                        help="Domain watchlist file matched against every certificate's CN and SANs; reloaded when it changes")
+    parser.add_argument("--watchlist_reload", type=float, default=5.0, help="Seconds between checks of --watchlist for changes")
+    parser.add_argument("--alerts", type=str, default="-",
+                        help="Where watchlist matches go: - (stdout), a JSON lines file, an http(s):// webhook or kafka://broker/topic")
+    parser.add_argument("--skip_migrations", action="store_true",
+                        help="Do not apply pending ClickHouse schema migrations at startup (see schema.py)")
     parser.add_argument("--num_consumers", type=int, default=3, help="Number of consumer processes")
+    parser.add_argument("--decode_mode", type=str, choices=["fast", "reference"], default="fast",
+                        help="fast: parse the leaf DER once; reference: original pyOpenSSL/certlib decode path")
+    parser.add_argument("--transport", type=str, choices=["queue", "shm"], default="queue",
+                        help="queue: pickled JSON batches on a multiprocessing.Queue; shm: raw entry bytes in a shared-memory ring")
+    parser.add_argument("--ring_bytes", type=int, default=256 * 1024 * 1024,
+                        help="Shared-memory ring capacity for --transport shm; fetching blocks when it is full")
+    parser.add_argument("--slot_bytes", type=int, default=4 * 1024 * 1024, help="Size of one ring slot (one batch)")
+    parser.add_argument("--insert_rows", type=int, default=100_000, help="Rows buffered per consumer before an insert")
+    parser.add_argument("--insert_bytes", type=int, default=64 * 1024 * 1024, help="Approximate bytes buffered per consumer before an insert")
+    parser.add_argument("--insert_age", type=float, default=5.0, help="Seconds the oldest buffered row may wait before an insert")
+    parser.add_argument("--async_insert", action="store_true", help="Use ClickHouse async inserts (waiting for the flush)")
+    parser.add_argument("--fetch_mode", type=str, choices=["thread", "pool"], default=None,
+                        help="thread (default): one thread per batch with staggered launch; pool: fixed worker pool on a "
+                             "keep-alive session. --ctlog_list always uses its own worker pool")
+    parser.add_argument("--max_in_flight", type=int, default=16, help="Maximum concurrent get-entries requests per log")
+    parser.add_argument("--rate_control", type=str, choices=["aimd", "stagger"], default="aimd",
+                        help="aimd: adaptive concurrency limit driven by 429/503, Retry-After and latency; stagger: fixed launch delay")
+    parser.add_argument("--batch_size", type=int, default=512,
+                        help="Initial get-entries page size; shrinks to the log's own cap after the first short response")
+    parser.add_argument("--checkpoint", type=str, default=None,
+                        help="SQLite file for resumable progress; a restart resumes from it and refills gaps first")
+    parser.add_argument("--verify_merkle", action="store_true",
+                        help="Check every fetched leaf against the log's signed tree heads (RFC 6962 Merkle roots and consistency proofs)")
+    parser.add_argument("--lease_store", type=str, default=None,
+                        help="SQLite file shared by several nodes backfilling one --ctlog_url; each node leases index ranges from it")
+    parser.add_argument("--lease_ttl", type=float, default=60.0, help="Seconds a lease lives without a heartbeat")
+    parser.add_argument("--lease_seconds", type=float, default=120.0,
+                        help="Lease size in seconds of work at this node's measured fetch rate")
+    parser.add_argument("--spill_dir", type=str, default=None,
+                        help="Directory for the disk spill buffer; batches go to disk while the transport is full")
+    parser.add_argument("--spill_segment_bytes", type=int, default=256 * 1024 * 1024, help="Size of one spill segment file")
+    parser.add_argument("--spill_max_bytes", type=int, default=8 * 1024 * 1024 * 1024,
+                        help="Disk cap for --spill_dir; fetching blocks when it is reached")
+    parser.add_argument("--queue_batches", type=int, default=64,
+                        help="Batches held in the --transport queue before spilling (only with --spill_dir)")
+    parser.add_argument("--metrics_port", type=int, default=9108,
+                        help="Port of the Prometheus metrics endpoint (http://127.0.0.1:PORT/metrics); 0 disables it")
+    parser.add_argument("--stagger_coef", type=float, default=0.01, help="Per-worker delay coefficient for --rate_control stagger")
     
     args = parser.parse_args()
+    try:
+        columns = parse_columns(args.columns)
+    except ValueError as exc:
+        parser.error(str(exc))
+
+    # the schema is brought up to date once, here, before any worker starts; workers never touch DDL
+    if "clickhouse" in args.sinks.split(",") and not args.skip_migrations:
+        migrate(columns=columns)
+    if args.watchlist:
+        print(f"Watchlist {args.watchlist}: {len(Watchlist(args.watchlist))} patterns")  # fail before starting on a bad file
 
-    buffer_queue = Queue()
+    if args.transport == "shm":
+        buffer_queue = ShmRingTransport(args.ring_bytes, args.slot_bytes)
+    else:
+        # with a spill directory the in-memory queue is bounded and the overflow goes to disk
+        buffer_queue = QueueTransport(args.queue_batches if args.spill_dir else 0)
     total_procs = Value('i', 0)
     total_entries = Value('i', 0)
+    metrics = MetricsRegistry()
+    checkpoint = CheckpointStore(args.checkpoint) if args.checkpoint else None
+    spill = (args.spill_dir, args.spill_segment_bytes, args.spill_max_bytes) if args.spill_dir else None
 
     # Start stream
-    producer = Process(
-        target=producer_process,
-        args=(args.ctlog_url, buffer_queue, total_entries, args.start_index, args.end_index),
-        daemon=True
-    )
+    if args.ctlog_list:
+        if args.fetch_mode == "thread":
+            print("--fetch_mode thread does not apply to --ctlog_list, whose fetchers are always a shared worker pool")
+        producer = Process(
+            target=multilog_producer_process,
+            args=(args.ctlog_list, buffer_queue, total_entries, args.start_index, args.global_in_flight, args.max_in_flight,
+                  args.batch_size, checkpoint, args.follow, spill, metrics, args.verify_merkle, args.rate_control,
+                  args.stagger_coef),
+            daemon=True
+        )
+    else:
+        producer = Process(
+            target=producer_process,
+            args=(args.ctlog_url, buffer_queue, total_entries, args.start_index, None if args.follow else args.end_index, args.fetch_mode or "thread", args.max_in_flight,
+                  args.rate_control, args.stagger_coef, metrics, args.batch_size, checkpoint,
+                  args.follow, spill, args.verify_merkle, args.lease_store, args.lease_ttl, args.lease_seconds),
+            daemon=True
+        )
     producer.start()
 
     # Start Decode
     consumers = []
     for _ in range(args.num_consumers):
-        p = Process(target=consumer_process, args=(buffer_queue, total_procs), daemon=True)
+        p = Process(target=consumer_process,
+                    args=(buffer_queue, total_procs, checkpoint, metrics, args.decode_mode,
+                          args.insert_rows, args.insert_bytes, args.insert_age, args.async_insert,
+                          args.sinks, args.broker, args.topic, args.kafka_compression, args.kafka_linger_ms,
+                          args.parquet_dir, args.parquet_rows, args.watchlist, args.watchlist_reload, args.alerts,
+                          columns, args.lease_store),
+                    daemon=True)
         p.start()
         consumers.append(p)
 
-    # Monitoring loop
-    start_time = time.time()
+    # Monitoring: per-stage metrics are served over HTTP; the queue gauges are sampled here
+    if args.metrics_port:
+        serve(metrics, args.metrics_port)
+        print(f"Metrics at http://127.0.0.1:{args.metrics_port}/metrics")
     try:
         while True:
-            time.sleep(10)
-            elapsed = time.time() - start_time
-            print(f"Elapsed time: {elapsed:.2f}s")
-            print(f"Total Entries: {total_entries.value}")
-            print(f"Buffer size: {buffer_queue.qsize()}")
-            print(f"Total processed: {total_procs.value}")
-            print("-----")
+            time.sleep(1)
+            metrics.set("ctlog_queue_batches", buffer_queue.qsize())
+            metrics.set("ctlog_queue_bytes", buffer_queue.nbytes())
+            metrics.set("ctlog_queue_entries", metrics.total("ctlog_entries_fetched_total")
+                        - metrics.total("ctlog_entries_dequeued_total"))
     except KeyboardInterrupt:
         print("Shutting down...")
         producer.terminate()
@@ -66,6 +238,8 @@ def run():
         for c in consumers:
             c.terminate()
             c.join()
+        if args.transport == "shm":
+            buffer_queue.close(unlink=True)
 
 
 # In Jupyter, call run() explicitly
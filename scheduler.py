@@ -0,0 +1,102 @@
+import threading
+from collections import deque
+
+
+class RangeScheduler:
+    """Hands out get-entries ranges for one log and re-queues what a short response left unfilled.
+
+    Ranges are inclusive `(start, end)` pairs, like the get-entries API; `end_index`
+    is exclusive, like `CTlogsStream.end_index`. Logs cap responses (commonly at 256
+    or 1024 entries), so once two short replies to page-aligned requests came back
+    with the same size it is taken as the log's page size and later requests are
+    cut on multiples of it, which is where such logs start their pages. A single
+    short reply (e.g. a log under load trimming one response) changes nothing.
+    """
+
+    def __init__(self, start_index, end_index, page_size=512, pending=()):
+        self.next_index = start_index  # first index never handed out
+        self.end_index = end_index
+        self.page_size = page_size
+        self.short_size = None  # size of a short page-aligned reply, until a second one confirms it
+        self.pending = deque(pending)  # remainders, re-queued and resumed ranges, served first
+        self.failed = []  # ranges given up on after max_retries
+        self.in_flight = 0
+        self.lock = threading.Lock()
+
+    def _page_end(self, start):
+        return (start // self.page_size + 1) * self.page_size - 1
+
+    def claim(self):
+        """Return the next `(start, end)` range to fetch, or None if nothing is claimable right now."""
+        with self.lock:
+            if self.pending:
+                start, end = self.pending.popleft()
+                page_end = self._page_end(start)
+                if end > page_end:
+                    self.pending.appendleft((page_end + 1, end))
+                    end = page_end
+            elif self.next_index < self.end_index:
+                start = self.next_index
+                end = min(self._page_end(start), self.end_index - 1)
+                self.next_index = end + 1
+            else:
+                return None
+            self.in_flight += 1
+            return start, end
+
+    def complete(self, start, end, received):
+        """Record that `received` entries came back for `(start, end)`; the unfilled tail is re-queued."""
+        with self.lock:
+            self.in_flight -= 1
+            requested = end - start + 1
+            if 0 < received < requested:
+                if start % self.page_size == 0 and received < self.page_size:
+                    if received == self.short_size:
+                        self.page_size = received
+                        self.short_size = None
+                    else:
+                        self.short_size = received
+                self.pending.appendleft((start + received, end))
+            elif received == requested and self.short_size is not None and requested > self.short_size:
+                self.short_size = None  # a fuller reply: that short one was not the log's cap
+
+    def fail(self, start, end):
+        with self.lock:
+            self.in_flight -= 1
+            self.failed.append((start, end))
+
+    def release(self, start, end):
+        """Put back a claimed range that was not fetched (e.g. on stop)."""
+        with self.lock:
+            self.in_flight -= 1
+            self.pending.appendleft((start, end))
+
+    def add(self, start, end):
+        """Queue the range `(start, end)` after the work already pending, e.g. a newly leased range."""
+        with self.lock:
+            self.pending.append((start, end))
+
+    def drop(self, start, end):
+        """Stop fetching `(start, end)`: pending work inside it is discarded, e.g. a lease given up on."""
+        with self.lock:
+            kept = deque()
+            for p_start, p_end in self.pending:
+                if p_start < start:
+                    kept.append((p_start, min(p_end, start - 1)))
+                if p_end > end:
+                    kept.append((max(p_start, end + 1), p_end))
+            self.pending = kept
+
+    def extend(self, end_index):
+        """Grow the range to `end_index` (exclusive), e.g. when a newer STH reports a larger tree."""
+        with self.lock:
+            self.end_index = max(self.end_index, end_index)
+
+    def exhausted(self):
+        """True when nothing is left to claim, though in-flight requests may still re-queue a tail."""
+        with self.lock:
+            return not self.pending and self.next_index >= self.end_index
+
+    def done(self):
+        with self.lock:
+            return not self.pending and self.next_index >= self.end_index and self.in_flight == 0
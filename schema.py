@@ -0,0 +1,150 @@
+import sys
+
+from fields import DEFAULT_COLUMNS, add_column, parse_columns
+
+DATABASE = 'certs_db'
+
+CLICKHOUSE = {
+    'host': 'localhost',
+    'port': 8123,
+    'username': 'default',
+    'password': 'mysecretpassword',
+}
+
+# (version, description, statements); append only, never edit an applied migration.
+# Every statement is idempotent on its own, so a migration interrupted halfway is simply run again.
+MIGRATIONS = [
+    (1, "certs and issuers tables", [
+        # the default columns; other columns selected from the field registry are added by `migrate`
+        f'''
+        CREATE TABLE IF NOT EXISTS {DATABASE}.certs (
+            log_id LowCardinality(String),
+            cert_index UInt32,
+            sha1_fingerprint String,
+            issuer_id UInt64,
+            subject_country String,
+            subject_state String,
+            subject_organization String,
+            subject_serial_number String,
+            subject_common_name String,
+            san String,
+            subject_business_category String,
+            subject_jurisdiction_state String,
+            subject_jurisdiction_country String,
+            not_after DateTime
+        ) ENGINE = MergeTree()
+        ORDER BY (log_id, cert_index)
+        ''',
+        # Issuer dimension table, deduplicated on merge; certs rows only carry issuer_id
+        f'''
+        CREATE TABLE IF NOT EXISTS {DATABASE}.issuers (
+            issuer_id UInt64,
+            issuer_country String,
+            issuer_organization String,
+            issuer_common_name String
+        ) ENGINE = ReplacingMergeTree()
+        ORDER BY issuer_id
+        ''',
+    ]),
+    (2, "quarantine table", [
+        # Entries that could not be decoded, kept raw with their index for inspection and replay
+        f'''
+        CREATE TABLE IF NOT EXISTS {DATABASE}.quarantine (
+            log_id LowCardinality(String),
+            cert_index UInt64,
+            error String,
+            leaf_input String,
+            extra_data String,
+            quarantined_at DateTime DEFAULT now()
+        ) ENGINE = MergeTree()
+        ORDER BY (log_id, cert_index)
+        ''',
+    ]),
+]
+
+
+def get_client(database=DATABASE):
+    """New ClickHouse client; the driver is imported here so processes that never insert do not pay for it."""
+    import clickhouse_connect
+    return clickhouse_connect.get_client(database=database, **CLICKHOUSE)
+
+
+class LazyClient:
+    """A ClickHouse client that connects on first use and is then reused for every call.
+
+    Cheap to create, so decode workers start without waiting for a connection.
+    """
+
+    def __init__(self, database=DATABASE):
+        self.database = database
+        self._client = None
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            # not set yet (e.g. while unpickling, before __init__): don't recurse through self._client
+            raise AttributeError(name)
+        if self._client is None:
+            self._client = get_client(self.database)
+        return getattr(self._client, name)
+
+
+def migrate(client=None, columns=DEFAULT_COLUMNS):
+    """Bring the schema up to the latest version and return the versions applied now.
+
+    Never drops anything, so running it on every start (or from several
+    runners at once) is safe. Applied versions are recorded in
+    `schema_migrations`. Selected `columns` (see `fields.parse_columns`)
+    missing from `certs` are added from the field registry afterwards;
+    columns not selected are left alone.
+    """
+    client = client or get_client(database='default')
+    client.command(f'CREATE DATABASE IF NOT EXISTS {DATABASE}')
+    client.command(f'''
+        CREATE TABLE IF NOT EXISTS {DATABASE}.schema_migrations (
+            version UInt32,
+            description String,
+            applied_at DateTime DEFAULT now()
+        ) ENGINE = ReplacingMergeTree()
+        ORDER BY version
+    ''')
+    applied = {row[0] for row in client.query(f'SELECT version FROM {DATABASE}.schema_migrations').result_rows}
+    newly_applied = []
+    for version, description, statements in MIGRATIONS:
+        if version in applied:
+            continue
+        for statement in statements:
+            client.command(statement)
+        client.insert(f'{DATABASE}.schema_migrations', [(version, description)], column_names=['version', 'description'])
+        print(f"Applied schema migration {version}: {description}")
+        newly_applied.append(version)
+    existing = {row[0] for row in client.query(f"SELECT name FROM system.columns WHERE database = '{DATABASE}' "
+                                               f"AND table = 'certs'").result_rows}
+    for name in columns:
+        if name not in existing:
+            client.command(add_column(f'{DATABASE}.certs', name))
+            print(f"Added column certs.{name}")
+    return newly_applied
+
+
+def parquet_load(columns=DEFAULT_COLUMNS, files="parquet/*/*/part-*.parquet"):
+    """The INSERT statements that load ParquetSink files written with `columns` into certs (and issuers).
+
+    Columns are named on both sides, since `INSERT ... SELECT` maps them by position.
+    """
+    names = ", ".join(columns)
+    statements = [f"INSERT INTO {DATABASE}.certs ({names})\nSELECT {names}\nFROM file('{files}', Parquet);"]
+    if 'issuer_id' in columns:
+        issuer_names = "issuer_id, issuer_country, issuer_organization, issuer_common_name"
+        statements.append(f"INSERT INTO {DATABASE}.issuers ({issuer_names})\nSELECT DISTINCT {issuer_names}\n"
+                          f"FROM file('{files}', Parquet);")
+    return statements
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["parquet_load"]:
+        # python schema.py parquet_load [COLUMNS [FILES]]: print the SQL loading a Parquet backfill
+        print("\n\n".join(parquet_load(parse_columns(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_COLUMNS,
+                                       *sys.argv[3:4])))
+    else:
+        # python schema.py [COLUMNS]: migrate, adding the selected columns (e.g. default,not_before,key_type)
+        migrate(columns=parse_columns(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_COLUMNS)
@@ -0,0 +1,502 @@
+import base64
+import json
+import os
+import re
+import threading
+import time
+import zlib
+from datetime import datetime
+
+from fields import FIELDS
+from writer import CoalescingWriter, insert_with_retry, is_transient
+
+pa = pq = None  # pyarrow, imported by the first ParquetSink; only it needs it and the import is slow
+
+ISSUER_COLUMNS = ['issuer_id', 'issuer_country', 'issuer_organization', 'issuer_common_name']
+QUARANTINE_COLUMNS = ['log_id', 'cert_index', 'error', 'leaf_input', 'extra_data']
+
+
+def _quarantine_record(failure):
+    log_id, cert_index, error, leaf_input, extra_data = failure
+    return {
+        "log_id": log_id,
+        "cert_index": cert_index,
+        "error": error,
+        "leaf_input": base64.b64encode(leaf_input).decode(),
+        "extra_data": base64.b64encode(extra_data).decode(),
+    }
+
+
+class Sink:
+    """Destination for decoded certificate rows.
+
+    `write` receives one queue item's rows as `{column: values}` plus the issuers
+    first seen in it as `(issuer_id, country, organization, common_name)`
+    tuples, and must not block on I/O longer than its own backpressure needs;
+    `on_commit()` runs (on any thread) once the rows are durable in the sink.
+
+    `quarantine` receives entries that failed to decode as
+    `(log_id, cert_index, error, leaf_input, extra_data)` tuples. It is called
+    before the batch's `write` and must have stored them when it returns, since
+    the batch's `on_commit` covers the quarantined entries too: transient
+    failures are retried until they succeed, and only an error retrying cannot
+    fix is raised (which stops the consumer with the batch uncommitted).
+    """
+
+    def write(self, columns, rows, nbytes=0, issuers=(), on_commit=None):
+        raise NotImplementedError
+
+    def quarantine(self, failures):
+        for log_id, cert_index, error, _, _ in failures:
+            print(f"Entry {cert_index} of {log_id} could not be decoded: {error}")
+
+    def close(self):
+        pass
+
+
+class ClickHouseSink(Sink):
+    """Coalesced column-oriented inserts into `certs`, with new issuers inserted synchronously first.
+
+    The synchronous issuer and quarantine inserts retry transient errors with
+    the writer's backoff, so a ClickHouse outage stalls decoding instead of
+    ending it.
+    """
+
+    def __init__(self, db_client, writer_client, column_names, max_rows=100_000, max_bytes=64 * 1024 * 1024,
+                 max_age=5.0, async_insert=False, retry_delay=1, max_retry_delay=30, metrics=None):
+        self.db_client = db_client
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.writer = CoalescingWriter(writer_client, 'certs', column_names, max_rows=max_rows, max_bytes=max_bytes,
+                                       max_age=max_age, async_insert=async_insert, retry_delay=retry_delay,
+                                       max_retry_delay=max_retry_delay, metrics=metrics)
+
+    def _insert(self, table, rows, column_names):
+        insert_with_retry(self.db_client, table, rows, len(rows), retry_delay=self.retry_delay,
+                          max_retry_delay=self.max_retry_delay, transient=is_transient, column_names=column_names)
+
+    def write(self, columns, rows, nbytes=0, issuers=(), on_commit=None):
+        # Issuers first, so every certs row can be joined as soon as it lands
+        if issuers:
+            self._insert('issuers', list(issuers), ISSUER_COLUMNS)
+        self.writer.append(columns, rows, nbytes, on_commit=on_commit)
+
+    def quarantine(self, failures):
+        self._insert('quarantine', list(failures), QUARANTINE_COLUMNS)
+
+    def close(self):
+        self.writer.close()
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return int(value.timestamp())
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+class KafkaSink(Sink):
+    """One JSON message per certificate, produced through a tuned, idempotent `confluent_kafka.Producer`.
+
+    librdkafka batches messages per partition for up to `linger_ms` or
+    `batch_bytes` and compresses whole batches (`zstd` or `lz4`), so throughput
+    comes from the batching, not from per-message calls. With idempotence the
+    broker drops duplicates from internal retries and keeps per-partition order.
+
+    The key is `log_id:block` with `block = cert_index // key_span`: contiguous
+    index blocks of a log land on one partition in index order, while blocks
+    spread over all partitions. Messages carry the issuer strings alongside
+    `issuer_id`, so downstream consumers need no dimension table.
+
+    `producer` may be passed in (e.g. `MemoryBroker().producer()`); otherwise
+    one is created for `broker`. If the producer's local queue stays full for
+    `queue_timeout` seconds (the broker is unreachable), `write` raises
+    BufferError and the batch is left uncommitted.
+    """
+
+    def __init__(self, broker, topic, linger_ms=50, batch_bytes=1024 * 1024, compression="zstd", key_span=4096,
+                 producer=None, queue_timeout=60.0):
+        self.topic = topic
+        self.key_span = key_span
+        self.queue_timeout = queue_timeout
+        if producer is None:
+            from confluent_kafka import Producer
+            producer = Producer({
+                'bootstrap.servers': broker,
+                'linger.ms': linger_ms,
+                'batch.size': batch_bytes,
+                'compression.type': compression,
+                'enable.idempotence': True,
+                'acks': 'all',
+            })
+        self.producer = producer
+        self.issuers = {}  # issuer_id -> (country, organization, common_name) seen by this worker
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._poll, name=f"kafka-{topic}", daemon=True)
+        self.thread.start()
+
+    def _poll(self):
+        # serves delivery callbacks
+        while not self.stop_event.is_set():
+            self.producer.poll(0.1)
+
+    def write(self, columns, rows, nbytes=0, issuers=(), on_commit=None):
+        for issuer_id, *fields in issuers:
+            self.issuers[issuer_id] = fields
+        if not rows:
+            if on_commit:
+                on_commit()
+            return
+        names = list(columns)
+        pending = [rows]
+        lock = threading.Lock()
+
+        def delivered(err, msg):
+            if err is not None:
+                # the range stays uncommitted and is fetched again on restart
+                print(f"Kafka delivery to {self.topic} failed: {err}")
+                return
+            with lock:
+                pending[0] -= 1
+                done = pending[0] == 0
+            if done and on_commit:
+                on_commit()
+
+        for values in zip(*(columns[name] for name in names)):
+            row = dict(zip(names, values))
+            if 'issuer_id' in row:
+                country, organization, common_name = self.issuers.get(row['issuer_id'], ("", "", ""))
+                row.update(issuer_country=country, issuer_organization=organization, issuer_common_name=common_name)
+            key = f"{row['log_id']}:{row['cert_index'] // self.key_span}".encode()
+            value = json.dumps(row, default=_json_default).encode()
+            self._produce(self.topic, value, key, delivered)
+
+    def _produce(self, topic, value, key, on_delivery=None):
+        deadline = None
+        while True:
+            try:
+                self.producer.produce(topic, value=value, key=key, on_delivery=on_delivery)
+                return
+            except BufferError:
+                # local queue full: wait for deliveries, but not forever
+                now = time.time()
+                deadline = deadline or now + self.queue_timeout
+                if now >= deadline:
+                    raise BufferError(f"Kafka producer queue for {topic} still full after {self.queue_timeout}s") from None
+                self.producer.poll(0.1)
+
+    def quarantine(self, failures):
+        # rare, so simply wait for the deliveries: the batch is committed right after
+        topic = f"{self.topic}.quarantine"
+        errors = []
+        for failure in failures:
+            record = _quarantine_record(failure)
+            key = f"{record['log_id']}:{record['cert_index'] // self.key_span}".encode()
+            self._produce(topic, json.dumps(record).encode(), key,
+                          lambda err, msg: err is not None and errors.append(err))
+        self.producer.flush()
+        if errors:
+            raise RuntimeError(f"Kafka delivery to {topic} failed: {errors[0]}")
+
+    def close(self):
+        self.producer.flush()
+        self.stop_event.set()
+        self.thread.join()
+
+
+class FanoutSink(Sink):
+    """Writes every batch to several sinks from one decode pass; `on_commit` runs once all of them have committed."""
+
+    def __init__(self, sinks):
+        self.sinks = list(sinks)
+
+    def write(self, columns, rows, nbytes=0, issuers=(), on_commit=None):
+        remaining = [len(self.sinks)]
+        lock = threading.Lock()
+
+        def committed():
+            with lock:
+                remaining[0] -= 1
+                done = remaining[0] == 0
+            if done and on_commit:
+                on_commit()
+
+        for sink in self.sinks:
+            sink.write(columns, rows, nbytes, issuers, committed)
+
+    def quarantine(self, failures):
+        for sink in self.sinks:
+            sink.quarantine(failures)
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
+
+
+# issuer strings repeated across most rows of a file; dictionary encoded in Arrow and Parquet like the
+# LowCardinality columns of the field registry
+DICTIONARY_COLUMNS = {'issuer_country', 'issuer_organization', 'issuer_common_name'}
+
+
+def _load_pyarrow():
+    global pa, pq
+    if pa is None:
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError("ParquetSink needs pyarrow (pip install pyarrow)") from None
+        pa, pq = pyarrow, pyarrow.parquet
+
+
+def _arrow_type(name):
+    """Arrow type of a column, following its ClickHouse type in fields.FIELDS."""
+    ch_type = 'LowCardinality(String)' if name in DICTIONARY_COLUMNS else FIELDS[name][0]
+    if ch_type == 'UInt32':
+        return pa.uint32()
+    if ch_type == 'UInt64':
+        return pa.uint64()
+    if ch_type == 'DateTime':
+        return pa.timestamp('s', tz='UTC')
+    if ch_type.startswith('LowCardinality'):
+        return pa.dictionary(pa.int32(), pa.string())
+    return pa.string()
+
+
+class _Partition:
+    def __init__(self, log_id, range_start):
+        self.log_id = log_id
+        self.range_start = range_start
+        self.batches = []  # record batches not yet written as a row group
+        self.batch_rows = 0
+        self.writer = None
+        self.tmp_path = None
+        self.rows = 0  # rows in the open file
+        self.first_index = None
+        self.last_index = None
+        self.callbacks = []
+        self.touched = time.time()
+
+
+class ParquetSink(Sink):
+    """Rolling Parquet files for offline backfills, loadable into ClickHouse in one bulk pass.
+
+    Rows are partitioned by log and by index range (`range_span` entries), as
+    `directory/<log>/<range start>/part-<pid>-<seq>.parquet`. Every `write` becomes
+    one Arrow record batch; batches are written as row groups of about
+    `row_group_rows` and a file is closed at `rows_per_file` rows. `log_id` and
+    the issuer strings (carried next to `issuer_id`, since there is no issuers
+    table offline) are dictionary encoded.
+
+    A file is written under a temporary name and renamed when complete; only
+    then are its batches' `on_commit` callbacks run and a line with its path,
+    log, index bounds and row count appended to `directory/manifest.jsonl`.
+    At most `max_open` partitions are buffered; the least recently written one
+    is closed early beyond that. A partition that received nothing for
+    `max_idle` seconds is closed too, so the tail of a backfill is flushed.
+    """
+
+    def __init__(self, directory, rows_per_file=1_000_000, row_group_rows=65_536, range_span=10_000_000,
+                 compression="zstd", max_open=8, max_idle=30.0):
+        _load_pyarrow()
+        self.directory = directory
+        self.rows_per_file = rows_per_file
+        self.row_group_rows = row_group_rows
+        self.range_span = range_span
+        self.compression = compression
+        self.max_open = max_open
+        self.max_idle = max_idle
+        self.issuers = {}  # issuer_id -> (country, organization, common_name) seen by this worker
+        self.partitions = {}
+        self.schema = None
+        self.sequence = 0
+        os.makedirs(directory, exist_ok=True)
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._close_idle, name="parquet-idle", daemon=True)
+        self.thread.start()
+
+    def _close_idle(self):
+        while not self.stop_event.wait(1):
+            with self.lock:
+                now = time.time()
+                for partition in list(self.partitions.values()):
+                    if now - partition.touched >= self.max_idle:
+                        self._close_file(partition)
+
+    def write(self, columns, rows, nbytes=0, issuers=(), on_commit=None):
+        for issuer_id, *fields in issuers:
+            self.issuers[issuer_id] = fields
+        if not rows:
+            if on_commit:
+                on_commit()
+            return
+        with self.lock:
+            self._write(columns, rows, on_commit)
+
+    def _write(self, columns, rows, on_commit):
+        log_id = columns['log_id'][0]
+        indexes = columns['cert_index']
+        key = (log_id, min(indexes) // self.range_span * self.range_span)
+        partition = self.partitions.get(key)
+        if partition is None:
+            if len(self.partitions) >= self.max_open:
+                self._close_file(min(self.partitions.values(), key=lambda p: p.touched))
+            partition = self.partitions[key] = _Partition(*key)
+
+        partition.batches.append(self._record_batch(columns))
+        partition.batch_rows += rows
+        partition.rows += rows
+        partition.first_index = min(indexes) if partition.first_index is None else min(partition.first_index, min(indexes))
+        partition.last_index = max(indexes) if partition.last_index is None else max(partition.last_index, max(indexes))
+        partition.touched = time.time()
+        if on_commit:
+            partition.callbacks.append(on_commit)
+        if partition.batch_rows >= self.row_group_rows:
+            self._write_row_group(partition)
+        if partition.rows >= self.rows_per_file:
+            self._close_file(partition)
+
+    def _record_batch(self, columns):
+        values = dict(columns)
+        if 'issuer_id' in columns:  # unless the deployment does not select issuers
+            issuers = [self.issuers.get(i, ("", "", "")) for i in columns['issuer_id']]
+            values['issuer_country'] = [i[0] for i in issuers]
+            values['issuer_organization'] = [i[1] for i in issuers]
+            values['issuer_common_name'] = [i[2] for i in issuers]
+        if self.schema is None:
+            self.schema = pa.schema([(name, _arrow_type(name)) for name in values])
+        arrays = []
+        for field in self.schema:
+            if pa.types.is_dictionary(field.type):
+                arrays.append(pa.array(values[field.name], pa.string()).dictionary_encode())
+            else:
+                arrays.append(pa.array(values[field.name], field.type))
+        return pa.RecordBatch.from_arrays(arrays, schema=self.schema)
+
+    def _write_row_group(self, partition):
+        if not partition.batches:
+            return
+        if partition.writer is None:
+            folder = os.path.join(self.directory, re.sub(r'[^A-Za-z0-9._-]+', '_', partition.log_id),
+                                  f"{partition.range_start:012d}")
+            os.makedirs(folder, exist_ok=True)
+            self.sequence += 1
+            partition.tmp_path = os.path.join(folder, f".part-{os.getpid()}-{self.sequence:06d}.parquet.tmp")
+            partition.writer = pq.ParquetWriter(partition.tmp_path, self.schema, compression=self.compression,
+                                                use_dictionary=True)
+        partition.writer.write_table(pa.Table.from_batches(partition.batches, schema=self.schema))
+        partition.batches = []
+        partition.batch_rows = 0
+
+    def _close_file(self, partition):
+        self._write_row_group(partition)
+        partition.writer.close()
+        folder, name = os.path.split(partition.tmp_path)
+        path = os.path.join(folder, name[1:-len(".tmp")])
+        os.replace(partition.tmp_path, path)
+        with open(os.path.join(self.directory, "manifest.jsonl"), "a") as manifest:
+            manifest.write(json.dumps({
+                "path": os.path.relpath(path, self.directory),
+                "log_id": partition.log_id,
+                "first_index": partition.first_index,
+                "last_index": partition.last_index,
+                "rows": partition.rows,
+                "bytes": os.path.getsize(path),
+            }) + "\n")
+        del self.partitions[(partition.log_id, partition.range_start)]
+        for callback in partition.callbacks:
+            callback()
+
+    def quarantine(self, failures):
+        with open(os.path.join(self.directory, "quarantine.jsonl"), "a") as f:
+            for failure in failures:
+                f.write(json.dumps(_quarantine_record(failure)) + "\n")
+
+    def close(self):
+        self.stop_event.set()
+        self.thread.join()
+        with self.lock:
+            for partition in list(self.partitions.values()):
+                self._close_file(partition)
+
+
+class _Message:
+    def __init__(self, topic, partition, offset, key, value):
+        self._topic = topic
+        self._partition = partition
+        self._offset = offset
+        self._key = key
+        self._value = value
+
+    def topic(self):
+        return self._topic
+
+    def partition(self):
+        return self._partition
+
+    def offset(self):
+        return self._offset
+
+    def key(self):
+        return self._key
+
+    def value(self):
+        return self._value
+
+
+class MemoryBroker:
+    """In-memory stand-in for a Kafka cluster, for exercising KafkaSink without a broker.
+
+    `producer()` returns an object with the subset of the `confluent_kafka.Producer`
+    API KafkaSink uses; delivery callbacks fire on `poll`/`flush`, as with
+    librdkafka. Messages are kept per topic and partition in `topics`. Setting
+    `fail` makes deliveries report an error instead.
+    """
+
+    def __init__(self, partitions=4):
+        self.partitions = partitions
+        self.topics = {}
+        self.fail = None
+        self.lock = threading.Lock()
+
+    def producer(self):
+        return _MemoryProducer(self)
+
+    def messages(self, topic):
+        """All messages of `topic`, partition by partition."""
+        return [m for partition in self.topics.get(topic, []) for m in partition]
+
+
+class _MemoryProducer:
+    def __init__(self, broker):
+        self.broker = broker
+        self.pending = []
+        self.lock = threading.Lock()
+
+    def produce(self, topic, value=None, key=None, on_delivery=None):
+        with self.lock:
+            self.pending.append((topic, key, value, on_delivery))
+
+    def poll(self, timeout=0):
+        with self.lock:
+            pending, self.pending = self.pending, []
+        for topic, key, value, on_delivery in pending:
+            broker = self.broker
+            with broker.lock:
+                partitions = broker.topics.setdefault(topic, [[] for _ in range(broker.partitions)])
+                partition = zlib.crc32(key or b"") % broker.partitions
+                message = _Message(topic, partition, len(partitions[partition]), key, value)
+                if broker.fail is None:
+                    partitions[partition].append(message)
+            if on_delivery:
+                on_delivery(broker.fail, message)
+        if not pending and timeout:
+            time.sleep(timeout)
+        return len(pending)
+
+    def flush(self, timeout=None):
+        self.poll()
+        return 0
+
+    def __len__(self):
+        return len(self.pending)
@@ -0,0 +1,149 @@
+import glob
+import json
+import mmap
+import os
+import struct
+import threading
+
+from transport import CTLogBatch, pack_entries
+
+_RECORD = struct.Struct("<II")  # header length, payload length
+
+
+class _Segment:
+    def __init__(self, path, size):
+        self.path = path
+        self.size = size
+        with open(path, "wb") as f:
+            f.truncate(size)
+        self.file = open(path, "r+b")
+        self.mm = mmap.mmap(self.file.fileno(), size)
+        self.write_offset = 0
+        self.read_offset = 0
+        self.sealed = False
+        self.ranges = []  # (log_url, start, end) of every record, for the commit check
+        self.committed = 0  # leading ranges already seen committed
+
+    def close(self):
+        self.mm.close()
+        self.file.close()
+        os.remove(self.path)
+
+
+class SpillBuffer:
+    """Disk-backed overflow between CTlogsStream and a transport.
+
+    Batches go straight to the `inner` transport while it has room. Once it is
+    full (the database is slow or down), they are appended to memory-mapped
+    segment files in `directory` instead, so fetchers keep their pace. A replay
+    thread feeds spilled records back in order as soon as the transport drains.
+    A segment is deleted once all of its records have been replayed and, when
+    `is_committed(log_url, start, end)` is given (e.g.
+    `CheckpointStore.is_committed`), their rows are in ClickHouse. Disk use is
+    capped at `max_bytes`; beyond it `put` blocks like a full transport.
+
+    Each record holds a small JSON header (log ID, URL, start index, STH
+    timestamp) and the packed raw entries. Segments left over from an earlier
+    run are discarded on start: their ranges are still gaps in the checkpoint
+    and get fetched again.
+    """
+
+    def __init__(self, inner, directory, segment_bytes=256 * 1024 * 1024, max_bytes=8 * 1024 * 1024 * 1024,
+                 is_committed=None):
+        self.inner = inner
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.is_committed = is_committed
+        os.makedirs(directory, exist_ok=True)
+        for stale in glob.glob(os.path.join(directory, "spill-*.seg")):
+            os.remove(stale)
+
+        self.segments = []  # oldest first
+        self.next_segment = 0
+        self.disk_bytes = 0
+        self.unreplayed = 0
+        self.cond = threading.Condition()
+        self.thread = threading.Thread(target=self._replay, name="spill-replay", daemon=True)
+        self.thread.start()
+
+    def put(self, batch):
+        with self.cond:
+            rest = [batch] if self.unreplayed else self.inner.offer(batch)
+            for part in rest:
+                self._append(part)
+
+    def _new_segment(self, min_size):
+        size = max(self.segment_bytes, min_size)
+        while self.segments and self.disk_bytes + size > self.max_bytes:
+            self.cond.wait(1)  # disk cap reached: wait for replayed, committed segments to be deleted
+            self._collect()
+        path = os.path.join(self.directory, f"spill-{self.next_segment:08d}.seg")
+        self.next_segment += 1
+        segment = _Segment(path, size)
+        self.segments.append(segment)
+        self.disk_bytes += size
+        return segment
+
+    def _append(self, batch):
+        payload = pack_entries(batch.payload)
+        header = json.dumps([batch.log_id, batch.log_url, batch.start_index, batch.sth_timestamp]).encode()
+        record_size = _RECORD.size + len(header) + len(payload)
+
+        segment = self.segments[-1] if self.segments and not self.segments[-1].sealed else None
+        if segment is None or segment.write_offset + record_size > segment.size:
+            if segment is not None:
+                segment.sealed = True
+            segment = self._new_segment(record_size)
+        offset = segment.write_offset
+        _RECORD.pack_into(segment.mm, offset, len(header), len(payload))
+        offset += _RECORD.size
+        segment.mm[offset:offset + len(header)] = header
+        offset += len(header)
+        segment.mm[offset:offset + len(payload)] = payload
+        segment.write_offset = offset + len(payload)
+        segment.ranges.append((batch.log_url, batch.start_index, batch.end_index))
+        self.unreplayed += 1
+        self.cond.notify_all()
+
+    def _read(self, segment):
+        offset = segment.read_offset
+        header_len, payload_len = _RECORD.unpack_from(segment.mm, offset)
+        offset += _RECORD.size
+        log_id, log_url, start_index, sth_timestamp = json.loads(segment.mm[offset:offset + header_len])
+        offset += header_len
+        payload = segment.mm[offset:offset + payload_len]  # one sequential copy out of the page cache
+        segment.read_offset = offset + payload_len
+        return CTLogBatch(log_id, log_url, start_index, payload, sth_timestamp)
+
+    def _replay(self):
+        while True:
+            with self.cond:
+                while not self.unreplayed:
+                    self.cond.wait(1)
+                    self._collect()
+                segment = next(s for s in self.segments if s.read_offset < s.write_offset)
+                batch = self._read(segment)
+            self.inner.put(batch)  # blocks until the transport has room
+            with self.cond:
+                self.unreplayed -= 1
+                self._collect()
+                self.cond.notify_all()
+
+    def _collect(self):
+        """Delete the oldest segments whose records are all replayed and committed."""
+        while self.segments:
+            segment = self.segments[0]
+            if segment.read_offset < segment.write_offset or not (segment.sealed or not self.unreplayed):
+                break
+            if self.is_committed:
+                while segment.committed < len(segment.ranges) and self.is_committed(*segment.ranges[segment.committed]):
+                    segment.committed += 1
+                if segment.committed < len(segment.ranges):
+                    break
+            self.segments.pop(0)
+            self.disk_bytes -= segment.size
+            segment.close()
+
+    def spilled_bytes(self):
+        return self.disk_bytes
@@ -4,15 +4,58 @@ import base64
 import time
 import requests
 import queue
+from bisect import bisect_right
+from requests.adapters import HTTPAdapter
+from lease import LeaseCoordinator
+from merkle import MerkleVerifier, leaf_hash, prefix_range, verify_consistency, verify_inclusion
+from ratelimit import AIMDRateController, THROTTLE_STATUSES, parse_retry_after
+from scheduler import RangeScheduler
+from transport import CTLogBatch, pack_entries
+
+
+def make_session(pool_size=16):
+    """Build a keep-alive session whose connection pool holds `pool_size` sockets for one log."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def default_log_id(log_url):
+    """Stable short ID for a log when its RFC 6962 log ID is not known, e.g. `ct.cloudflare.com/logs/nimbus2025`."""
+    return log_url.split("://", 1)[-1].rstrip("/")
+
 
 class CTlogsStream:
-    def __init__(self, ct_log_url: str, buffer: queue.Queue, total_entries, start_index=0, end_index=None, max_retries=10, retry_delay=1):
+    def __init__(self, ct_log_url: str, buffer: queue.Queue, total_entries, start_index=0, end_index=None, max_retries=10, retry_delay=1,
+                 max_in_flight=16, session=None, rate_controller=None, metrics=None, batch_size=512, checkpoint=None, log_id=None,
+                 verify=False, lease_store=None, lease_ttl=60.0, lease_seconds=120.0):
         self.ct_log_url = ct_log_url
-        self.start_index = start_index
-        self.end_index = end_index or self.get_sth(ct_log_url)['tree_size']
-        self.current_index = self.start_index
+        self.log_id = log_id or default_log_id(ct_log_url)  # tagged onto every row of this log
+        self.max_in_flight = max_in_flight
+        self.session = session or make_session(max_in_flight)  # one pooled session per log
+        sth = self.get_sth(ct_log_url) if verify or not end_index or start_index < 0 else {}
+        # a negative start_index counts back from the current tree head
+        self.start_index = max(0, sth.get('tree_size', 0) + start_index) if start_index < 0 else start_index
+        self.end_index = end_index or sth['tree_size']
+        # (tree_size, timestamp) of every STH that grew the range, to date entries for lag reporting
+        self.sth_sizes = [sth['tree_size']] if sth.get('timestamp') else []
+        self.sth_timestamps = [sth['timestamp']] if sth.get('timestamp') else []
+        self.following = False
+        self.checkpoint = checkpoint  # optional CheckpointStore; consumers commit, we record claims and failures
+        if lease_store:
+            # ranges come from leases shared with other nodes (see lease.py), not from start_index..end_index
+            self.scheduler = RangeScheduler(self.start_index, self.start_index, page_size=batch_size)
+        elif checkpoint:
+            pending, next_index = checkpoint.resume(ct_log_url, self.start_index, self.end_index)
+            print(f"Resuming {ct_log_url} at index {next_index} with {len(pending)} gaps to refill")
+            self.scheduler = RangeScheduler(next_index, self.end_index, page_size=batch_size, pending=pending)
+        else:
+            self.scheduler = RangeScheduler(self.start_index, self.end_index, page_size=batch_size)
         self.workers = {}
-        self.lock = threading.Lock()  # still needed for current_index & workers
+        self.retry_attempts = {}  # start index -> failed attempts of a range waiting out its backoff
+        self.lock = threading.Lock()  # guards workers and retry_attempts
         self.start_time = time.time()
         self.max_retries = max_retries
         self.retry_delay = retry_delay
@@ -20,55 +63,190 @@ class CTlogsStream:
         self.stop_event = threading.Event()  # <--- stop flag
         self.start_time = time.time()
         self.total_entries = total_entries
-
+        # per-log concurrency limit; replaces the fixed launch stagger
+        self.rate = rate_controller or AIMDRateController(max_limit=max_in_flight, base_delay=retry_delay)
+        self.metrics = metrics  # optional metrics.MetricsRegistry
+        # optional Merkle verification of everything fetched against the log's signed tree heads
+        self.sth_roots = {}  # tree_size -> root hash of every STH seen
+        if verify and lease_store:
+            print("Merkle verification needs every leaf in one process; it is disabled when ranges are leased")
+            verify = False
+        self.verifier = self.start_verifier(sth) if verify else None
+        self.leases = LeaseCoordinator(lease_store, self, ttl=lease_ttl, lease_seconds=lease_seconds) if lease_store else None
 
     def get_sth(self, log_url, timeout=10):
         url = log_url + "ct/v1/get-sth"
         try:
-            resp = requests.get(url, timeout=timeout)
+            resp = self.session.get(url, timeout=timeout)
             resp.raise_for_status()
             return resp.json()
         except requests.RequestException as e:
             print(f"Error fetching STH: {e}")
             return {'tree_size': 0}
 
+    def get_json(self, path, timeout=10):
+        try:
+            resp = self.session.get(self.ct_log_url + path, timeout=timeout)
+            resp.raise_for_status()
+            return resp.json()
+        except (requests.RequestException, ValueError) as e:
+            print(f"Error fetching {path}: {e}")
+            return None
+
+    def start_verifier(self, sth):
+        """MerkleVerifier for the leaves this stream will fetch, or None if the log cannot be verified."""
+        if not sth.get('sha256_root_hash'):
+            print(f"Merkle verification disabled for {self.ct_log_url}: no signed tree head")
+            return None
+        self.sth_roots[sth['tree_size']] = base64.b64decode(sth['sha256_root_hash'])
+        base = min([self.scheduler.next_index] + [start for start, _ in self.scheduler.pending])
+        verifier = MerkleVerifier(base, self.check_root)
+        verifier.cut(self.end_index)
+        # with nothing to fetch yet (e.g. resumed at the tree head) there is no leaf `base` to prove;
+        # in follow mode the verifier is seeded once the tree grows past it
+        if base and base < self.end_index and not self.seed_verifier(verifier, sth['tree_size']):
+            return None
+        return verifier
+
+    def seed_verifier(self, verifier, tree_size):
+        """Seed `verifier` with the hashes left of its first leaf, from that leaf's audit path; False if that fails."""
+        base = verifier.base
+        proof = self.get_json(f"ct/v1/get-entry-and-proof?leaf_index={base}&tree_size={tree_size}")
+        lefts = None
+        if proof:
+            lefts = verify_inclusion(base, tree_size, leaf_hash(base64.b64decode(proof['leaf_input'])),
+                                     [base64.b64decode(p) for p in proof.get('audit_path', ())],
+                                     self.sth_roots[tree_size])
+        if lefts is None:
+            print(f"Merkle verification disabled for {self.ct_log_url}: no valid inclusion proof for leaf {base}")
+            self.merkle_failed()
+            return False
+        verifier.seed(prefix_range(base, lefts))
+        return True
+
+    def check_consistency(self, first, first_root, second, second_root):
+        """Verify that the tree head of size `second` extends the one of size `first`."""
+        if first == second:
+            return first_root == second_root
+        response = self.get_json(f"ct/v1/get-sth-consistency?first={first}&second={second}") or {}
+        proof = [base64.b64decode(p) for p in response.get('consistency', ())]
+        return verify_consistency(first, second, first_root, second_root, proof)
+
+    def check_root(self, size, root):
+        """Called by the verifier once every leaf below `size` has been fetched and folded."""
+        with self.lock:
+            expected = self.sth_roots.get(size)
+            latest = max(self.sth_roots)
+        if expected is not None:
+            ok = root == expected
+        else:
+            # --end_index short of a tree head: prove the computed root is a prefix of the latest one
+            ok = self.check_consistency(size, root, latest, self.sth_roots[latest])
+        if not ok:
+            print(f"MERKLE MISMATCH: entries of {self.ct_log_url} below {size} do not match its signed tree head")
+            self.merkle_failed()
+            return
+        if not self.following:  # while following, progress is in the ctlog_merkle_verified_size gauge
+            print(f"Merkle root verified for {self.ct_log_url} at tree size {size}")
+        if self.metrics:
+            self.metrics.set("ctlog_merkle_verified_size", size, log=self.log_id)
+
+    def merkle_failed(self):
+        if self.metrics:
+            self.metrics.inc("ctlog_merkle_failures_total", log=self.log_id)
+
+    def report_verification(self):
+        """Print what could not be verified when the stream stops."""
+        if not self.verifier:
+            return
+        cuts, waiting = self.verifier.unverified()
+        if cuts and self.verifier.verified_end() is not None:  # unseeded: nothing was fetched
+            print(f"Merkle root of {self.ct_log_url} not verified at tree size(s) {cuts}: leaves from "
+                  f"{self.verifier.verified_end()} on were not all fetched in this run (pending ranges {waiting[:5]})")
+
     def get_entries(self, start_index, end_index, timeout=60):
         url = f"{self.ct_log_url}ct/v1/get-entries?start={start_index}&end={end_index}"
+        request_start = time.time()
         try:
-            resp = requests.get(url, timeout=timeout)
+            resp = self.session.get(url, timeout=timeout)
+            if resp.status_code in THROTTLE_STATUSES:
+                self.rate.on_throttle(parse_retry_after(resp.headers.get("Retry-After")))
+                if self.metrics:
+                    self.metrics.inc("ctlog_throttled_total", log=self.log_id)
             resp.raise_for_status()
-            return resp.json()
-        except requests.RequestException as e:
+            entries = resp.json()
+        except (requests.RequestException, ValueError) as e:
+            if not (isinstance(e, requests.HTTPError) and e.response.status_code in THROTTLE_STATUSES):
+                self.rate.on_error()
             print(f"Error fetching entries {start_index}-{end_index}: {e}")
             return None
+        latency = time.time() - request_start
+        self.rate.on_success(latency)
+        if self.metrics:
+            self.metrics.observe("ctlog_fetch_seconds", latency, log=self.log_id)
+            self.metrics.observe("ctlog_fetch_entries", len(entries.get("entries", ())), log=self.log_id)
+        return entries
+
+    def report_rate(self):
+        """Publish the rate controller's state as gauges."""
+        if self.metrics:
+            self.metrics.set("ctlog_active_workers", self.rate.in_flight, log=self.log_id)
+            self.metrics.set("ctlog_fetch_limit", self.rate.current_limit, log=self.log_id)
+            self.metrics.set("ctlog_stagger_seconds", self.rate.current_stagger, log=self.log_id)
 
-    def stream_task(self, batch_size=100):
+    def stream_task(self, slot_held=False, defer_retries=False):
+        """Fetch one scheduled range into the buffer. Returns False when there is no range to claim right now.
+
+        With `slot_held` the caller has already acquired a rate-controller slot for the first attempt. With
+        `defer_retries` a failed attempt does not sleep out its backoff in the caller's thread: the range is
+        handed back to the scheduler once the backoff has passed, and retried by whichever worker claims it.
+        """
         u = uuid.uuid4()
         short_id = base64.urlsafe_b64encode(u.bytes)[:8].decode('utf-8')
 
+        claimed = self.scheduler.claim()
+        if claimed is None:
+            if slot_held:
+                self.rate.release()
+            return False
+        start_index, end_index = claimed
+        if self.checkpoint:
+            self.checkpoint.mark(self.ct_log_url, start_index, end_index, "inflight")
         with self.lock:
-            if self.current_index >= self.end_index:
-                return
-            start_index = self.current_index
-            end_index = min(self.current_index + batch_size - 1, self.end_index - 1)
-            self.current_index = end_index + 1
             self.workers[short_id] = {"index": {"start": start_index, "end": end_index}, "job_status": "process"}
-
-        attempt = 0
+            attempt = self.retry_attempts.pop(start_index, 0)  # failed attempts of a deferred retry
         while True:
+            if not slot_held and not self.rate.acquire(self.stop_event):
+                self.scheduler.release(start_index, end_index)
+                with self.lock:
+                    self.workers.pop(short_id, None)
+                break
+            slot_held = False
             try:
-                entries = self.get_entries(start_index, end_index)
-                # elapsed = time.time() - self.start_time
-                # print(f"[{elapsed:.2f}s] Worker {u}: fetched {len(entries['entries'])} entries "
-                #     f"({start_index} → {end_index})")
-                if entries is None or 'entries' not in entries:
+                try:
+                    entries = self.get_entries(start_index, end_index)
+                finally:
+                    self.rate.release()
+                    self.report_rate()
+                if entries is None or not entries.get('entries'):
                     raise Exception("Failed to get entries")
 
-                # put each entry individually into the queue
-                batched_entries = entries['entries']
-                self.buffer.put(batched_entries)
+                # a short response is kept; the scheduler re-queues the unfilled tail
+                batched_entries = entries['entries'][:end_index - start_index + 1]
+                # base64 is decoded once here; downstream stages only see packed raw bytes
+                batch = CTLogBatch(self.log_id, self.ct_log_url, start_index, pack_entries(batched_entries),
+                                   self.sth_timestamp_for(start_index))
+                verifier = self.verifier  # dropped by follow_tree_head if it cannot be seeded
+                if verifier:
+                    verifier.add(start_index, [leaf for leaf, _ in batch.entries()])
+                self.buffer.put(batch)
+                self.scheduler.complete(start_index, end_index, len(batched_entries))
+                if self.leases:
+                    self.leases.record(start_index, len(batched_entries))
                 with self.total_entries.get_lock():
                     self.total_entries.value += len(batched_entries)
+                if self.metrics:
+                    self.metrics.inc("ctlog_entries_fetched_total", len(batched_entries), log=self.log_id)
 
                 with self.lock:
                     self.workers.pop(short_id, None)
@@ -76,34 +254,131 @@ class CTlogsStream:
 
             except Exception as e:
                 attempt += 1
+                if self.metrics:
+                    self.metrics.inc("ctlog_fetch_retries_total", log=self.log_id)
                 if self.max_retries and attempt >= self.max_retries:
                     print(f"Worker {short_id}: giving up after {attempt} retries. Last error: {e}")
+                    self.scheduler.fail(start_index, end_index)
+                    if self.checkpoint:
+                        self.checkpoint.mark(self.ct_log_url, start_index, end_index, "failed")
                     with self.lock:
                         self.workers.pop(short_id, None)
                     break
-                time.sleep(self.retry_delay)
+                if defer_retries:
+                    with self.lock:
+                        self.workers.pop(short_id, None)
+                        self.retry_attempts[start_index] = attempt
+                    # stays in flight for the scheduler until released, so the stream is not done meanwhile
+                    timer = threading.Timer(self.rate.backoff(attempt), self.scheduler.release, (start_index, end_index))
+                    timer.daemon = True
+                    timer.start()
+                    break
+                time.sleep(self.rate.backoff(attempt))
+        return True
+
+    def sth_timestamp_for(self, index):
+        """Timestamp (ms) of the first STH whose tree contained `index`, or 0 if unknown."""
+        i = bisect_right(self.sth_sizes, index)
+        return self.sth_timestamps[i] if i < len(self.sth_timestamps) else 0
+
+    def poll_sth(self, poll_min=1.0, poll_max=30.0):
+        """Extend the scheduled range whenever the tree grows.
 
-    def start_stream(self, stagger_coef=0.01, batch_size=512):
+        The poll interval drops to `poll_min` after the tree grows and backs off by
+        1.5x per unchanged STH up to `poll_max`, so an active log is followed within
+        about a second while a quiet one is not hammered.
+        """
+        interval = poll_min
+        while not self.stop_event.wait(interval):
+            sth = self.get_sth(self.ct_log_url)
+            tree_size = sth.get('tree_size', 0)
+            if tree_size > self.end_index:
+                if self.verifier:
+                    self.follow_tree_head(sth)
+                self.sth_sizes.append(tree_size)
+                self.sth_timestamps.append(sth.get('timestamp', 0))
+                self.end_index = tree_size
+                if self.leases:
+                    self.leases.extend(tree_size)
+                else:
+                    self.scheduler.extend(tree_size)
+                interval = poll_min
+            else:
+                interval = min(poll_max, interval * 1.5)
+
+    def follow_tree_head(self, sth):
+        """Check that a newer STH extends the previous one and have the verifier check its root once fetched."""
+        if not sth.get('sha256_root_hash'):
+            return
+        size, root = sth['tree_size'], base64.b64decode(sth['sha256_root_hash'])
+        with self.lock:
+            previous = max(self.sth_roots)
+            self.sth_roots[size] = root
+        if not self.check_consistency(previous, self.sth_roots[previous], size, root):
+            print(f"MERKLE MISMATCH: tree head {size} of {self.ct_log_url} is not consistent with {previous}")
+            self.merkle_failed()
+        self.verifier.cut(size)  # before the scheduler hands out any leaf beyond the old size
+        if self.verifier.verified_end() is None and not self.seed_verifier(self.verifier, size):
+            self.verifier = None
+
+    def follow(self, poll_min=1.0, poll_max=30.0):
+        """Keep streaming past `end_index`: new entries are scheduled as soon as a newer STH reports them."""
+        self.following = True
+        t = threading.Thread(target=self.poll_sth, args=(poll_min, poll_max), name="sth-poller")
+        t.daemon = True
+        t.start()
+
+    def finished(self):
+        """True when every range is fetched and no more will come (no follow mode, nothing left to lease)."""
+        return self.scheduler.done() and not self.following and (self.leases is None or self.leases.finished)
+
+    def start_stream(self):
         # last_yield_time = time.time()
         while not self.stop_event.is_set():
             # stop if all work done
-            with self.lock:
-                if self.current_index >= self.end_index and not self.workers:
-                    break
+            if self.finished():
+                break
+            if self.scheduler.exhausted():
+                time.sleep(0.1)  # in-flight batches may still re-queue a short-read tail; follow mode waits for the tree to grow
+                continue
 
-            t = threading.Thread(target=self.stream_task, args=(batch_size,))
+            # the rate controller paces launches: blocks while the log is at its limit or in Retry-After
+            if not self.rate.acquire(self.stop_event):
+                break
+            t = threading.Thread(target=self.stream_task, args=(True,))
             t.daemon = True
             t.start()
-
-            with self.lock:
-                num_workers = len(self.workers)
-            stagger = 0.12 + num_workers * stagger_coef
-
-            # self.total_entries_shared.value = self.total_entries
-            time.sleep(stagger)
+        self.report_verification()
         print("Stream finished.")
 
             # # periodic yield: can yield nothing or just indicate buffer size
             # if time.time() - last_yield_time >= push_time:
             #     yield self.buffer.qsize()  # or just yield a signal; queue contents are thread-safe
-            #     last_yield_time = time.time()
\ No newline at end of file
+            #     last_yield_time = time.time()
+
+    def _pool_worker(self):
+        while not self.stop_event.is_set():
+            if not self.stream_task():
+                if self.finished():
+                    break
+                time.sleep(0.05)  # in-flight batches may still re-queue a short-read tail; follow mode waits for the tree to grow
+
+    def start_stream_pool(self, max_in_flight=None):
+        """Fetch with a fixed pool of long-lived workers sharing the keep-alive session.
+
+        Unlike `start_stream`, no thread is created per batch: `max_in_flight` workers
+        loop over `stream_task` until the scheduler is done, so at most that many
+        requests are outstanding and connections are reused across batches.
+        """
+        max_in_flight = max_in_flight or self.max_in_flight
+        threads = []
+        for i in range(max_in_flight):
+            t = threading.Thread(target=self._pool_worker, name=f"fetch-{i}")
+            t.daemon = True
+            t.start()
+            threads.append(t)
+        for t in threads:
+            t.join()
+        self.report_verification()
+        self.session.close()
+        print("Stream finished.")
@@ -0,0 +1,69 @@
+import threading
+from multiprocessing import Value
+
+import pytest
+
+from bench.synthetic import SyntheticLog
+from sinks import Sink
+
+
+@pytest.fixture(scope="session")
+def synthetic_log():
+    # every other entry is a precert, so X509 and precert entries are both covered
+    return SyntheticLog(pool_size=16)
+
+
+class CaptureSink(Sink):
+    """Keeps what CTLogsProcs writes and commits it at once; stops the consumer after `batches` writes."""
+
+    def __init__(self, stop_event=None, batches=1):
+        self.writes = []
+        self.failures = []
+        self.stop_event = stop_event
+        self.batches = batches
+
+    def write(self, columns, rows, nbytes=0, issuers=(), on_commit=None):
+        self.writes.append((columns, rows, list(issuers)))
+        if on_commit:
+            on_commit()
+        if self.stop_event and len(self.writes) >= self.batches:
+            self.stop_event.set()
+
+    def quarantine(self, failures):
+        self.failures.extend(failures)
+
+
+class FlakyClient:
+    """A ClickHouse client whose first `failures` inserts raise `error`; keeps every insert that succeeds."""
+
+    def __init__(self, failures=0, error=ConnectionError("server unavailable")):
+        self.failures = failures
+        self.error = error
+        self.attempts = 0
+        self.inserts = []
+
+    def insert(self, table, data, column_names=None, column_oriented=False, settings=None):
+        self.attempts += 1
+        if self.attempts <= self.failures:
+            raise self.error
+        rows = [list(row) for row in zip(*data)] if column_oriented else list(data)
+        self.inserts.append((table, rows, list(column_names)))
+
+
+@pytest.fixture
+def consume():
+    """`consume(transport, batches=1, **procs_kwargs)` runs a CTLogsProcs over `batches` batches of `transport`."""
+    from decrypt import CTLogsProcs
+
+    def consume(transport, batches=1, **kwargs):
+        total = Value('i', 0)
+        sink = kwargs.pop("sink", None) or CaptureSink(batches=batches)
+        procs = CTLogsProcs(transport, total, sink=sink, **kwargs)
+        sink.stop_event = procs.stop_event
+        thread = threading.Thread(target=procs.start_processing, daemon=True)
+        thread.start()
+        thread.join(30)
+        assert not thread.is_alive(), "consumer did not finish its batches"
+        return procs, sink, total.value
+
+    return consume
@@ -0,0 +1,46 @@
+from checkpoint import CheckpointStore
+
+LOG = "http://log/"
+
+
+def store(tmp_path, start=0):
+    checkpoint = CheckpointStore(str(tmp_path / "checkpoint.db"))
+    checkpoint.resume(LOG, start, 1000)
+    return checkpoint
+
+
+def test_watermark_advances_over_contiguous_commits(tmp_path):
+    checkpoint = store(tmp_path)
+    checkpoint.commit(LOG, 10, 19)
+    assert checkpoint.watermark(LOG) == 0
+    checkpoint.commit(LOG, 0, 9)
+    assert checkpoint.watermark(LOG) == 20
+    assert checkpoint.resume(LOG, 0, 1000) == ([], 20)
+
+
+def test_is_committed_across_pieces(tmp_path):
+    checkpoint = store(tmp_path)
+    checkpoint.commit(LOG, 5, 9)
+    checkpoint.commit(LOG, 10, 14)
+    assert checkpoint.is_committed(LOG, 5, 14)
+    assert not checkpoint.is_committed(LOG, 5, 15)
+    assert not checkpoint.is_committed(LOG, 4, 14)
+
+
+def test_is_committed_behind_failed_gap(tmp_path):
+    checkpoint = store(tmp_path)
+    checkpoint.mark(LOG, 0, 4, "failed")
+    checkpoint.commit(LOG, 5, 14)
+    assert checkpoint.watermark(LOG) == 0
+    assert checkpoint.is_committed(LOG, 5, 14)
+    assert not checkpoint.is_committed(LOG, 0, 14)
+    pending, next_index = checkpoint.resume(LOG, 0, 1000)
+    assert pending == [(0, 4)] and next_index == 15
+
+
+def test_is_committed_below_watermark(tmp_path):
+    checkpoint = store(tmp_path)
+    checkpoint.commit(LOG, 0, 99)
+    assert checkpoint.is_committed(LOG, 10, 20)
+    assert checkpoint.is_committed(LOG, 90, 99)
+    assert not checkpoint.is_committed(LOG, 90, 100)
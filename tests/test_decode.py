@@ -0,0 +1,63 @@
+import base64
+import struct
+
+import pytest
+from cryptography import x509
+
+from decrypt import diff_decode_paths, process_ctlog_entry_fast, process_der, process_raw_entry_fast
+from issuers import IssuerCache, issuer_fields
+
+
+def reference_leaf(entry):
+    """The leaf certificate DER of a get-entries object, read from the RFC 6962 structures without decrypt.py.
+
+    A MerkleTreeLeaf is version(1) leaf_type(1) timestamp(8) entry_type(2); an
+    x509_entry continues with the length-prefixed certificate, while a
+    precert_entry's certificate is the first one in its PrecertChainEntry.
+    """
+    leaf_input = base64.b64decode(entry["leaf_input"])
+    extra_data = base64.b64decode(entry["extra_data"])
+    version, leaf_type, _, entry_type = struct.unpack(">BBQH", leaf_input[:12])
+    assert (version, leaf_type) == (0, 0)
+    body = leaf_input[12:] if entry_type == 0 else extra_data
+    length = int.from_bytes(body[:3], "big")
+    return leaf_input, extra_data, body[3:3 + length]
+
+
+def test_fast_path_decodes_x509_and_precerts(synthetic_log):
+    entries = synthetic_log.entries(0, 15)
+    rows = [process_ctlog_entry_fast(entry) for entry in entries]
+    assert all(rows)
+    assert len({row['sha1_fingerprint'] for row in rows}) == 16
+
+
+def test_fast_path_matches_reference_extraction(synthetic_log):
+    # process_der is the reference extraction, written independently of the fields.py extractors, and reads
+    # the issuer from the leaf; the fast path slices the DER itself and takes the issuer from the chain
+    cache = IssuerCache()
+    for index, entry in enumerate(synthetic_log.entries(0, 31), 1000):
+        leaf_input, extra_data, der = reference_leaf(entry)
+        expected = process_der(der, index)
+        assert expected is not None
+        assert process_raw_entry_fast(leaf_input, extra_data, cache, index) == expected
+    assert cache.hits and cache.misses == 4
+
+
+def test_issuer_from_chain_matches_leaf_issuer(synthetic_log):
+    cache = IssuerCache()
+    for i, entry in enumerate(synthetic_log.entries(0, 15)):
+        leaf_input, extra_data, der = reference_leaf(entry)
+        leaf = x509.load_der_x509_certificate(der)
+        row = process_raw_entry_fast(leaf_input, extra_data, cache, i)
+        issuer_id, country, organization, common_name = issuer_fields(leaf.issuer)
+        assert row['issuer_id'] == issuer_id
+        assert (row['issuer_country'], row['issuer_organization'], row['issuer_common_name']) == \
+            (country, organization, common_name) == ("US", "Bench Trust", f"Bench Issuing CA {i % 4}")
+
+
+def test_decode_paths_agree(synthetic_log):
+    # the pyOpenSSL/certlib round trip itself, where those libraries are installed
+    pytest.importorskip("certlib")
+    pytest.importorskip("OpenSSL")
+    entries = synthetic_log.entries(0, 15)
+    assert diff_decode_paths(entries) == []
@@ -0,0 +1,109 @@
+import datetime
+
+import pytest
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
+
+from fields import DEFAULT_COLUMNS, FIELDS, KEY_COLUMNS, CertView, extract, extractors, parse_columns
+from issuers import issuer_id_for
+
+NOT_BEFORE = datetime.datetime(2025, 3, 1, tzinfo=datetime.timezone.utc)
+NOT_AFTER = datetime.datetime(2026, 3, 1, tzinfo=datetime.timezone.utc)
+ISSUER = x509.Name([
+    x509.NameAttribute(NameOID.COUNTRY_NAME, "US"),
+    x509.NameAttribute(NameOID.ORGANIZATION_NAME, "Example Trust"),
+    x509.NameAttribute(NameOID.COMMON_NAME, "Example Issuing CA"),
+])
+
+
+@pytest.fixture(scope="module")
+def cert():
+    """CertView of an EV-style leaf with every subject attribute the registry reads."""
+    key = ec.generate_private_key(ec.SECP256R1())
+    subject = x509.Name([
+        x509.NameAttribute(NameOID.COUNTRY_NAME, "DE"),
+        x509.NameAttribute(NameOID.STATE_OR_PROVINCE_NAME, "Berlin"),
+        x509.NameAttribute(NameOID.ORGANIZATION_NAME, "Example GmbH"),
+        x509.NameAttribute(NameOID.SERIAL_NUMBER, "HRB 12345"),
+        x509.NameAttribute(NameOID.BUSINESS_CATEGORY, "Private Organization"),
+        x509.NameAttribute(NameOID.JURISDICTION_STATE_OR_PROVINCE_NAME, "Berlin"),
+        x509.NameAttribute(NameOID.JURISDICTION_COUNTRY_NAME, "DE"),
+        x509.NameAttribute(NameOID.COMMON_NAME, "example.de"),
+    ])
+    certificate = (x509.CertificateBuilder()
+                   .subject_name(subject)
+                   .issuer_name(ISSUER)
+                   .public_key(key.public_key())
+                   .serial_number(0xABCDEF0123)
+                   .not_valid_before(NOT_BEFORE)
+                   .not_valid_after(NOT_AFTER)
+                   .add_extension(x509.SubjectAlternativeName([x509.DNSName(name) for name in
+                                                               ("example.de", "www.example.de", "shop.example.de")]),
+                                  critical=False)
+                   .add_extension(x509.CertificatePolicies([
+                       x509.PolicyInformation(x509.ObjectIdentifier("2.23.140.1.1"), None),
+                       x509.PolicyInformation(x509.ObjectIdentifier("1.3.6.1.4.1.99999.1"), None),
+                   ]), critical=False)
+                   .sign(key, hashes.SHA256()))
+    return CertView(certificate, cert_index=4242)
+
+
+def test_every_extractor(cert):
+    expected = {
+        'cert_index': 4242,
+        'sha1_fingerprint': ':'.join(f'{byte:02X}' for byte in cert.certificate.fingerprint(hashes.SHA1())),
+        'issuer_id': issuer_id_for(ISSUER),
+        'subject_country': "DE",
+        'subject_state': "Berlin",
+        'subject_organization': "Example GmbH",
+        'subject_serial_number': "HRB 12345",
+        'subject_common_name': "example.de",
+        'san': "www.example.de;shop.example.de",  # the CN is not repeated
+        'subject_business_category': "Private Organization",
+        'subject_jurisdiction_state': "Berlin",
+        'subject_jurisdiction_country': "DE",
+        'not_after': NOT_AFTER,
+        'not_before': NOT_BEFORE,
+        'serial': "ABCDEF0123",
+        'key_type': "EC-secp256r1",
+        'policy_oids': "2.23.140.1.1;1.3.6.1.4.1.99999.1",
+    }
+    assert set(expected) == set(FIELDS) - {'log_id'}  # a new field needs a case here
+    assert extract(cert, list(FIELDS)) == expected
+    assert len(expected['sha1_fingerprint']) == 59
+    assert cert.issuer[1:] == ("US", "Example Trust", "Example Issuing CA")
+
+
+def test_missing_attributes_and_extensions_are_empty():
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "bare.example")])
+    certificate = (x509.CertificateBuilder().subject_name(name).issuer_name(name).public_key(key.public_key())
+                   .serial_number(1).not_valid_before(NOT_BEFORE).not_valid_after(NOT_AFTER)
+                   .sign(key, hashes.SHA256()))
+    values = extract(CertView(certificate), ['subject_country', 'subject_state', 'san', 'policy_oids'])
+    assert values == {'subject_country': "", 'subject_state': "", 'san': "", 'policy_oids': ""}
+
+
+def test_precomputed_issuer_is_used(cert):
+    view = CertView(cert.certificate, issuer=(7, "US", "Cached CA", "Cached R1"))
+    assert extract(view, ['issuer_id']) == {'issuer_id': 7}
+
+
+def test_parse_columns_keeps_key_columns_first():
+    assert parse_columns("default") == DEFAULT_COLUMNS
+    assert parse_columns("san,issuer_id") == KEY_COLUMNS + ['san', 'issuer_id']
+    assert parse_columns("cert_index") == KEY_COLUMNS
+    assert parse_columns(" default , not_before,key_type,san ") == DEFAULT_COLUMNS + ['not_before', 'key_type']
+
+
+def test_parse_columns_rejects_unknown_names():
+    with pytest.raises(ValueError, match="unknown column 'subject'"):
+        parse_columns("san,subject")
+    with pytest.raises(ValueError, match="unknown column ''"):
+        parse_columns("san,")
+
+
+def test_log_id_is_not_extracted():
+    assert [name for name, _ in extractors(parse_columns("default"))] == DEFAULT_COLUMNS[1:]
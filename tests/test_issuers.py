@@ -0,0 +1,31 @@
+from conftest import CaptureSink
+from transport import CTLogBatch, QueueTransport, pack_entries
+
+
+class FirstWriteFailsSink(CaptureSink):
+    """Never commits its first write, like an issuers or certs insert that failed."""
+
+    def write(self, columns, rows, nbytes=0, issuers=(), on_commit=None):
+        super().write(columns, rows, nbytes, issuers, on_commit if self.writes else None)
+
+
+def batches(synthetic_log, count):
+    transport = QueueTransport()
+    for i in range(count):
+        transport.put(CTLogBatch("log", "http://log/", 8 * i, pack_entries(synthetic_log.entries(0, 7))))
+    return transport
+
+
+def test_issuers_sent_once_committed(synthetic_log, consume):
+    _, sink, _ = consume(batches(synthetic_log, 2), batches=2)
+    first, second = (issuers for _, _, issuers in sink.writes)
+    assert first and len({issuer[0] for issuer in first}) == len(first)
+    assert second == []
+
+
+def test_issuers_sent_again_after_failed_write(synthetic_log, consume):
+    _, sink, committed = consume(batches(synthetic_log, 3), batches=3, sink=FirstWriteFailsSink(batches=3))
+    first, second, third = (issuers for _, _, issuers in sink.writes)
+    assert first and second == first
+    assert third == []
+    assert committed == 16
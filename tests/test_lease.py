@@ -0,0 +1,108 @@
+import threading
+import time
+from collections import Counter
+
+from lease import LeaseCoordinator, LeaseStore
+from scheduler import RangeScheduler
+
+LOG = "http://log/"
+
+
+class Stream:
+    """The parts of CTlogsStream a LeaseCoordinator uses, with the scheduler started empty as in lease mode."""
+
+    def __init__(self, end_index, page_size=50):
+        self.ct_log_url = LOG
+        self.start_index = 0
+        self.end_index = end_index
+        self.stop_event = threading.Event()
+        self.scheduler = RangeScheduler(0, 0, page_size=page_size)
+
+
+class Node:
+    def __init__(self, path, end_index, **kwargs):
+        self.store = LeaseStore(path)
+        self.stream = Stream(end_index)
+        self.coordinator = LeaseCoordinator(self.store, self.stream, tick=0.01, **kwargs)
+        self.fetched = Counter()
+
+    def fetch(self, commit=True):
+        """Claim one range, "fetch" it and optionally commit it, as stream workers and consumers do."""
+        claimed = self.stream.scheduler.claim()
+        if claimed is None:
+            return None
+        start, end = claimed
+        self.fetched.update(range(start, end + 1))
+        self.stream.scheduler.complete(start, end, end - start + 1)
+        self.coordinator.record(start, end - start + 1)
+        if commit:
+            self.store.commit(LOG, start, end)
+        return claimed
+
+    def run(self, deadline):
+        while time.time() < deadline and not (self.coordinator.finished and self.stream.scheduler.done()):
+            if self.fetch() is None:
+                time.sleep(0.005)
+        self.stream.stop_event.set()
+
+
+def wait_for(condition, timeout=10.0):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline
+        time.sleep(0.01)
+
+
+def leases_done(path):
+    logs, _ = LeaseStore(path).status()
+    return logs[0][3]
+
+
+def test_two_nodes_cover_every_index_once(tmp_path):
+    path = str(tmp_path / "leases.db")
+    nodes = [Node(path, 5000, min_lease=300, max_lease=300) for _ in range(2)]
+    deadline = time.time() + 20
+    threads = [threading.Thread(target=node.run, args=(deadline,)) for node in nodes]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    fetched = nodes[0].fetched + nodes[1].fetched
+    assert set(fetched) == set(range(5000))
+    assert set(fetched.values()) == {1}
+    assert nodes[0].fetched and nodes[1].fetched
+    assert leases_done(path) == 17
+
+
+def test_expired_lease_resumes_from_committed_index(tmp_path):
+    path = str(tmp_path / "leases.db")
+    a = Node(path, 200, ttl=0.3, min_lease=100, max_lease=100)
+    wait_for(lambda: a.coordinator._fetching() == 2)
+    assert a.fetch() == (0, 49)
+    assert a.fetch(commit=False) == (50, 99)
+    a.stream.stop_event.set()  # node A dies: no more heartbeats
+    a.coordinator.thread.join()
+    time.sleep(0.3)
+
+    b = Node(path, 200, ttl=5.0, min_lease=100, max_lease=100)
+    b.run(time.time() + 10)
+    assert set(b.fetched) == set(range(50, 200))
+    assert set(b.fetched.values()) == {1}
+    assert leases_done(path) == 2
+
+
+def test_failed_range_releases_the_rest_of_its_lease(tmp_path):
+    path = str(tmp_path / "leases.db")
+    a = Node(path, 200, ttl=5.0, min_lease=100, max_lease=100, max_leases=1)
+    wait_for(lambda: a.coordinator._fetching() == 1)
+    start, end = a.stream.scheduler.claim()
+    a.stream.scheduler.fail(start, end)
+    # the lease's other page is no longer queued here; A moves on to the next lease and leaves it to others
+    wait_for(lambda: list(a.stream.scheduler.pending) == [(100, 199)])
+    assert [lease.start for lease in a.coordinator.leases.values()] == [100]
+    a.stream.stop_event.set()
+
+    b = Node(path, 200, ttl=5.0, min_lease=100, max_lease=100, max_leases=1)
+    wait_for(lambda: b.coordinator._fetching() == 1)
+    assert list(b.stream.scheduler.pending) == [(0, 99)]
+    b.stream.stop_event.set()
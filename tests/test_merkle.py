@@ -0,0 +1,131 @@
+import random
+from multiprocessing import Value
+import queue
+
+from bench.mock_server import MockCTServer
+from merkle import (EMPTY_ROOT, CompactRange, MerkleVerifier, leaf_hash, node_hash, prefix_range, verify_consistency,
+                    verify_inclusion)
+from stream import CTlogsStream
+
+LEAVES = [b"leaf %d" % i for i in range(70)]
+
+
+# RFC 6962 section 2.1, written out recursively as the reference
+def split(n):
+    k = 1
+    while k * 2 < n:
+        k *= 2
+    return k
+
+
+def mth(leaves):
+    if not leaves:
+        return EMPTY_ROOT
+    if len(leaves) == 1:
+        return leaf_hash(leaves[0])
+    k = split(len(leaves))
+    return node_hash(mth(leaves[:k]), mth(leaves[k:]))
+
+
+def path(m, leaves):
+    if len(leaves) <= 1:
+        return []
+    k = split(len(leaves))
+    if m < k:
+        return path(m, leaves[:k]) + [mth(leaves[k:])]
+    return path(m - k, leaves[k:]) + [mth(leaves[:k])]
+
+
+def subproof(m, leaves, complete):
+    n = len(leaves)
+    if m == n:
+        return [] if complete else [mth(leaves)]
+    k = split(n)
+    if m <= k:
+        return subproof(m, leaves[:k], complete) + [mth(leaves[k:])]
+    return subproof(m - k, leaves[k:], False) + [mth(leaves[:k])]
+
+
+def test_compact_range_root():
+    for n in range(len(LEAVES) + 1):
+        assert CompactRange(0, [leaf_hash(leaf) for leaf in LEAVES[:n]]).root() == mth(LEAVES[:n])
+
+
+def test_compact_ranges_join():
+    hashes = [leaf_hash(leaf) for leaf in LEAVES]
+    for cut in range(len(LEAVES) + 1):
+        left = CompactRange(0, hashes[:cut])
+        left.extend(CompactRange(cut, hashes[cut:]))
+        assert left.root() == mth(LEAVES)
+
+
+def test_inclusion_proofs():
+    for size in range(1, 40):
+        root = mth(LEAVES[:size])
+        for index in range(size):
+            leaf = leaf_hash(LEAVES[index])
+            lefts = verify_inclusion(index, size, leaf, path(index, LEAVES[:size]), root)
+            assert lefts is not None
+            # the left siblings are the compact range in front of the leaf
+            assert prefix_range(index, lefts).root() == mth(LEAVES[:index])
+            assert verify_inclusion(index, size, leaf_hash(b"other"), path(index, LEAVES[:size]), root) is None
+        assert verify_inclusion(size, size, leaf_hash(LEAVES[0]), [], root) is None
+
+
+def test_consistency_proofs():
+    for second in range(1, 40):
+        second_root = mth(LEAVES[:second])
+        for first in range(1, second + 1):
+            first_root = mth(LEAVES[:first])
+            proof = subproof(first, LEAVES[:second], True) if first < second else []
+            assert verify_consistency(first, second, first_root, second_root, proof)
+            if first < second:
+                assert not verify_consistency(first, second, leaf_hash(b"other"), second_root, proof)
+                assert not verify_consistency(first, second, first_root, second_root, proof[:-1])
+
+
+def fold(verifier, ranges):
+    for start, end in ranges:
+        verifier.add(start, LEAVES[start:end])
+
+
+def test_out_of_order_folding_with_cuts():
+    rng = random.Random(6962)
+    for _ in range(20):
+        bounds = sorted(rng.sample(range(1, len(LEAVES)), 8))
+        ranges = list(zip([0] + bounds, bounds + [len(LEAVES)]))
+        rng.shuffle(ranges)
+        cuts = set(rng.sample(range(1, len(LEAVES) + 1), 4)) | {len(LEAVES)}
+        roots = []
+        verifier = MerkleVerifier(on_root=lambda size, root: roots.append((size, root)))
+        for cut in cuts:
+            verifier.cut(cut)
+        fold(verifier, ranges)
+        assert sorted(roots) == [(cut, mth(LEAVES[:cut])) for cut in sorted(cuts)]
+        assert verifier.unverified() == ([], [])
+
+
+def test_seeded_verifier():
+    base = 21
+    lefts = verify_inclusion(base, 50, leaf_hash(LEAVES[base]), path(base, LEAVES[:50]), mth(LEAVES[:50]))
+    roots = []
+    verifier = MerkleVerifier(base, on_root=lambda size, root: roots.append((size, root)))
+    verifier.cut(50)
+    fold(verifier, [(40, 50), (base, 40)])
+    assert roots == []  # nothing is reported before the prefix is known
+    verifier.seed(prefix_range(base, lefts))
+    assert roots == [(50, mth(LEAVES[:50]))]
+
+
+def test_verifier_starting_at_the_tree_head_is_not_seeded():
+    server = MockCTServer(tree_size=300, latency=0).start()
+    try:
+        stream = CTlogsStream(server.url, queue.Queue(), Value('i', 0), start_index=300, verify=True)
+        assert stream.verifier is not None  # no out-of-range get-entry-and-proof, no failure
+        assert stream.verifier.verified_end() is None
+        server.tree_size = 400  # follow mode: seeded from the first tree head past it
+        stream.follow_tree_head(stream.get_sth(server.url))
+        assert stream.verifier.verified_end() == 300
+        stream.session.close()
+    finally:
+        server.stop()
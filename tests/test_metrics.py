@@ -0,0 +1,26 @@
+from metrics import MetricsRegistry
+from transport import CTLogBatch, QueueTransport, pack_entries
+
+
+def test_histogram_handle_matches_observe():
+    metrics = MetricsRegistry(max_series=16, max_cells=512)
+    decode = metrics.histogram("ctlog_decode_seconds")
+    for value in (0.00002, 0.0003, 0.02):
+        decode.observe(value)
+        metrics.observe("ctlog_decode_seconds", value)
+    text = metrics.render()
+    assert 'ctlog_decode_seconds_bucket{le="5e-05"} 2' in text
+    assert 'ctlog_decode_seconds_bucket{le="0.0005"} 4' in text
+    assert 'ctlog_decode_seconds_bucket{le="+Inf"} 6' in text
+    assert "ctlog_decode_seconds_count 6" in text
+
+
+def test_queue_transport_counts_bytes(synthetic_log):
+    transport = QueueTransport()
+    batch = CTLogBatch("log", "http://log/", 0, pack_entries(synthetic_log.entries(0, 3)))
+    transport.put(batch)
+    assert transport.offer(batch) == []
+    assert transport.nbytes() == 2 * len(batch.payload)
+    transport.get()
+    transport.get()
+    assert transport.nbytes() == 0
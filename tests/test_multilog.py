@@ -0,0 +1,50 @@
+import json
+import queue
+import threading
+import time
+from multiprocessing import Value
+
+from bench.mock_server import MockCTServer
+from multilog import MultiLogStream, load_log_list
+from ratelimit import StaggerController
+
+
+def test_json_log_list_urls_end_with_slash(tmp_path):
+    path = tmp_path / "log_list.json"
+    path.write_text(json.dumps({"operators": [{"logs": [
+        {"url": "https://ct.example/2025h1", "log_id": "a", "state": {"usable": {}}},
+        {"url": "https://ct.example/2025h2/", "log_id": "b", "state": {"qualified": {}}},
+        {"url": "https://ct.example/2019", "log_id": "c", "state": {"retired": {}}},
+    ]}]}))
+    assert load_log_list(str(path)) == [("https://ct.example/2025h1/", 1.0, "a"), ("https://ct.example/2025h2/", 1.0, "b")]
+
+
+def test_stagger_try_acquire_spaces_launches():
+    rate = StaggerController(stagger_coef=0.0)
+    assert rate.try_acquire()
+    assert not rate.try_acquire()  # within 0.12s of the previous launch
+    time.sleep(0.15)
+    assert rate.try_acquire()
+
+
+def test_failing_log_does_not_hold_the_global_slot():
+    good = MockCTServer(tree_size=1024, latency=0, page_cap=256).start()
+    bad = MockCTServer(tree_size=1024, latency=0, page_cap=256, error_rate=1.0).start()
+    try:
+        stream = MultiLogStream([(good.url, 1.0, "good"), (bad.url, 1.0, "bad")], queue.Queue(), Value('i', 0),
+                                max_in_flight=1, batch_size=256)
+        good_log, bad_log = stream.streams
+        bad_log.rate.backoff = lambda attempt: 30  # slept in the only worker, this would stall the good log
+        thread = threading.Thread(target=stream.start_stream, daemon=True)
+        thread.start()
+        deadline = time.time() + 10
+        while not good_log.scheduler.done() and time.time() < deadline:
+            time.sleep(0.05)
+        assert good_log.scheduler.done()
+        assert bad.stats["errors"] >= 1
+        assert not bad_log.scheduler.done()  # its range waits out the backoff, still in flight
+        stream.stop_event.set()
+        thread.join(5)
+    finally:
+        good.stop()
+        bad.stop()
@@ -0,0 +1,72 @@
+import base64
+
+import pytest
+
+from conftest import CaptureSink, FlakyClient
+from sinks import QUARANTINE_COLUMNS, ClickHouseSink
+from transport import CTLogBatch, QueueTransport, pack_entries
+
+
+class OrderedSink(CaptureSink):
+    """Records quarantines and commits in the order they happen."""
+
+    def __init__(self, fail_quarantine=False):
+        super().__init__()
+        self.events = []
+        self.fail_quarantine = fail_quarantine
+
+    def write(self, columns, rows, nbytes=0, issuers=(), on_commit=None):
+        super().write(columns, rows, nbytes, issuers, lambda: (self.events.append("commit"), on_commit()))
+
+    def quarantine(self, failures):
+        if self.fail_quarantine:
+            raise RuntimeError("quarantine unavailable")
+        self.events.append("quarantine")
+        super().quarantine(failures)
+
+
+def batch_with_bad_entry(synthetic_log):
+    entries = [dict(entry) for entry in synthetic_log.entries(0, 3)]
+    leaf_input = base64.b64decode(entries[2]["leaf_input"])
+    entries[2]["leaf_input"] = base64.b64encode(leaf_input[:40]).decode()  # truncated certificate
+    transport = QueueTransport()
+    transport.put(CTLogBatch("log", "http://log/", 10, pack_entries(entries)))
+    return transport
+
+
+def test_undecoded_entries_quarantined_before_commit(synthetic_log, consume):
+    _, sink, committed = consume(batch_with_bad_entry(synthetic_log), sink=OrderedSink())
+    assert [failure[1] for failure in sink.failures] == [12]
+    assert sink.writes[0][0]['cert_index'] == [10, 11, 13]
+    assert sink.events == ["quarantine", "commit"]
+    assert committed == 4
+
+
+class ClickHouseQuarantineSink(CaptureSink):
+    """Captures rows, but quarantines through a ClickHouseSink backed by `client`."""
+
+    def __init__(self, client):
+        super().__init__()
+        self.clickhouse = ClickHouseSink(client, FlakyClient(), [], retry_delay=0.01, max_retry_delay=0.02)
+
+    def quarantine(self, failures):
+        self.clickhouse.quarantine(failures)
+        super().quarantine(failures)
+
+
+def test_quarantine_waits_out_a_clickhouse_outage(synthetic_log, consume):
+    client = FlakyClient(failures=3)
+    _, sink, committed = consume(batch_with_bad_entry(synthetic_log), sink=ClickHouseQuarantineSink(client))
+    sink.clickhouse.close()
+    assert client.attempts == 4
+    [(table, [row], column_names)] = client.inserts
+    assert table == 'quarantine' and column_names == QUARANTINE_COLUMNS
+    assert row[:2] == ("log", 12)
+    assert committed == 4
+
+
+@pytest.mark.filterwarnings("ignore::pytest.PytestUnhandledThreadExceptionWarning")
+def test_nothing_committed_when_quarantine_fails_for_good(synthetic_log, consume):
+    _, sink, committed = consume(batch_with_bad_entry(synthetic_log), sink=OrderedSink(fail_quarantine=True))
+    assert sink.writes == []
+    assert committed == 0
@@ -0,0 +1,123 @@
+import random
+from email.utils import format_datetime
+from datetime import datetime, timezone
+
+from ratelimit import AIMDRateController, parse_retry_after
+
+NOW = 1_700_000_000.0
+
+
+class Clock:
+    def __init__(self, now=NOW):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class UpperBound:
+    """An rng whose `uniform` always returns the top of its range, and records the ranges asked for."""
+
+    def __init__(self):
+        self.ranges = []
+
+    def uniform(self, low, high):
+        self.ranges.append((low, high))
+        return high
+
+
+def controller(clock, **kwargs):
+    return AIMDRateController(clock=clock, rng=random.Random(1), **kwargs)
+
+
+def test_additive_increase_per_round_trip():
+    rate = controller(Clock(), initial_limit=4, max_limit=6)
+    for _ in range(4):
+        rate.on_success(0.1)
+    assert 4.9 < rate.limit < 5.0  # +1/limit per reply: about +1 per round trip of `limit` replies
+    assert rate.current_limit == 4
+    for _ in range(40):
+        rate.on_success(0.1)
+    assert rate.limit == 6 and rate.current_limit == 6  # capped at max_limit
+
+
+def test_rising_latency_holds_the_limit():
+    rate = controller(Clock(), initial_limit=4, latency_tolerance=2.0)
+    rate.on_success(0.1)
+    limit = rate.limit
+    for _ in range(10):
+        rate.on_success(1.0)  # the smoothed latency is past twice the best one from the first slow reply
+    assert rate.limit == limit
+    for _ in range(20):
+        rate.on_success(0.1)
+    assert rate.limit > limit  # grows again once the average is back within tolerance
+
+
+def test_multiplicative_decrease_once_per_round_trip():
+    clock = Clock()
+    rate = controller(clock, initial_limit=16, min_limit=2)
+    rate.on_success(1.0)
+    limit = rate.limit
+    rate.on_throttle()
+    assert rate.limit == limit / 2
+    clock.now += 0.5
+    rate.on_throttle()  # same congestion event: within one smoothed round trip of the last cut
+    rate.on_error()
+    assert rate.limit == limit / 2
+    assert rate.throttled == 2
+    clock.now += 1.0
+    rate.on_error()
+    assert rate.limit == limit / 4
+    for _ in range(10):
+        clock.now += 2.0
+        rate.on_throttle()
+    assert rate.limit == 2 and rate.current_limit == 2  # never below min_limit
+
+
+def test_slots_follow_the_limit():
+    rate = controller(Clock(), initial_limit=2)
+    assert rate.try_acquire() and rate.try_acquire()
+    assert not rate.try_acquire()
+    rate.release()
+    assert rate.try_acquire()
+
+
+def test_retry_after_pauses_the_log():
+    clock = Clock()
+    rate = controller(clock, initial_limit=4, max_delay=60)
+    rate.on_throttle(retry_after=10)
+    assert rate.current_stagger == 10
+    assert not rate.try_acquire()
+    clock.now += 9.5
+    assert not rate.try_acquire()
+    clock.now += 0.5
+    assert rate.try_acquire()
+    rate.on_throttle(retry_after=3600)
+    assert rate.current_stagger == 60  # capped at max_delay
+    rate.on_throttle(retry_after=5)
+    assert rate.current_stagger == 60  # a shorter pause does not cut a longer one
+
+
+def test_parse_retry_after():
+    assert parse_retry_after("120") == 120.0
+    assert parse_retry_after("1.5") == 1.5
+    assert parse_retry_after("-3") == 0.0
+    date = format_datetime(datetime.fromtimestamp(NOW + 90, timezone.utc), usegmt=True)
+    assert date.endswith("GMT")
+    assert parse_retry_after(date, now=NOW) == 90.0
+    assert parse_retry_after(date, now=NOW + 200) == 0.0  # a date in the past means retry now
+    assert parse_retry_after(None) is None
+    assert parse_retry_after("") is None
+    assert parse_retry_after("soon") is None
+
+
+def test_full_jitter_backoff_bounds():
+    rng = UpperBound()
+    rate = AIMDRateController(base_delay=0.5, max_delay=10, clock=Clock(), rng=rng)
+    assert [rate.backoff(attempt) for attempt in range(1, 7)] == [1.0, 2.0, 4.0, 8.0, 10, 10]
+    assert all(low == 0 for low, _ in rng.ranges)
+
+    rate = controller(Clock(), base_delay=0.5, max_delay=10)
+    delays = [rate.backoff(3) for _ in range(1000)]
+    assert all(0 <= delay <= 4.0 for delay in delays)
+    assert min(delays) < 0.5 and max(delays) > 3.5  # spread over the whole range, not around a fixed delay
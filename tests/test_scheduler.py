@@ -0,0 +1,39 @@
+from scheduler import RangeScheduler
+
+
+def test_page_size_needs_two_equal_short_replies():
+    scheduler = RangeScheduler(0, 10_000, page_size=512)
+    assert scheduler.claim() == (0, 511)
+    scheduler.complete(0, 511, 256)
+    assert scheduler.page_size == 512  # one short reply is not enough
+    assert scheduler.claim() == (256, 511)  # its tail comes first
+    scheduler.complete(256, 511, 256)
+    assert scheduler.claim() == (512, 1023)
+    scheduler.complete(512, 1023, 256)
+    assert scheduler.page_size == 256
+    assert scheduler.claim() == (768, 1023)
+    scheduler.complete(768, 1023, 256)
+    assert scheduler.claim() == (1024, 1279)
+
+
+def test_full_reply_discards_a_short_one():
+    scheduler = RangeScheduler(0, 10_000, page_size=512)
+    scheduler.claim()
+    scheduler.complete(0, 511, 100)  # e.g. trimmed under load
+    scheduler.claim()
+    scheduler.complete(100, 511, 412)
+    assert scheduler.claim() == (512, 1023)
+    scheduler.complete(512, 1023, 512)
+    assert scheduler.short_size is None
+    assert scheduler.claim() == (1024, 1535)
+    scheduler.complete(1024, 1535, 100)
+    assert scheduler.page_size == 512
+
+
+def test_drop_clips_pending_ranges():
+    scheduler = RangeScheduler(0, 0, page_size=50)
+    scheduler.add(0, 99)
+    scheduler.add(100, 199)
+    scheduler.add(200, 299)
+    scheduler.drop(150, 249)
+    assert list(scheduler.pending) == [(0, 99), (100, 149), (250, 299)]
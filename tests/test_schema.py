@@ -0,0 +1,13 @@
+import pickle
+
+import pytest
+
+from schema import LazyClient
+
+
+def test_lazy_client_unpickles_without_connecting():
+    client = pickle.loads(pickle.dumps(LazyClient("certs_test")))
+    assert client.database == "certs_test"
+    assert client._client is None
+    with pytest.raises(AttributeError):
+        client._missing
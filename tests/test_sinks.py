@@ -0,0 +1,175 @@
+import base64
+import json
+
+import pytest
+
+from conftest import FlakyClient
+from sinks import ISSUER_COLUMNS, ClickHouseSink, FanoutSink, KafkaSink, MemoryBroker, Sink
+
+
+def columns(start, count, log_id="log"):
+    indexes = list(range(start, start + count))
+    return {'log_id': [log_id] * count, 'cert_index': indexes, 'issuer_id': [7] * count,
+            'subject_common_name': [f"host{i}.example" for i in indexes]}
+
+
+def kafka_sink(broker, topic="certs", **kwargs):
+    return KafkaSink(None, topic, producer=broker.producer(), key_span=100, **kwargs)
+
+
+def test_kafka_keys_by_index_block():
+    broker = MemoryBroker()
+    sink = kafka_sink(broker)
+    commits = []
+    sink.write(columns(150, 100), 100, issuers=[(7, "US", "Example CA", "Example R1")],
+               on_commit=lambda: commits.append(1))
+    sink.close()
+    assert commits == [1]
+    messages = broker.messages("certs")
+    assert sorted(m.key() for m in messages) == [b"log:1"] * 50 + [b"log:2"] * 50
+    for message in messages:
+        row = json.loads(message.value())
+        assert message.key() == f"log:{row['cert_index'] // 100}".encode()
+        assert row['issuer_organization'] == "Example CA"
+    # one block per partition, in index order
+    for partition in broker.topics["certs"]:
+        indexes = [json.loads(m.value())['cert_index'] for m in partition]
+        assert indexes == sorted(indexes)
+
+
+def test_kafka_commits_only_after_delivery():
+    broker = MemoryBroker()
+    broker.fail = "broker down"
+    sink = kafka_sink(broker)
+    commits = []
+    sink.write(columns(0, 10), 10, on_commit=lambda: commits.append(1))
+    sink.close()
+    assert commits == []
+    assert broker.messages("certs") == []
+
+
+def test_kafka_gives_up_on_full_queue():
+    class FullProducer:
+        def produce(self, *args, **kwargs):
+            raise BufferError("queue full")
+
+        def poll(self, timeout=0):
+            return 0
+
+        def flush(self, timeout=None):
+            return 0
+
+    sink = KafkaSink(None, "certs", producer=FullProducer(), queue_timeout=0.2)
+    commits = []
+    with pytest.raises(BufferError):
+        sink.write(columns(0, 1), 1, on_commit=lambda: commits.append(1))
+    sink.close()
+    assert commits == []
+
+
+def test_kafka_quarantine_topic():
+    broker = MemoryBroker()
+    sink = kafka_sink(broker)
+    sink.quarantine([("log", 250, "bad leaf", b"\x00\x01", b"")])
+    sink.close()
+    [message] = broker.messages("certs.quarantine")
+    record = json.loads(message.value())
+    assert message.key() == b"log:2"
+    assert record["cert_index"] == 250 and record["error"] == "bad leaf"
+    assert base64.b64decode(record["leaf_input"]) == b"\x00\x01"
+    assert broker.messages("certs") == []
+
+
+def test_kafka_quarantine_raises_when_undelivered():
+    broker = MemoryBroker()
+    broker.fail = "broker down"
+    sink = kafka_sink(broker)
+    with pytest.raises(RuntimeError):
+        sink.quarantine([("log", 3, "bad leaf", b"\x00", b"")])
+    sink.close()
+
+
+class HeldSink(Sink):
+    """Commits only when told to, like a sink still waiting for its broker or file."""
+
+    def __init__(self):
+        self.callbacks = []
+        self.failures = []
+
+    def write(self, columns, rows, nbytes=0, issuers=(), on_commit=None):
+        self.callbacks.append(on_commit)
+
+    def quarantine(self, failures):
+        self.failures.extend(failures)
+
+    def commit(self):
+        for callback in self.callbacks:
+            callback()
+        self.callbacks = []
+
+
+def test_fanout_commits_once_every_sink_delivered():
+    held = HeldSink()
+    broker = MemoryBroker()
+    kafka = kafka_sink(broker)
+    fanout = FanoutSink([kafka, held])
+    commits = []
+    fanout.write(columns(0, 10), 10, on_commit=lambda: commits.append(1))
+    kafka.producer.flush()
+    assert len(broker.messages("certs")) == 10
+    assert commits == []
+    held.commit()
+    assert commits == [1]
+    fanout.close()
+
+
+def test_fanout_does_not_commit_when_one_sink_fails():
+    held = HeldSink()
+    broker = MemoryBroker()
+    broker.fail = "broker down"
+    fanout = FanoutSink([kafka_sink(broker), held])
+    commits = []
+    fanout.write(columns(0, 10), 10, on_commit=lambda: commits.append(1))
+    held.commit()
+    fanout.close()
+    assert commits == []
+
+
+def test_fanout_quarantines_to_every_sink():
+    held = HeldSink()
+    broker = MemoryBroker()
+    fanout = FanoutSink([kafka_sink(broker), held])
+    failure = ("log", 3, "bad leaf", b"\x00", b"")
+    fanout.quarantine([failure])
+    fanout.close()
+    assert held.failures == [failure]
+    assert len(broker.messages("certs.quarantine")) == 1
+
+
+def clickhouse_sink(client, **kwargs):
+    return ClickHouseSink(client, FlakyClient(), ['log_id', 'cert_index', 'issuer_id', 'subject_common_name'],
+                          max_age=0.05, retry_delay=0.01, max_retry_delay=0.02, **kwargs)
+
+
+def test_clickhouse_issuers_retried_through_outage():
+    client = FlakyClient(failures=3)
+    sink = clickhouse_sink(client)
+    commits = []
+    issuer = (7, "US", "Example CA", "Example R1")
+    sink.write(columns(0, 2), 2, issuers=[issuer], on_commit=lambda: commits.append(1))
+    sink.close()
+    assert client.attempts == 4
+    assert client.inserts == [('issuers', [issuer], ISSUER_COLUMNS)]
+    assert commits == [1]
+
+
+def test_clickhouse_issuers_not_retried_on_bad_rows():
+    client = FlakyClient(failures=1, error=TypeError("bad issuer row"))
+    sink = clickhouse_sink(client)
+    commits = []
+    with pytest.raises(TypeError):
+        sink.write(columns(0, 2), 2, issuers=[(7, "US", "Example CA", "Example R1")],
+                   on_commit=lambda: commits.append(1))
+    sink.close()
+    assert client.attempts == 1
+    assert commits == []
@@ -0,0 +1,65 @@
+import queue
+import threading
+
+from checkpoint import CheckpointStore
+from spill import SpillBuffer
+from transport import CTLogBatch, pack_entries
+
+LOG = "http://log/"
+
+
+class GatedTransport:
+    """Transport that refuses every batch until `open` is set."""
+
+    def __init__(self):
+        self.open = threading.Event()
+        self.items = queue.Queue()
+
+    def offer(self, batch):
+        if not self.open.is_set():
+            return [batch]
+        self.items.put(batch)
+        return []
+
+    def put(self, batch):
+        self.open.wait()
+        self.items.put(batch)
+
+    def get(self):
+        return self.items.get(timeout=10)
+
+
+def collect(spill):
+    with spill.cond:
+        spill._collect()
+    return spill.spilled_bytes()
+
+
+def test_spilled_batches_replay_and_decode(tmp_path, synthetic_log, consume):
+    inner = GatedTransport()
+    spill = SpillBuffer(inner, str(tmp_path / "spill"), segment_bytes=1 << 20)
+    spill.put(CTLogBatch("log", LOG, 0, pack_entries(synthetic_log.entries(0, 15))))
+    spill.put(CTLogBatch("log", LOG, 16, pack_entries(synthetic_log.entries(16, 31))))
+    assert spill.spilled_bytes() > 0 and inner.items.empty()
+    inner.open.set()
+    _, sink, committed = consume(inner, batches=2)
+    assert [rows for _, rows, _ in sink.writes] == [16, 16]
+    assert sink.writes[1][0]['cert_index'][0] == 16
+    assert committed == 32
+
+
+def test_segment_freed_when_committed_in_pieces_behind_failed_gap(tmp_path, synthetic_log):
+    checkpoint = CheckpointStore(str(tmp_path / "checkpoint.db"))
+    checkpoint.resume(LOG, 0, 1000)
+    checkpoint.mark(LOG, 0, 4, "failed")  # holds the watermark at 0 for the whole test
+    inner = GatedTransport()
+    spill = SpillBuffer(inner, str(tmp_path / "spill"), segment_bytes=1 << 20, is_committed=checkpoint.is_committed)
+    spill.put(CTLogBatch("log", LOG, 5, pack_entries(synthetic_log.entries(5, 14))))
+    inner.open.set()
+    inner.get()  # replayed
+    with spill.cond:
+        spill.cond.wait_for(lambda: not spill.unreplayed, timeout=10)
+    checkpoint.commit(LOG, 5, 9)  # e.g. split across two ring slots
+    assert collect(spill) > 0
+    checkpoint.commit(LOG, 10, 14)
+    assert collect(spill) == 0
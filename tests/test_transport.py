@@ -0,0 +1,32 @@
+from transport import CTLogBatch, QueueTransport, ShmRingTransport, pack_entries, unpack_entries
+
+
+def test_pack_roundtrip(synthetic_log):
+    entries = synthetic_log.entries(0, 9)
+    pairs = unpack_entries(pack_entries(entries))
+    assert len(pairs) == 10
+    assert all(isinstance(leaf, memoryview) for leaf, _ in pairs)
+
+
+def test_shm_ring_batch_decodes(synthetic_log, consume):
+    ring = ShmRingTransport(capacity_bytes=1 << 20, slot_bytes=1 << 18)
+    try:
+        ring.put(CTLogBatch("log", "http://log/", 100, pack_entries(synthetic_log.entries(0, 31))))
+        procs, sink, committed = consume(ring)
+        [(columns, rows, issuers)] = sink.writes
+        assert rows == 32  # memoryview entries must decode, not be dropped
+        assert columns['cert_index'] == list(range(100, 132))
+        assert columns['subject_common_name'][0] == "host0.bench.example"
+        assert not sink.failures
+        assert committed == 32
+        assert ring.free.get(timeout=5) is not None  # the slot went back to the ring
+    finally:
+        ring.close(unlink=True)
+
+
+def test_queue_batch_decodes(synthetic_log, consume):
+    transport = QueueTransport()
+    transport.put(CTLogBatch("log", "http://log/", 0, pack_entries(synthetic_log.entries(0, 7))))
+    _, sink, committed = consume(transport)
+    assert sink.writes[0][1] == 8
+    assert committed == 8
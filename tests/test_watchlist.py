@@ -0,0 +1,105 @@
+import os
+import random
+
+import pytest
+
+from watchlist import Watchlist, WatchlistIndex, _AhoCorasick
+
+
+def tags(index, name):
+    return sorted(tag for _, _, tag in index.match_name(name))
+
+
+def test_pattern_kinds():
+    index = WatchlistIndex([
+        "example.com exact",
+        "*.example.com wildcard",
+        ".example.org suffix",
+        "~paypal keyword",
+    ])
+    assert len(index) == 4
+    assert tags(index, "example.com") == ["exact"]
+    assert tags(index, "www.example.com") == ["wildcard"]
+    assert tags(index, "*.example.com") == ["wildcard"]  # the literal wildcard name, as logged for wildcard certs
+    assert tags(index, "a.b.example.com") == []  # a wildcard covers exactly one label
+    assert tags(index, "example.org") == tags(index, "a.b.example.org") == ["suffix"]
+    assert tags(index, "notexample.org") == []  # labels, not characters
+    assert tags(index, "secure-paypal.example.net") == ["keyword"]
+    assert tags(index, "example.net") == []
+
+
+def test_names_and_patterns_normalized():
+    index = WatchlistIndex(["Example.COM.", "~PayPal", ".Shop.Example.", "*.Mail.Example.Net"])
+    assert tags(index, "EXAMPLE.com.") == ["Example.COM."]
+    assert tags(index, " www.PAYPAL.com ") == ["~PayPal"]
+    assert tags(index, "A.shop.example.") == [".Shop.Example."]
+    assert tags(index, "imap.mail.example.net.") == ["*.Mail.Example.Net"]
+
+
+def test_file_lines():
+    index = WatchlistIndex(["# brand watch", "", "example.com\tbrand  # the main site", "  ~login  "])
+    assert len(index) == 2
+    assert index.match(["example.com", "", "login.example.com"]) == [
+        ("example.com", "example.com", "exact", "brand"),
+        ("login.example.com", "~login", "keyword", "~login"),
+    ]
+    with pytest.raises(ValueError, match="line 2"):
+        WatchlistIndex(["example.com", "*.exa*mple.com"])
+    for pattern in ("*.", ".", "~", "a..com"):
+        with pytest.raises(ValueError):
+            WatchlistIndex([pattern])
+
+
+def test_overlapping_keywords():
+    index = WatchlistIndex(["~pay", "~paypal", "~ypa", "~al", "~palpay"])
+    assert tags(index, "paypal-login.com") == ["~al", "~pay", "~paypal", "~ypa"]
+    # the same rule matching twice in one name is reported once
+    matches = index.match(["paypalpaypal.com"])
+    assert sorted(tag for *_, tag in matches) == ["~al", "~palpay", "~pay", "~paypal", "~ypa"]
+
+
+def test_aho_corasick_matches_every_occurrence():
+    # keywords that are prefixes, suffixes and infixes of each other exercise the failure links
+    keywords = ["he", "she", "his", "hers", "e", "abab", "bab", "aba", "b"]
+    automaton = _AhoCorasick({keyword: [keyword] for keyword in keywords})
+    assert sorted(automaton.search("ushers")) == ["e", "he", "hers", "she"]
+    rng = random.Random(7)
+    for _ in range(200):
+        text = "".join(rng.choice("abehirsu") for _ in range(rng.randrange(30)))
+        expected = sorted(keyword for keyword in keywords for start in range(len(text))
+                          if text.startswith(keyword, start))
+        assert sorted(automaton.search(text)) == expected
+
+
+def write(path, text, mtime_ns):
+    path.write_text(text)
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+def test_hot_reload_on_mtime_change(tmp_path, capsys):
+    path = tmp_path / "watchlist.txt"
+    write(path, "example.com\n", 1_000_000_000_000_000_000)
+    watchlist = Watchlist(str(path), reload_interval=0)
+    assert watchlist.match(["example.com"]) and not watchlist.match(["example.org"])
+    assert not watchlist.maybe_reload()  # unchanged file
+
+    write(path, "example.org\n~bank\n", 1_000_000_001_000_000_000)
+    assert watchlist.maybe_reload()
+    assert len(watchlist) == 2
+    assert not watchlist.match(["example.com"]) and watchlist.match(["example.org", "mybank.net"])
+
+    # a broken file keeps the previous patterns, and is reported once per change
+    write(path, "*.\n", 1_000_000_002_000_000_000)
+    assert not watchlist.maybe_reload()
+    assert not watchlist.maybe_reload()
+    assert watchlist.match(["example.org"])
+    assert capsys.readouterr().out.count("not reloaded") == 1
+
+
+def test_reload_checks_at_most_every_interval(tmp_path):
+    path = tmp_path / "watchlist.txt"
+    write(path, "example.com\n", 1_000_000_000_000_000_000)
+    watchlist = Watchlist(str(path), reload_interval=3600)
+    write(path, "example.org\n", 1_000_000_001_000_000_000)
+    assert not watchlist.maybe_reload()
+    assert watchlist.match(["example.com"])
@@ -0,0 +1,135 @@
+import threading
+import time
+
+import pytest
+
+from conftest import FlakyClient
+from writer import CoalescingWriter, insert_with_retry, is_transient
+
+COLUMNS = ['cert_index', 'san']
+
+
+def rows(start, count):
+    indexes = list(range(start, start + count))
+    return {'cert_index': indexes, 'san': [f"host{i}.example" for i in indexes]}
+
+
+def writer(client, **kwargs):
+    kwargs.setdefault("max_age", 60)
+    return CoalescingWriter(client, 'certs', COLUMNS, retry_delay=0.01, max_retry_delay=0.02, **kwargs)
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline
+        time.sleep(0.005)
+
+
+def inserted(client):
+    return [[row[0] for row in insert_rows] for _, insert_rows, _ in client.inserts]
+
+
+class BlockingClient(FlakyClient):
+    """Holds every insert until `proceed` is set."""
+
+    def __init__(self):
+        super().__init__()
+        self.proceed = threading.Event()
+        self.started = threading.Event()
+
+    def insert(self, *args, **kwargs):
+        self.started.set()
+        self.proceed.wait()
+        super().insert(*args, **kwargs)
+
+
+def test_row_threshold_flushes():
+    client = FlakyClient()
+    w = writer(client, max_rows=10)
+    w.append(rows(0, 6), 6)
+    w.append(rows(6, 6), 6)  # 12 rows: over the threshold, handed over whole
+    w.append(rows(12, 3), 3)
+    wait_for(lambda: client.inserts)
+    assert inserted(client) == [list(range(12))]
+    assert w.rows == 3
+    w.close()
+    assert inserted(client) == [list(range(12)), [12, 13, 14]]
+    assert client.inserts[0][2] == COLUMNS
+
+
+def test_byte_threshold_flushes():
+    client = FlakyClient()
+    w = writer(client, max_bytes=1000)
+    w.append(rows(0, 2), 2, nbytes=600)
+    time.sleep(0.05)
+    assert client.inserts == []
+    w.append(rows(2, 2), 2, nbytes=600)
+    wait_for(lambda: client.inserts)
+    assert inserted(client) == [[0, 1, 2, 3]]
+    w.close()
+
+
+def test_age_threshold_flushes():
+    client = FlakyClient()
+    commits = []
+    w = writer(client, max_age=0.1)
+    w.append(rows(0, 2), 2, on_commit=lambda: commits.append(1))
+    wait_for(lambda: commits, timeout=2.0)
+    assert inserted(client) == [[0, 1]]
+    w.close()
+
+
+def test_double_buffering():
+    client = BlockingClient()
+    w = writer(client, max_rows=2)
+    w.append(rows(0, 2), 2)
+    assert client.started.wait(2.0)  # first buffer in flight
+    w.append(rows(2, 2), 2)  # decoding carries on: the second buffer waits for the writer
+    assert w.rows == 0
+    third = threading.Thread(target=w.append, args=(rows(4, 2), 2))
+    third.start()
+    third.join(0.1)
+    assert third.is_alive()  # two buffers behind: append blocks instead of growing memory
+    client.proceed.set()
+    third.join(2.0)
+    assert not third.is_alive()
+    w.close()
+    assert inserted(client) == [[0, 1], [2, 3], [4, 5]]
+
+
+def test_on_commit_runs_after_insert_in_order():
+    client = FlakyClient()
+    events = []
+    w = writer(client, max_rows=4)
+    for start in range(0, 8, 2):
+        w.append(rows(start, 2), 2, on_commit=lambda start=start: events.append((start, len(client.inserts))))
+    w.append({name: [] for name in COLUMNS}, 0, on_commit=lambda: events.append(("empty", len(client.inserts))))
+    w.close()
+    # each callback runs once the insert holding its rows is done, in append order
+    assert events == [(0, 1), (2, 1), (4, 2), (6, 2), ("empty", 2)]
+
+
+def test_failed_insert_retried_until_it_succeeds(capsys):
+    client = FlakyClient(failures=3)
+    commits = []
+    w = writer(client, max_rows=2)
+    w.append(rows(0, 2), 2, on_commit=lambda: commits.append(len(client.inserts)))
+    w.close()
+    assert client.attempts == 4
+    assert inserted(client) == [[0, 1]]
+    assert commits == [1]  # never before the insert succeeded
+    assert capsys.readouterr().out.count("retrying") == 3
+
+
+def test_insert_with_retry_gives_up_on_permanent_errors():
+    class DataError(Exception):
+        pass  # named like clickhouse_connect's
+
+    assert is_transient(ConnectionError()) and is_transient(OSError()) and is_transient(RuntimeError())
+    assert not is_transient(TypeError()) and not is_transient(DataError())
+    client = FlakyClient(failures=5, error=DataError("cannot convert"))
+    with pytest.raises(DataError):
+        insert_with_retry(client, 'issuers', [(1,)], 1, retry_delay=0.01, transient=is_transient,
+                          column_names=['issuer_id'])
+    assert client.attempts == 1
@@ -0,0 +1,203 @@
+import base64
+import queue
+import struct
+from multiprocessing import Queue, Value
+from multiprocessing import shared_memory
+
+_COUNT = struct.Struct("<I")
+
+
+def _b64decode(data: str) -> bytes:
+    missing_padding = len(data) % 4
+    if missing_padding:
+        data += '=' * (4 - missing_padding)
+    return base64.b64decode(data)
+
+
+def pack_raw(pairs):
+    """Pack `(leaf_input, extra_data)` byte pairs: count, (leaf_len, extra_len) per entry, then the payloads."""
+    raw = [part for pair in pairs for part in pair]
+    lengths = struct.pack(f"<{len(raw)}I", *map(len, raw))
+    return b"".join([_COUNT.pack(len(pairs)), lengths] + raw)
+
+
+def pack_entries(entries):
+    """Pack get-entries JSON dicts as raw bytes; an already packed buffer is returned as is."""
+    if isinstance(entries, (bytes, bytearray, memoryview)):
+        return entries
+    return pack_raw([(_b64decode(e["leaf_input"]), _b64decode(e["extra_data"])) for e in entries])
+
+
+def unpack_entries(buf):
+    """Return `(leaf_input, extra_data)` memoryview pairs over a `pack_entries` buffer, without copying."""
+    view = memoryview(buf)
+    count = _COUNT.unpack_from(view)[0]
+    lengths = struct.unpack_from(f"<{2 * count}I", view, _COUNT.size)
+    offset = _COUNT.size + 8 * count
+    pairs = []
+    for i in range(count):
+        leaf_end = offset + lengths[2 * i]
+        extra_end = leaf_end + lengths[2 * i + 1]
+        pairs.append((view[offset:leaf_end], view[leaf_end:extra_end]))
+        offset = extra_end
+    return pairs
+
+
+def raw_entries(payload):
+    """`(leaf_input, extra_data)` byte pairs for a queue payload: JSON dicts or a packed buffer."""
+    if isinstance(payload, list):
+        return [(_b64decode(e["leaf_input"]), _b64decode(e["extra_data"])) for e in payload]
+    return unpack_entries(payload)
+
+
+class CTLogBatch:
+    """One fetched range of a log on its way from CTlogsStream to CTLogsProcs.
+
+    `payload` holds the entries packed by `pack_entries` (one bytes object
+    instead of two base64 strings and a dict per entry); entry `i` of the batch
+    is leaf `start_index + i` of the log. `slot` is set by transports that lend
+    out their own memory (the shared-memory ring) and is returned on `release`.
+    """
+
+    __slots__ = ("log_id", "log_url", "start_index", "payload", "sth_timestamp", "slot")
+
+    def __init__(self, log_id, log_url, start_index, payload, sth_timestamp=0, slot=None):
+        self.log_id = log_id
+        self.log_url = log_url
+        self.start_index = start_index
+        self.payload = payload
+        self.sth_timestamp = sth_timestamp
+        self.slot = slot
+
+    def __len__(self):
+        if isinstance(self.payload, list):
+            return len(self.payload)
+        return _COUNT.unpack_from(self.payload)[0]
+
+    @property
+    def end_index(self):
+        """Index of the last entry (inclusive, like get-entries)."""
+        return self.start_index + len(self) - 1
+
+    def entries(self):
+        """`(leaf_input, extra_data)` pairs; memoryviews into `payload` when it is packed."""
+        return raw_entries(self.payload)
+
+    def packed(self):
+        """A copy of this batch whose payload is packed."""
+        return CTLogBatch(self.log_id, self.log_url, self.start_index, pack_entries(self.payload), self.sth_timestamp)
+
+
+class QueueTransport:
+    """The original transport: CTLogBatch records pickled through a multiprocessing.Queue.
+
+    `maxsize` (in batches) bounds it; 0 keeps it unbounded. The payload bytes
+    queued are counted in shared memory for `nbytes`.
+    """
+
+    def __init__(self, maxsize=0):
+        self.queue = Queue(maxsize)
+        self.bytes = Value('q', 0)
+
+    def _count(self, batch, sign):
+        if not isinstance(batch.payload, list):
+            with self.bytes.get_lock():
+                self.bytes.value += sign * len(batch.payload)
+
+    def put(self, batch):
+        self.queue.put(batch)
+        self._count(batch, 1)
+
+    def offer(self, batch):
+        """Non-blocking put; returns the batches that did not fit (here all or nothing)."""
+        try:
+            self.queue.put(batch, block=False)
+        except queue.Full:
+            return [batch]
+        self._count(batch, 1)
+        return []
+
+    def get(self):
+        batch = self.queue.get()
+        self._count(batch, -1)
+        return batch
+
+    def release(self, batch):
+        pass
+
+    def qsize(self):
+        return self.queue.qsize()
+
+    def nbytes(self):
+        return self.bytes.value
+
+
+class ShmRingTransport:
+    """Batches of raw entry bytes in a `multiprocessing.shared_memory` ring of fixed-size slots.
+
+    The producer packs a batch straight into a free slot and queues only a small
+    descriptor `(slot, nbytes, log_id, log_url, start_index, sth_timestamp)`;
+    consumers decode from a memoryview over the slot and `release` it afterwards.
+    Capacity is `slots * slot_bytes`: when every slot is taken, `put` blocks, so
+    a slow database stalls the fetchers instead of growing memory. A batch larger
+    than one slot is split across several. `get` returns a CTLogBatch whose
+    payload is a memoryview into its slot.
+    """
+
+    def __init__(self, capacity_bytes=256 * 1024 * 1024, slot_bytes=4 * 1024 * 1024):
+        self.slot_bytes = slot_bytes
+        self.slots = max(1, capacity_bytes // slot_bytes)
+        self.shm = shared_memory.SharedMemory(create=True, size=self.slots * slot_bytes)
+        self.free = Queue()
+        self.descriptors = Queue()
+        for slot in range(self.slots):
+            self.free.put(slot)
+
+    def put(self, batch):
+        self._place(batch, block=True)
+
+    def offer(self, batch):
+        """Non-blocking put; returns the (possibly split) parts of `batch` that found no free slot."""
+        return self._place(batch, block=False)
+
+    def _place(self, batch, block):
+        packed = pack_entries(batch.payload)
+        if len(packed) > self.slot_bytes:
+            pairs = raw_entries(packed)
+            if len(pairs) == 1:
+                raise ValueError(f"entry {batch.start_index} of {batch.log_url} is larger than a {self.slot_bytes}-byte slot")
+            half = len(pairs) // 2
+            first = CTLogBatch(batch.log_id, batch.log_url, batch.start_index, pack_raw(pairs[:half]), batch.sth_timestamp)
+            second = CTLogBatch(batch.log_id, batch.log_url, batch.start_index + half, pack_raw(pairs[half:]),
+                                batch.sth_timestamp)
+            rest = self._place(first, block)
+            return rest + [second] if rest else self._place(second, block)
+        try:
+            slot = self.free.get(block)  # blocks while the ring is full
+        except queue.Empty:
+            return [batch]
+        offset = slot * self.slot_bytes
+        self.shm.buf[offset:offset + len(packed)] = packed
+        self.descriptors.put((slot, len(packed), batch.log_id, batch.log_url, batch.start_index, batch.sth_timestamp))
+        return []
+
+    def get(self):
+        slot, nbytes, log_id, log_url, start_index, sth_timestamp = self.descriptors.get()
+        offset = slot * self.slot_bytes
+        return CTLogBatch(log_id, log_url, start_index, self.shm.buf[offset:offset + nbytes], sth_timestamp, slot)
+
+    def release(self, batch):
+        """Return the slot of a `get` result to the ring once nothing references its payload anymore."""
+        batch.payload.release()
+        self.free.put(batch.slot)
+
+    def qsize(self):
+        return self.descriptors.qsize()
+
+    def nbytes(self):
+        return (self.slots - self.free.qsize()) * self.slot_bytes
+
+    def close(self, unlink=False):
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
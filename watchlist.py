@@ -0,0 +1,353 @@
+import json
+import os
+import queue
+import sys
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+# Pattern syntax, one per line, optionally followed by a tag naming the rule in alerts:
+#   example.com     exact name
+#   *.example.com   exactly one label below example.com (also the literal wildcard name *.example.com)
+#   .example.com    example.com and every name below it, at any depth
+#   ~paypal         keyword anywhere in the name
+
+
+def normalize(name):
+    return name.strip().lower().rstrip(".")
+
+
+class _Node:
+    __slots__ = ("children", "exact", "wildcard", "suffix")
+
+    def __init__(self):
+        self.children = {}
+        self.exact = []
+        self.wildcard = []
+        self.suffix = []
+
+
+class _AhoCorasick:
+    """Keyword automaton: every keyword occurring in a string is found in one pass over it."""
+
+    def __init__(self, keywords):
+        self.goto = [{}]
+        self.fail = [0]
+        self.out = [[]]
+        for keyword, rules in keywords.items():
+            state = 0
+            for ch in keyword:
+                nxt = self.goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(self.goto)
+                    self.goto[state][ch] = nxt
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.out.append([])
+                state = nxt
+            self.out[state].extend(rules)
+        # breadth first, so the failure target of a state is always finished before the state itself
+        pending = deque(self.goto[0].values())
+        while pending:
+            state = pending.popleft()
+            for ch, nxt in self.goto[state].items():
+                pending.append(nxt)
+                fail = self.fail[state]
+                while fail and ch not in self.goto[fail]:
+                    fail = self.fail[fail]
+                self.fail[nxt] = self.goto[fail].get(ch, 0)
+                self.out[nxt] = self.out[nxt] + self.out[self.fail[nxt]]
+
+    def search(self, text):
+        goto, fail, out = self.goto, self.fail, self.out
+        found = []
+        state = 0
+        for ch in text:
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if out[state]:
+                found.extend(out[state])
+        return found
+
+
+def parse_pattern(pattern):
+    """`(kind, key)` for one pattern: the name's labels (`.`-joined) or the keyword."""
+    pattern = normalize(pattern)
+    if pattern.startswith("~"):
+        kind, key = "keyword", pattern[1:]
+    elif pattern.startswith("*."):
+        kind, key = "wildcard", pattern[2:]
+    elif pattern.startswith("."):
+        kind, key = "suffix", pattern[1:]
+    else:
+        kind, key = "exact", pattern
+    if not key or (kind != "keyword" and ("*" in key or "" in key.split("."))):
+        raise ValueError(f"invalid watchlist pattern {pattern!r}")
+    return kind, key
+
+
+class WatchlistIndex:
+    """Exact, wildcard and suffix patterns in one reversed-label trie, keywords in one Aho-Corasick automaton.
+
+    Checking a name walks the trie once from its last label and scans its
+    characters once, however many patterns there are. `lines` are watchlist
+    file lines: `pattern [tag]`, blank lines and `#` comments are skipped.
+    """
+
+    def __init__(self, lines):
+        self.root = _Node()
+        keywords = {}
+        self.size = 0
+        for number, line in enumerate(lines, 1):
+            line = line.split("#", 1)[0].strip()
+            if not line:
+                continue
+            pattern, _, tag = line.replace("\t", " ").partition(" ")
+            try:
+                kind, key = parse_pattern(pattern)
+            except ValueError as exc:
+                raise ValueError(f"line {number}: {exc}") from None
+            rule = (pattern, kind, tag.strip() or pattern)
+            if kind == "keyword":
+                keywords.setdefault(key, []).append(rule)
+            else:
+                node = self.root
+                for label in reversed(key.split(".")):
+                    node = node.children.setdefault(label, _Node())
+                getattr(node, kind).append(rule)
+            self.size += 1
+        self.keywords = _AhoCorasick(keywords) if keywords else None
+
+    def __len__(self):
+        return self.size
+
+    def match_name(self, name):
+        """Rules `(pattern, kind, tag)` matching one name."""
+        name = normalize(name)
+        labels = name.split(".")
+        remaining = len(labels)
+        node = self.root
+        found = []
+        for label in reversed(labels):
+            node = node.children.get(label)
+            if node is None:
+                break
+            remaining -= 1
+            found.extend(node.suffix)
+            if remaining == 0:
+                found.extend(node.exact)
+            elif remaining == 1:
+                found.extend(node.wildcard)
+        if self.keywords:
+            found.extend(self.keywords.search(name))
+        return found
+
+    def match(self, names):
+        """`(name, pattern, kind, tag)` for every rule matching any of `names`, each rule once per name."""
+        matches = []
+        for name in names:
+            if not name:
+                continue
+            seen = set()
+            for rule in self.match_name(name):
+                if rule not in seen:
+                    seen.add(rule)
+                    matches.append((name,) + rule)
+        return matches
+
+
+def certificate_names(cert):
+    """Subject CN plus the SAN DNS names of a `fields.CertView`."""
+    return [cert.common_name] + cert.san
+
+
+class Watchlist:
+    """A watchlist file compiled into a `WatchlistIndex`, recompiled when the file changes.
+
+    `maybe_reload` costs one `stat` every `reload_interval` seconds; when the
+    modification time moved, the file is compiled into a new index that then
+    replaces the old one. A file that fails to read or parse keeps the
+    previous index, so a typo never stops matching.
+    """
+
+    def __init__(self, path, reload_interval=5.0):
+        self.path = path
+        self.reload_interval = reload_interval
+        self.mtime = None
+        self.checked = time.monotonic()
+        self.index = self._load()
+
+    def _load(self):
+        self.mtime = os.stat(self.path).st_mtime_ns
+        with open(self.path) as f:
+            return WatchlistIndex(f)
+
+    def __len__(self):
+        return len(self.index)
+
+    def maybe_reload(self):
+        """Recompile if the file changed; returns True when a new index is in use."""
+        now = time.monotonic()
+        if now - self.checked < self.reload_interval:
+            return False
+        self.checked = now
+        try:
+            if os.stat(self.path).st_mtime_ns == self.mtime:
+                return False
+            index = self._load()  # records the new mtime first, so a broken file is reported once per change
+        except (OSError, ValueError) as exc:
+            print(f"Watchlist {self.path} not reloaded, keeping {len(self.index)} patterns: {exc}")
+            return False
+        self.index = index
+        print(f"Watchlist {self.path} reloaded: {len(self.index)} patterns")
+        return True
+
+    def match(self, names):
+        return self.index.match(names)
+
+
+def make_alert(log_id, cert, match):
+    """Alert for one `match` on `cert`, a `fields.CertView`; only the fields it shows are extracted."""
+    name, pattern, kind, tag = match
+    not_after = cert.value("not_after")
+    return {
+        "detected_at": time.time(),
+        "log_id": log_id,
+        "cert_index": cert.cert_index,
+        "name": name,
+        "pattern": pattern,
+        "kind": kind,
+        "tag": tag,
+        "subject_common_name": cert.common_name,
+        "sha1_fingerprint": cert.value("sha1_fingerprint"),
+        "issuer_organization": cert.issuer[2],
+        "not_after": int(not_after.timestamp()) if isinstance(not_after, datetime) else not_after,
+    }
+
+
+class AlertSink:
+    """Destination for watchlist alerts; `send` is called once per batch and must not wait on the network."""
+
+    def send(self, alerts):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class JsonlAlertSink(AlertSink):
+    """One JSON line per alert, appended to `path` (`-` for stdout) as soon as it is found.
+
+    Every line is a single `O_APPEND` write, so several consumers can share the file.
+    """
+
+    def __init__(self, path="-"):
+        self.fd = 1 if path == "-" else os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        self.owned = path != "-"
+
+    def send(self, alerts):
+        for alert in alerts:
+            os.write(self.fd, (json.dumps(alert) + "\n").encode())
+
+    def close(self):
+        if self.owned:
+            os.close(self.fd)
+
+
+class WebhookAlertSink(AlertSink):
+    """POSTs alerts as a JSON list to `url` from a background thread, so decoding never waits on the endpoint.
+
+    Alerts queued while a request is in flight go out together in the next
+    one; a request is retried `retries` times with backoff before its alerts
+    are dropped (and printed).
+    """
+
+    def __init__(self, url, timeout=5.0, retries=3):
+        import requests
+        self.url = url
+        self.timeout = timeout
+        self.retries = retries
+        self.session = requests.Session()
+        self.pending = queue.Queue()
+        self.thread = threading.Thread(target=self._run, name="alert-webhook", daemon=True)
+        self.thread.start()
+
+    def send(self, alerts):
+        if alerts:
+            self.pending.put(alerts)
+
+    def _run(self):
+        while True:
+            alerts = self.pending.get()
+            if alerts is None:
+                return
+            stopping = False
+            while not stopping:
+                try:
+                    more = self.pending.get_nowait()
+                except queue.Empty:
+                    break
+                if more is None:
+                    stopping = True
+                else:
+                    alerts = alerts + more
+            self._post(alerts)
+            if stopping:
+                return
+
+    def _post(self, alerts):
+        for attempt in range(self.retries + 1):
+            try:
+                response = self.session.post(self.url, json=alerts, timeout=self.timeout)
+                if response.status_code < 300:
+                    return
+                error = f"HTTP {response.status_code}"
+            except Exception as exc:
+                error = exc
+            time.sleep(min(2 ** attempt * 0.1, 2))
+        print(f"Dropped {len(alerts)} watchlist alerts after {self.retries + 1} attempts to {self.url}: {error}")
+        for alert in alerts:
+            print(json.dumps(alert), file=sys.stderr)
+
+    def close(self):
+        self.pending.put(None)
+        self.thread.join()
+
+
+class KafkaAlertSink(AlertSink):
+    """Produces each alert to `topic` without lingering, keyed by the matched name."""
+
+    def __init__(self, broker, topic, producer=None):
+        if producer is None:
+            from confluent_kafka import Producer
+            producer = Producer({'bootstrap.servers': broker, 'linger.ms': 0, 'acks': 'all'})
+        self.producer = producer
+        self.topic = topic
+
+    def send(self, alerts):
+        for alert in alerts:
+            self.producer.produce(self.topic, value=json.dumps(alert).encode(), key=alert["name"].encode())
+        self.producer.poll(0)
+
+    def close(self):
+        self.producer.flush()
+
+
+def make_alert_sink(spec):
+    """`-` (stdout), a file path, `http(s)://...` (webhook) or `kafka://broker/topic`."""
+    if spec.startswith(("http://", "https://")):
+        return WebhookAlertSink(spec)
+    if spec.startswith("kafka://"):
+        broker, _, topic = spec[len("kafka://"):].partition("/")
+        return KafkaAlertSink(broker, topic or "ctlogs.alerts")
+    return JsonlAlertSink(spec)
+
+
+if __name__ == "__main__":
+    # python watchlist.py watchlist.txt name [name ...]: show which rules match
+    index = Watchlist(sys.argv[1]).index
+    print(f"{len(index)} patterns")
+    for match in index.match(sys.argv[2:]):
+        print("\t".join(match))
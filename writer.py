@@ -0,0 +1,139 @@
+import queue
+import threading
+import time
+
+_STOP = object()
+
+# clickhouse_connect errors raised for the request itself (bad data, unsupported types, wrong column names),
+# matched by name so this module does not import the client
+_PERMANENT_ERRORS = {"DataError", "ProgrammingError", "NotSupportedError"}
+
+
+def is_transient(exc):
+    """Whether retrying an insert that raised `exc` can succeed: connection and server errors can, bad rows can't."""
+    if isinstance(exc, (TypeError, ValueError, KeyError, AttributeError)):
+        return False
+    return not any(cls.__name__ in _PERMANENT_ERRORS for cls in type(exc).__mro__)
+
+
+def insert_with_retry(db_client, table, data, rows, retry_delay=1, max_retry_delay=30, transient=None, **kwargs):
+    """`db_client.insert(table, data, **kwargs)`, retried with exponential backoff until it succeeds.
+
+    Blocks the caller for as long as the database is unavailable. Errors for
+    which `transient(exc)` is false are raised instead of retried; without
+    `transient` every error is retried.
+    """
+    delay = retry_delay
+    while True:
+        try:
+            return db_client.insert(table, data, **kwargs)
+        except Exception as e:
+            if transient is not None and not transient(e):
+                raise
+            print(f"Insert of {rows} rows into {table} failed, retrying in {delay}s: {e}")
+            time.sleep(delay)
+            delay = min(max_retry_delay, delay * 2)
+
+
+class CoalescingWriter:
+    """Coalesce decoded rows into column buffers and insert them from a background thread.
+
+    Rows from many queue items accumulate in one set of column lists until
+    `max_rows`, `max_bytes` or `max_age` seconds is reached; the full buffer is
+    then swapped for an empty one and handed to the writer thread, so decoding
+    continues while the insert is in flight (double buffering). When the writer
+    falls behind by more than one buffer, `append` blocks, which throttles the
+    decoder instead of growing memory.
+
+    Callbacks passed to `append` run on the writer thread once the buffer that
+    holds those rows has been inserted; failed inserts are retried with
+    backoff, never dropped.
+    """
+
+    def __init__(self, db_client, table, column_names, max_rows=100_000, max_bytes=64 * 1024 * 1024, max_age=5.0,
+                 async_insert=False, retry_delay=1, max_retry_delay=30, metrics=None):
+        self.db_client = db_client
+        self.table = table
+        self.column_names = list(column_names)
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.metrics = metrics  # optional metrics.MetricsRegistry
+        # server-side batching on top of ours; waiting keeps "inserted" meaning durable for the callbacks
+        self.settings = {"async_insert": 1, "wait_for_async_insert": 1} if async_insert else None
+
+        self.lock = threading.Lock()
+        self._reset()
+        self.ready = queue.Queue(maxsize=1)
+        self.thread = threading.Thread(target=self._run, name=f"writer-{table}", daemon=True)
+        self.thread.start()
+
+    def _reset(self):
+        self.columns = {name: [] for name in self.column_names}
+        self.callbacks = []
+        self.rows = 0
+        self.nbytes = 0
+        self.first_at = None
+
+    def _swap(self):
+        buffer = (self.columns, self.callbacks, self.rows)
+        self._reset()
+        return buffer
+
+    def append(self, columns, rows, nbytes=0, on_commit=None):
+        """Add `rows` rows given as `{column: values}`; `on_commit()` runs after they are inserted."""
+        with self.lock:
+            for name, values in columns.items():
+                self.columns[name].extend(values)
+            self.rows += rows
+            self.nbytes += nbytes
+            if self.first_at is None:
+                self.first_at = time.time()
+            if on_commit:
+                self.callbacks.append(on_commit)
+            full = self.rows >= self.max_rows or self.nbytes >= self.max_bytes
+            buffer = self._swap() if full else None
+        if buffer:
+            self.ready.put(buffer)
+
+    def flush(self):
+        """Hand the current buffer to the writer thread, whatever its size."""
+        with self.lock:
+            buffer = self._swap() if self.rows or self.callbacks else None
+        if buffer:
+            self.ready.put(buffer)
+
+    def close(self):
+        self.flush()
+        self.ready.put(_STOP)
+        self.thread.join()
+
+    def _run(self):
+        while True:
+            try:
+                buffer = self.ready.get(timeout=min(self.max_age, 0.5))
+            except queue.Empty:
+                with self.lock:
+                    stale = self.first_at is not None and time.time() - self.first_at >= self.max_age
+                    buffer = self._swap() if stale else None
+                if buffer is None:
+                    continue
+            if buffer is _STOP:
+                break
+            self._insert(*buffer)
+
+    def _insert(self, columns, callbacks, rows):
+        if rows:
+            insert_start = time.time()
+            insert_with_retry(
+                self.db_client, self.table, [columns[name] for name in self.column_names], rows,
+                retry_delay=self.retry_delay, max_retry_delay=self.max_retry_delay,
+                column_names=self.column_names, column_oriented=True, settings=self.settings
+            )
+            if self.metrics:
+                self.metrics.observe("ctlog_insert_seconds", time.time() - insert_start, table=self.table)
+                self.metrics.observe("ctlog_insert_rows", rows, table=self.table)
+        for callback in callbacks:
+            callback()